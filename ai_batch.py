@@ -0,0 +1,208 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from note_stats import content_hash
+from note_store import NoteConflict
+
+# Rough token estimate used for packing (about 4 characters per token)
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 6000
+DEFAULT_CONCURRENCY = 2
+MAX_RETRIES = 5
+BASE_BACKOFF = 2.0  # seconds, doubled per retry
+
+TASKS = {
+    "tags": {
+        "field": "ai_tags",
+        "prompt": ("Suggest up to 5 relevant single-word hashtags (without the #) for each note below. "
+                   "Reply with only a JSON object mapping each note id to a list of tags."),
+    },
+    "summarize": {
+        "field": "ai_summary",
+        "prompt": ("Write a concise one or two sentence summary of each note below. "
+                   "Reply with only a JSON object mapping each note id to its summary."),
+    },
+}
+
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def source_field(task):
+    # Records which content a stored result was computed from, so unchanged
+    # notes are skipped when a run is repeated or resumed
+    return TASKS[task]["field"] + "_hash"
+
+
+def needs_processing(note, task):
+    return note.get(source_field(task)) != (note.get('content_hash') or content_hash(note.get('content', '')))
+
+
+def pack(notes, token_budget=DEFAULT_TOKEN_BUDGET):
+    # Greedily packs notes into batches whose estimated prompt size stays
+    # within the budget; an oversized note is truncated to fit on its own
+    max_chars = token_budget * CHARS_PER_TOKEN
+    per_note_chars = max_chars // 2
+    batches, batch, used = [], [], 0
+    for note in notes:
+        text = f"{note.get('title', '')}\n{note.get('content', '')}"[:per_note_chars]
+        size = len(text) + 40  # id and separators
+        if batch and used + size > max_chars:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append((note['id'], text))
+        used += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_prompt(task, batch):
+    parts = [TASKS[task]["prompt"], ""]
+    for note_id, text in batch:
+        parts.append(f"=== note id: {note_id} ===\n{text}\n")
+    return "\n".join(parts)
+
+
+def parse_response(task, text, ids):
+    match = _JSON_RE.search(text or "")
+    if not match:
+        raise ValueError("model reply contained no JSON object")
+    data = json.loads(match.group(0))
+    results = {}
+    for note_id in ids:
+        value = data.get(note_id)
+        if value is None:
+            continue
+        if task == "tags":
+            if isinstance(value, str):
+                value = re.findall(r'\w+', value)
+            value = [str(tag).lstrip('#') for tag in value][:5]
+        else:
+            value = str(value).strip()
+        results[note_id] = value
+    return results
+
+
+def is_rate_limited(error):
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "resourceexhausted" in text or "rate limit" in text or "quota" in text
+
+
+class BulkJob:
+    # Progress of one bulk run. Pending ids are checkpointed to disk after
+    # every batch, so an interrupted run can be resumed from the same file.
+
+    def __init__(self, task, note_ids, checkpoint_path):
+        self.task = task
+        self.pending = list(note_ids)
+        self.total = len(self.pending)
+        self.done = 0
+        self.failed = []
+        self.status = 'running'
+        self.error = None
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def resume(cls, checkpoint_path):
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        job = cls(state['task'], state['pending'], checkpoint_path)
+        job.total = state['total']
+        job.done = state['done']
+        job.failed = state.get('failed', [])
+        return job
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _finish_batch(self, ids, ok):
+        with self._lock:
+            finished = set(ids)
+            self.pending = [i for i in self.pending if i not in finished]
+            if ok:
+                self.done += len(ids)
+            else:
+                self.failed.extend(ids)
+            self._checkpoint()
+
+    def _checkpoint(self):
+        state = {"task": self.task, "pending": self.pending, "total": self.total,
+                 "done": self.done, "failed": self.failed}
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def run_bulk(store, model, job, token_budget=DEFAULT_TOKEN_BUDGET, concurrency=DEFAULT_CONCURRENCY):
+    # Runs `job` to completion on the calling thread, `concurrency` model
+    # requests at a time. Results are written back one store batch per request.
+    field = TASKS[job.task]["field"]
+    job._checkpoint()
+    notes = [store.notes[i] for i in job.pending if i in store.notes]
+    todo = [note for note in notes if needs_processing(note, job.task)]
+    skipped = {note['id'] for note in notes} - {note['id'] for note in todo}
+    missing = [i for i in job.pending if i not in store.notes]
+    if skipped or missing:
+        job._finish_batch(list(skipped) + missing, ok=True)
+
+    def process(batch):
+        if job._cancelled.is_set():
+            return
+        ids = [note_id for note_id, _ in batch]
+        prompt = build_prompt(job.task, batch)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                results = parse_response(job.task, model.generate_content(prompt).text, ids)
+                break
+            except Exception as e:
+                if attempt == MAX_RETRIES or job._cancelled.is_set() or not is_rate_limited(e):
+                    job.error = str(e)
+                    job._finish_batch(ids, ok=False)
+                    return
+                time.sleep(BASE_BACKOFF * 2 ** attempt * (0.5 + random.random()))
+
+        try:
+            with store.batch():
+                for note_id, value in results.items():
+                    note = store.notes.get(note_id)
+                    if note is None:
+                        continue
+                    updated = dict(note)
+                    updated[field] = value
+                    updated[source_field(job.task)] = note.get('content_hash') or content_hash(note.get('content', ''))
+                    store.put(updated, base=note)
+        except NoteConflict:
+            pass  # a note was edited meanwhile; it is picked up again next run
+        job._finish_batch(ids, ok=True)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(process, pack(todo, token_budget)))
+
+    if job._cancelled.is_set():
+        job.status = 'cancelled'
+    else:
+        job.status = 'done'
+        if os.path.exists(job.checkpoint_path):
+            os.remove(job.checkpoint_path)
+
+
+def start_bulk(store, model, job, **kwargs):
+    thread = threading.Thread(target=_run_safely, args=(store, model, job), kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_safely(store, model, job, **kwargs):
+    try:
+        run_bulk(store, model, job, **kwargs)
+    except Exception as e:
+        job.status = 'error'
+        job.error = str(e)
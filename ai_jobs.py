@@ -0,0 +1,211 @@
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+
+class BackgroundMemo:
+    # Remembers the last value computed for each slot together with the
+    # fingerprint of its inputs. A lookup never blocks: if the fingerprint
+    # changed, the old value is returned as stale while a worker recomputes.
+    # A computation that raises is not retried for the same fingerprint until
+    # retry() is called; failure() returns its exception meanwhile.
+
+    def __init__(self, executor=None):
+        self.executor = executor or ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        # Re-entrant: a future that is already done runs its callback inline
+        self._lock = threading.RLock()
+        self._values = {}    # slot -> (fingerprint, value)
+        self._inflight = {}  # slot -> (fingerprint, future)
+        self._failed = {}    # slot -> (fingerprint, exception)
+
+    def get(self, slot, fingerprint, compute):
+        # Returns (value, stale, refreshing); value is None until the first
+        # computation for the slot has finished
+        with self._lock:
+            cached = self._values.get(slot)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1], False, False
+
+            value = cached[1] if cached is not None else None
+            if self.failure(slot, fingerprint) is not None:
+                return value, cached is not None, False
+
+            inflight = self._inflight.get(slot)
+            if inflight is None or inflight[0] != fingerprint:
+                future = self.executor.submit(compute)
+                self._inflight[slot] = (fingerprint, future)
+                future.add_done_callback(lambda f: self._finished(slot, fingerprint, f))
+            return value, True, True
+
+    def failure(self, slot, fingerprint):
+        # The exception the computation for `fingerprint` raised, if it failed
+        with self._lock:
+            failed = self._failed.get(slot)
+            return failed[1] if failed is not None and failed[0] == fingerprint else None
+
+    def retry(self, slot):
+        # Lets the next get() for the slot compute again after a failure
+        with self._lock:
+            self._failed.pop(slot, None)
+
+    def _finished(self, slot, fingerprint, future):
+        with self._lock:
+            if self._inflight.get(slot, (None,))[0] == fingerprint:
+                del self._inflight[slot]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._failed[slot] = (fingerprint, future.exception())
+                return
+            self._failed.pop(slot, None)
+            self._values[slot] = (fingerprint, future.result())
+
+
+# --- Streaming suggestion jobs ---
+
+DEFAULT_TIMEOUT = 90  # seconds
+MAX_FINISHED_JOBS = 200
+
+
+class AIJob:
+    # One model request. `text` grows as chunks stream in; status moves from
+    # 'running' to 'done', 'error', 'cancelled' or 'timeout'.
+
+    def __init__(self, key, timeout=DEFAULT_TIMEOUT):
+        self.key = key
+        self.text = ""
+        self.status = 'running'
+        self.error = None
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self._cancelled = threading.Event()
+
+    @property
+    def running(self):
+        if self.status == 'running' and time.monotonic() > self.deadline:
+            # The worker may be stuck in a blocking call; give up on it
+            self.status = 'timeout'
+        return self.status == 'running'
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.status == 'running':
+            self.status = 'cancelled'
+
+
+class JobRunner:
+    # Runs streaming model requests on a thread pool so several can be in
+    # flight at once. Requests are keyed (model, kind, content hash); asking
+    # for a key that is already running or finished returns the same job.
+
+    def __init__(self, max_workers=MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def completed(self, key, text):
+        # Registers an already-known result (e.g. a cache hit) as a done job
+        job = AIJob(key, self.timeout)
+        job.text = text
+        job.status = 'done'
+        with self._lock:
+            self._jobs[key] = job
+            self._prune()
+        return job
+
+    def submit(self, key, stream, on_done=None):
+        # `stream()` yields text chunks; `on_done(text)` runs after a full,
+        # successful response. Failed or cancelled jobs are replaced on resubmit.
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and (job.running or job.status == 'done'):
+                return job
+            job = self._jobs[key] = AIJob(key, self.timeout)
+            self._prune()
+        self.executor.submit(self._run, job, stream, on_done)
+        return job
+
+    def _run(self, job, stream, on_done):
+        try:
+            for chunk in stream():
+                if job._cancelled.is_set() or not job.running:
+                    return
+                job.text += chunk
+            if job.running:
+                job.status = 'done'
+                if on_done is not None:
+                    on_done(job.text)
+        except Exception as e:
+            if job.status == 'running':
+                job.status = 'error'
+                job.error = str(e)
+
+    def _prune(self):
+        finished = [key for key, job in self._jobs.items() if job.status != 'running']
+        for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[key]
+
+
+class LazyGeminiModel:
+    # Gemini GenerativeModel that imports the SDK and builds the client on
+    # the first request, so reruns that never call the model don't pay for it
+    def __init__(self, api_key, name):
+        self.api_key = api_key
+        self.model_name = name if name.startswith("models/") else f"models/{name}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def generate_content(self, *args, **kwargs):
+        return self._client().generate_content(*args, **kwargs)
+
+
+class FakeModel:
+    # Offline stand-in for a Gemini GenerativeModel: echoes a canned reply
+    # word by word, with an optional per-chunk delay to mimic streaming
+    model_name = "fake-model"
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+
+    def _reply(self, prompt):
+        # Bulk prompts list several notes and expect a JSON object keyed by id
+        ids = re.findall(r'=== note id: (\S+) ===', prompt)
+        if ids:
+            return json.dumps({note_id: ["offline", "reply"] if "hashtags" in prompt else "(offline summary)"
+                               for note_id in ids})
+        first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+        return f"(offline reply) {first_line}"
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = self._reply(prompt)
+        if not stream:
+            time.sleep(self.delay)
+            return _FakeResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        for word in text.split(' '):
+            time.sleep(self.delay)
+            yield _FakeResponse(word + ' ')
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
@@ -5,13 +5,21 @@ from datetime import datetime
 import re
 import hashlib
 import base64
+import difflib
 from io import BytesIO
-import markdown
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-import google.generativeai as genai
+from ids import new_id
+from note_store import DEFAULT_SETTINGS, NoteConflict, NoteStore
+from sqlite_store import SqliteStore, migrate_json
+from search_index import NoteOrder, SearchIndex, TagIndex, make_snippet, tokenize
+from ai_cache import ResponseCache, cache_key, default_cache_path
+from ai_batch import TASKS as BULK_TASKS, BulkJob, start_bulk
+from ai_jobs import DEFAULT_TIMEOUT, BackgroundMemo, FakeModel, JobRunner, LazyGeminiModel
+from render import MarkdownRenderer
+from importer import import_notes
+from export import FORMATS as EXPORT_FORMATS, export_filename, export_notes, write_pdf
+from note_stats import NoteStats, annotate, extract_tags, needs_annotation, reading_time, word_count
+from history import NoteHistory
+from drafts import DraftJournal
 
 # Configure Streamlit page
 st.set_page_config(
@@ -77,68 +85,144 @@ if not st.session_state.app_authenticated:
     st.stop()
 # --- END: INITIAL APP PASSWORD PROTECTION ---
 
-# Database file
+# Database file. DRIFTNOTES_BACKEND=sqlite keeps notes in SQLite instead
+# (migrated from the JSON file on first start)
 DB_FILE = "noirnotes_db.json"
+SQLITE_FILE = os.path.splitext(DB_FILE)[0] + ".sqlite"
+STORAGE_BACKEND = os.environ.get("DRIFTNOTES_BACKEND", "json")
+# Format the JSON backend writes its snapshot in: json, msgpack, json+zstd,
+# msgpack+zstd, ... (see serialization.py). Any format is read back.
+SNAPSHOT_FORMAT = os.environ.get("DRIFTNOTES_SNAPSHOT_FORMAT", "json")
+
+# Initialize Gemini AI. One client per process and key; the SDK itself is
+# only imported when the first request is made
+@st.cache_resource
+def get_gemini_model(api_key):
+    return LazyGeminiModel(api_key, 'gemma-3-27b-it')
 
-# Initialize Gemini AI
 def init_gemini():
+    # DRIFTNOTES_FAKE_AI=1 swaps in an offline model for local testing
+    if os.environ.get("DRIFTNOTES_FAKE_AI"):
+        return FakeModel()
     try:
         api_key = st.secrets.get("GEMINI_API_KEY")
         if api_key:
-            genai.configure(api_key=api_key)
-            return genai.GenerativeModel('gemma-3-27b-it')
+            return get_gemini_model(api_key)
         return None
     except:
         return None
 
 def create_pdf(note):
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        textColor=colors.black
-    )
-    story.append(Paragraph(note['title'], title_style))
-    story.append(Spacer(1, 12))
-    
-    # Content
-    content_style = ParagraphStyle(
-        'CustomContent',
-        parent=styles['Normal'],
-        fontSize=11,
-        spaceAfter=12,
-        textColor=colors.black
-    )
-    
-    # Convert markdown to HTML then to PDF-compatible format
-    html_content = markdown.markdown(note['content'])
-    story.append(Paragraph(html_content, content_style))
-    
-    doc.build(story)
+    write_pdf([note], buffer, renderer=get_renderer())
     buffer.seek(0)
     return buffer
 
-# Initialize database
-def init_db():
-    if not os.path.exists(DB_FILE):
-        with open(DB_FILE, 'w') as f:
-            json.dump({"notes": [], "settings": {"theme": "nebula", "locked": False, "ai_enabled": True}}, f)
+# Markdown rendering is cached per block and shared by the editor preview,
+# the dashboard and exports (big exports render their misses in pool workers
+# and add the results to this cache)
+@st.cache_resource
+def get_renderer():
+    return MarkdownRenderer()
+
+# Embeddings for semantic search and related notes: a local hashing embedder
+# by default, or Gemini embeddings with DRIFTNOTES_EMBEDDER = "gemini" in secrets.
+# embeddings.py pulls in numpy, so it is imported with the store, not at startup.
+def make_embedder():
+    from embeddings import GeminiEmbedder, HashingEmbedder
+    try:
+        if st.secrets.get("DRIFTNOTES_EMBEDDER") == "gemini" and st.secrets.get("GEMINI_API_KEY"):
+            return GeminiEmbedder(api_key=st.secrets["GEMINI_API_KEY"])
+    except Exception:
+        pass
+    return HashingEmbedder()
+
+# Database: an append-only note store, see note_store.py. One store is shared
+# by every session and rerun in the process; all writes go through it.
+@st.cache_resource
+def get_store():
+    if STORAGE_BACKEND == "sqlite":
+        if not os.path.exists(SQLITE_FILE) and os.path.exists(DB_FILE):
+            migrate_json(DB_FILE, SQLITE_FILE)
+        store = SqliteStore(SQLITE_FILE)
+    else:
+        store = NoteStore(DB_FILE, snapshot_format=SNAPSHOT_FORMAT)
+    # One-time re-keying of old 8-character ids, before indexes are built
+    store.migrate_ids()
+    if STORAGE_BACKEND != "sqlite":
+        # SQLite answers search, tag and order queries itself
+        store.attach('search', SearchIndex(lookup=store.get))
+        store.attach('tags', TagIndex())
+        store.attach('order', NoteOrder())
+    store.attach('stats', NoteStats())
+    from embeddings import VectorIndex
+    store.attach('vectors', VectorIndex(os.path.splitext(DB_FILE)[0] + "_vectors.npy", make_embedder()))
+    # Notes saved before derived stats existed get them in the background
+    store.backfill(lambda note: annotate(note) if needs_annotation(note) else None)
+    return store
 
 def load_db():
-    init_db()
-    with open(DB_FILE, 'r') as f:
-        return json.load(f)
+    store = get_store()
+    store.refresh()  # pick up writes from other processes
+    return store
+
+# Revision history lives in its own file and is only read when a note's
+# history is opened; saves just queue the new revision (see history.py)
+HISTORY_FILE = os.path.splitext(DB_FILE)[0] + "_history.log"
+
+@st.cache_resource
+def get_history():
+    store = get_store()
+    return NoteHistory(HISTORY_FILE, exists=lambda note_id: note_id in store.notes)
+
+# Unsaved editor text is autosaved here, never to the database (see drafts.py)
+DRAFTS_DIR = os.path.splitext(DB_FILE)[0] + "_drafts"
+
+@st.cache_resource
+def get_drafts():
+    return DraftJournal(DRAFTS_DIR)
+
+def save_note(note, base=None):
+    # `base` is the note as it was when editing started; concurrent edits
+    # from other sessions are merged against it (raises NoteConflict)
+    saved = get_store().put(note, base=base)
+    get_history().record(saved, previous=base)
+    get_drafts().discard(saved['id'])
+    return saved
 
-def save_db(data):
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def delete_note(note_id):
+    get_store().delete(note_id)
+    get_drafts().discard(note_id)
+
+# Editor navigation: O(1) lookups by id, never a scan of the note list
+def open_note(note_id):
+    # None opens a new note, whose id is fixed until it is saved or left
+    st.session_state.view = 'edit'
+    st.session_state.current_note_id = note_id
+    st.session_state.edit_base = get_store().notes.get(note_id) if note_id else None
+    st.session_state.new_note_id = generate_id()
+    st.session_state.ai_jobs = {}
+    # Unsaved changes left by a closed tab or a crash reopen in the editor
+    st.session_state.draft = get_drafts().load(note_id) if note_id else None
+
+def recover_draft(draft):
+    if draft['id'] in get_store().notes:
+        open_note(draft['id'])
+    else:
+        # A note that was never saved (or was deleted since) keeps its id
+        open_note(None)
+        st.session_state.new_note_id = draft['id']
+        st.session_state.draft = draft
+
+def close_note():
+    st.session_state.view = 'dashboard'
+    st.session_state.current_note_id = None
+    st.session_state.edit_base = None
+    st.session_state.draft = None
+
+def save_settings(changes):
+    # Only the changed keys, so sessions don't overwrite each other's settings
+    get_store().update_settings(changes)
 
 # Themes
 THEMES = {
@@ -172,11 +256,56 @@ THEMES = {
     }
 }
 
-# Apply CSS styling
+THEME_LABELS = {
+    "nebula": "🌌 Nebula",
+    "ocean": "🌊 Ocean",
+    "forest": "🌲 Forest",
+    "classic": "🖤 Classic Noir"
+}
+
+# User-defined themes: {"name": {"label": ..., "primary": ..., ...}} in a JSON
+# file next to the database; missing colours are taken from Nebula
+USER_THEMES_FILE = os.path.splitext(DB_FILE)[0] + "_themes.json"
+
+@st.cache_data
+def load_user_themes(path, mtime):
+    # `mtime` is only part of the cache key, so edits to the file are picked up
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {name: {**THEMES['nebula'], **{k: str(v) for k, v in values.items()}}
+            for name, values in data.items() if isinstance(values, dict)}
+
+def all_themes():
+    try:
+        mtime = os.path.getmtime(USER_THEMES_FILE)
+    except OSError:
+        return THEMES
+    return {**THEMES, **load_user_themes(USER_THEMES_FILE, mtime)}
+
+def theme_label(name, theme):
+    return theme.get('label') or THEME_LABELS.get(name, name.title())
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{}:;,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+# Apply CSS styling. The stylesheet is built and minified once per theme;
+# Streamlit still needs it emitted on every rerun, but as a cached string
+@st.cache_data
+def compiled_theme_css(theme_items):
+    return f"<style>{minify_css(theme_css(dict(theme_items)))}</style>"
+
 def apply_theme(theme_name):
-    theme = THEMES[theme_name]
-    st.markdown(f"""
-    <style>
+    theme = all_themes().get(theme_name, THEMES['nebula'])
+    st.markdown(compiled_theme_css(tuple(sorted(theme.items()))), unsafe_allow_html=True)
+
+def theme_css(theme):
+    return f"""
     .stApp {{
         background: {theme['bg']};
         color: {theme['primary']};
@@ -331,65 +460,175 @@ def apply_theme(theme_name):
         0%, 100% {{ opacity: 0.5; }}
         50% {{ opacity: 1; }}
     }}
-    </style>
-    """, unsafe_allow_html=True)
+    """
 
 # Utility functions
 def generate_id():
-    return hashlib.md5(str(datetime.now()).encode()).hexdigest()[:8]
-
-def word_count(text):
-    return len(re.findall(r'\w+', text))
-
-def reading_time(text):
-    words = word_count(text)
-    return max(1, round(words / 200))  # 200 WPM average
+    # Time-sortable and unique even when called many times per microsecond
+    return new_id()
 
-def extract_tags(content):
-    return re.findall(r'#(\w+)', content)
-
-def filter_notes(notes, search_term="", tag_filter=""):
+def filter_notes(notes, search_term="", tag_filter=(), store=None, match_all_tags=True):
     if not search_term and not tag_filter:
         return notes
     
+    # Indexed search: words are ANDed, OR unions, "quotes" match a phrase and
+    # the last word is a prefix; tags come from the tag index as a set.
+    # Without a store (or for queries with no words in them) fall back to
+    # the plain substring scan below.
+    if store is not None:
+        ids = None
+        if tag_filter:
+            ids = store.tagged(tag_filter, match_all=match_all_tags)
+            tag_filter = ()
+        if search_term and tokenize(search_term):
+            found = store.search(search_term)
+            ids = found if ids is None else ids & found
+            search_term = ""
+        if ids is not None:
+            notes = [store.notes[i] for i in ids if i in store.notes]
+    
+    tag_test = all if match_all_tags else any
     filtered = []
     for note in notes:
         search_match = not search_term or (
             search_term.lower() in note['title'].lower() or 
             search_term.lower() in note['content'].lower()
         )
-        tag_match = not tag_filter or tag_filter in note.get('tags', [])
+        tag_match = not tag_filter or tag_test(tag in note.get('tags', []) for tag in tag_filter)
         
         if search_match and tag_match:
             filtered.append(note)
     
     return filtered
 
+# Dashboard pagination: only one page of cards is built per rerun
+PAGE_SIZES = [10, 25, 50, 100]
+DEFAULT_PAGE_SIZE = 25
+
+# Ranked search: top-k notes by BM25 relevance, plus a highlighted snippet
+# around the first match for each (only the k results are snippeted)
+RANKED_RESULTS = 50
+
+def rank_notes(store, search_term, tag_filter=(), match_all_tags=True, limit=RANKED_RESULTS):
+    allowed = store.tagged(tag_filter, match_all=match_all_tags) if tag_filter else None
+    ranked = store.rank(search_term, k=limit, allowed=allowed)
+    terms = store.query_terms(search_term)
+    results = [store.notes[note_id] for note_id, _ in ranked if note_id in store.notes]
+    snippets = {note['id']: make_snippet(note['content'], terms) for note in results}
+    return results, snippets
+
 # Gemini AI functions
-def generate_ai_suggestions(model, note_content, suggestion_type="improve"):
-    if not model:
-        return None
-    
-    prompts = {
-        "improve": f"Analyze this note and suggest 3 ways to improve it:\n\n{note_content}",
-        "summarize": f"Create a concise summary of this note:\n\n{note_content}",
-        "tags": f"Suggest 5 relevant hashtags for this note:\n\n{note_content}",
-        "continue": f"Continue writing this note with 2-3 more sentences:\n\n{note_content}",
-        "title": f"Suggest 3 creative titles for this note:\n\n{note_content}"
-    }
+# Persistent response cache shared by every session: asking again for the
+# same suggestion on unchanged content costs no API call
+@st.cache_resource
+def get_ai_cache():
+    return ResponseCache(default_cache_path(DB_FILE))
+
+def model_name(model):
+    return getattr(model, 'model_name', type(model).__name__)
+
+AI_PROMPTS = {
+    "improve": "Analyze this note and suggest 3 ways to improve it:\n\n{content}",
+    "summarize": "Create a concise summary of this note:\n\n{content}",
+    "tags": "Suggest 5 relevant hashtags for this note:\n\n{content}",
+    "continue": "Continue writing this note with 2-3 more sentences:\n\n{content}",
+    "title": "Suggest 3 creative titles for this note:\n\n{content}"
+}
+
+# Streaming AI jobs: editor requests run on a shared thread pool instead of
+# blocking the rerun, identical in-flight requests share one job, and the
+# partial text shows up in st.session_state.ai_suggestions as it arrives
+@st.cache_resource
+def get_ai_runner():
+    return JobRunner()
+
+def stream_ai_suggestion(model, prompt):
+    for chunk in model.generate_content(prompt, stream=True, request_options={"timeout": DEFAULT_TIMEOUT}):
+        yield chunk.text
+
+def start_ai_suggestion(model, note_content, suggestion_type):
+    cache = get_ai_cache()
+    runner = get_ai_runner()
+    key = cache_key(model_name(model), suggestion_type, note_content)
+    cached = cache.get(key)
+    if cached is not None:
+        job = runner.completed(key, cached)
+    else:
+        prompt = AI_PROMPTS[suggestion_type].format(content=note_content)
+        job = runner.submit(key, lambda: stream_ai_suggestion(model, prompt),
+                            on_done=lambda text: cache.put(key, text))
+    st.session_state.ai_jobs[suggestion_type] = job.key
+
+def render_ai_jobs(suggestion_types):
+    runner = get_ai_runner()
+    
+    def session_jobs():
+        for sug_type in suggestion_types:
+            key = st.session_state.ai_jobs.get(sug_type)
+            job = runner.get(key) if key else None
+            if job is not None:
+                yield sug_type, job
+    
+    polling = any(job.running for _, job in session_jobs())
+    
+    def show():
+        if polling and not any(job.running for _, job in session_jobs()):
+            st.rerun()  # everything finished: stop polling
+        for sug_type, job in session_jobs():
+            st.session_state.ai_suggestions[sug_type] = job.text
+            running = job.running
+            with st.expander(f"✨ {sug_type.title()} Suggestions", expanded=running):
+                if job.text:
+                    st.markdown(f'<div class="ai-suggestion">{job.text}</div>', unsafe_allow_html=True)
+                if running:
+                    st.caption("✍️ AI writing...")
+                    if st.button("Cancel", key=f"cancel_{sug_type}"):
+                        job.cancel()
+                        st.rerun()
+                elif job.status == 'error':
+                    st.error(f"AI unavailable: {job.error}")
+                elif job.status != 'done':
+                    st.caption(f"Stopped ({job.status})")
+                if not running and st.button(f"Clear {sug_type}", key=f"clear_{sug_type}"):
+                    del st.session_state.ai_jobs[sug_type]
+                    st.session_state.ai_suggestions.pop(sug_type, None)
+                    st.rerun()
     
-    try:
-        response = model.generate_content(prompts[suggestion_type])
-        return response.text
-    except Exception as e:
-        return f"AI unavailable: {str(e)}"
+    st.fragment(run_every=1 if polling else None)(show)()
+
+# Bulk AI: tags or summaries for many notes, packed several to a request and
+# checkpointed so an interrupted run picks up where it stopped
+BULK_TASK_LABELS = {"tags": "🏷️ Suggest tags", "summarize": "📋 Summarize"}
 
-def get_smart_insights(model, notes):
+@st.cache_resource
+def get_bulk_state():
+    return {"job": None}
+
+def bulk_checkpoint_path():
+    return os.path.splitext(DB_FILE)[0] + "_ai_batch.json"
+
+def render_bulk_progress(job):
+    def show():
+        if job.status != 'running':
+            st.rerun()  # finished: redraw the sidebar controls
+        st.progress(job.done / max(job.total, 1),
+                    text=f"{BULK_TASK_LABELS[job.task]}: {job.done}/{job.total} notes")
+        if job.failed:
+            st.caption(f"⚠️ {len(job.failed)} failed: {job.error}")
+        if st.button("⏹️ Stop", key="bulk_stop"):
+            job.cancel()
+    
+    st.fragment(run_every=2)(show)()
+
+def insights_sample(notes):
+    recent_notes = notes[-5:]  # Last 5 notes
+    return "\n".join([f"- {note['title']}: {note['content'][:100]}..." for note in recent_notes])
+
+def get_smart_insights(model, notes, cache=None):
     if not model or not notes:
         return None
     
-    recent_notes = notes[-5:]  # Last 5 notes
-    content_sample = "\n".join([f"- {note['title']}: {note['content'][:100]}..." for note in recent_notes])
+    content_sample = insights_sample(notes)
     
     prompt = f"""Analyze these recent notes and provide insights:
     {content_sample}
@@ -399,60 +638,48 @@ def get_smart_insights(model, notes):
     2. Writing patterns
     3. Productivity suggestions"""
     
-    try:
+    def ask():
         response = model.generate_content(prompt)
         return response.text
-    except:
-        return None
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        textColor=colors.black
-    )
-    story.append(Paragraph(note['title'], title_style))
-    story.append(Spacer(1, 12))
-    
-    # Content
-    content_style = ParagraphStyle(
-        'CustomContent',
-        parent=styles['Normal'],
-        fontSize=11,
-        spaceAfter=12,
-        textColor=colors.black
-    )
-    
-    # Convert markdown to HTML then to PDF-compatible format
-    html_content = markdown.markdown(note['content'])
-    story.append(Paragraph(html_content, content_style))
     
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+    # Errors propagate so the panel can offer a retry; they are never cached
+    if cache is None:
+        return ask()
+    return cache.get_or_compute(cache_key(model_name(model), "insights", content_sample), ask)
+
+# Insights are recomputed in the background only when the recent notes change;
+# the panel shows the last result meanwhile instead of blocking the page
+@st.cache_resource
+def get_insights_memo():
+    return BackgroundMemo()
 
 # Initialize session state
-if 'current_note' not in st.session_state:
-    st.session_state.current_note = None
+if 'current_note_id' not in st.session_state:
+    # The note being edited is tracked by id and looked up in the store;
+    # `edit_base` is the version it had when editing started (merge base)
+    st.session_state.current_note_id = None
+    st.session_state.edit_base = None
+    st.session_state.new_note_id = generate_id()
+    st.session_state.draft = None
 if 'view' not in st.session_state:
     st.session_state.view = 'dashboard'
 if 'auth' not in st.session_state:
     st.session_state.auth = False
 if 'ai_suggestions' not in st.session_state:
     st.session_state.ai_suggestions = {}
+if 'ai_jobs' not in st.session_state:
+    st.session_state.ai_jobs = {}  # suggestion type -> JobRunner key
 if 'show_ai_panel' not in st.session_state:
     st.session_state.show_ai_panel = False
+if 'page_cursors' not in st.session_state:
+    # Start cursor of every page visited so far; the last one is on screen
+    st.session_state.page_cursors = [None]
+    st.session_state.page_query = None
 
 # Load data and initialize Gemini
 db = load_db()
-notes = db.get('notes', [])
-settings = db.get('settings', {"theme": "nebula", "locked": False, "ai_enabled": True})
+notes = db.all_notes()
+settings = dict(db.settings or DEFAULT_SETTINGS)
 gemini_model = init_gemini() if settings.get('ai_enabled', True) else None
 
 # Apply theme
@@ -480,12 +707,10 @@ with st.sidebar:
     st.markdown("### Navigation")
     
     if st.button("📊 Dashboard", use_container_width=True):
-        st.session_state.view = 'dashboard'
-        st.session_state.current_note = None
+        close_note()
     
     if st.button("➕ New Note", use_container_width=True):
-        st.session_state.view = 'edit'
-        st.session_state.current_note = None
+        open_note(None)
     
     st.markdown("---")
     
@@ -496,8 +721,7 @@ with st.sidebar:
         
         if ai_enabled != settings.get('ai_enabled', True):
             settings['ai_enabled'] = ai_enabled
-            db['settings'] = settings
-            save_db(db)
+            save_settings({'ai_enabled': ai_enabled})
             st.rerun()
         
         if ai_enabled and st.button("🧠 Smart Insights"):
@@ -507,24 +731,19 @@ with st.sidebar:
     
     # Theme selector
     st.markdown("### 🎨 Theme")
-    theme_options = {
-        "nebula": "🌌 Nebula",
-        "ocean": "🌊 Ocean", 
-        "forest": "🌲 Forest",
-        "classic": "🖤 Classic Noir"
-    }
+    theme_options = {name: theme_label(name, theme) for name, theme in all_themes().items()}
     
     current_theme = st.selectbox(
         "Choose theme:",
         options=list(theme_options.keys()),
         format_func=lambda x: theme_options[x],
-        index=list(theme_options.keys()).index(settings['theme'])
+        # A user theme may have been removed from the file since it was chosen
+        index=list(theme_options.keys()).index(settings['theme']) if settings['theme'] in theme_options else 0
     )
     
     if current_theme != settings['theme']:
         settings['theme'] = current_theme
-        db['settings'] = settings
-        save_db(db)
+        save_settings({'theme': current_theme})
         st.rerun()
     
     st.markdown("---")
@@ -532,12 +751,26 @@ with st.sidebar:
     # Search and filter
     st.markdown("### 🔍 Search & Filter")
     search_term = st.text_input("Search notes:")
+    search_modes = {
+        "ranked": "Best match",
+        "semantic": "Similar meaning",
+        "index": "Pinned & recent first",
+        "substring": "Exact substring",
+    }
+    search_mode = st.selectbox("Order results by:", options=list(search_modes.keys()),
+                               format_func=lambda x: search_modes[x],
+                               help="Exact substring scans every note for the literal text")
     
-    all_tags = set()
-    for note in notes:
-        all_tags.update(note.get('tags', []))
+    # Counts come straight from the tag index, no scan over the notes
+    tag_counts = db.tag_counts()
+    tag_filter = st.multiselect("Filter by tag:", sorted(tag_counts),
+                                format_func=lambda tag: f"#{tag} ({tag_counts.get(tag, 0)})")
+    match_all_tags = True
+    if len(tag_filter) > 1:
+        match_all_tags = st.radio("Show notes with:", ["all of these tags", "any of these tags"],
+                                  horizontal=True) == "all of these tags"
     
-    tag_filter = st.selectbox("Filter by tag:", [""] + sorted(list(all_tags)))
+    page_size = st.selectbox("Notes per page:", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE))
     
     st.markdown("---")
     
@@ -560,10 +793,30 @@ if st.session_state.view == 'dashboard':
     # Dashboard view
     st.markdown("### 📝 Your Notes")
     
-    # Stats
-    total_notes = len(notes)
-    total_words = sum(word_count(note['content']) for note in notes)
-    pinned_count = len([n for n in notes if n.get('pinned', False)])
+    # Drafts left behind by a closed tab or a crash, offered for recovery
+    for draft in get_drafts().recoverable():
+        stored = db.notes.get(draft['id'])
+        if stored is not None and (stored['title'], stored['content']) == (draft['title'], draft['content']):
+            get_drafts().discard(draft['id'])  # saved after all
+            continue
+        col1, col2, col3 = st.columns([6, 1, 1])
+        with col1:
+            st.warning(f"📝 Unsaved draft of **{draft['title'] or 'Untitled'}** from "
+                       f"{draft['saved_at'][:16].replace('T', ' ')}")
+        with col2:
+            if st.button("Recover", key=f"recover_{draft['id']}"):
+                recover_draft(draft)
+                st.rerun()
+        with col3:
+            if st.button("Discard", key=f"discard_{draft['id']}"):
+                get_drafts().discard(draft['id'])
+                st.rerun()
+    
+    # Stats, kept up to date by the store on every save/delete
+    stats = db.indexes['stats']
+    total_notes = stats.total_notes
+    total_words = stats.total_words
+    pinned_count = stats.pinned_count
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -576,23 +829,79 @@ if st.session_state.view == 'dashboard':
     # Smart Insights Panel
     if st.session_state.show_ai_panel and gemini_model and settings.get('ai_enabled'):
         with st.expander("🧠 AI Insights", expanded=True):
-            insights = get_smart_insights(gemini_model, notes)
-            if insights:
-                st.markdown(f'<div class="ai-suggestion">{insights}</div>', unsafe_allow_html=True)
-            else:
-                st.info("Write more notes to get AI insights!")
-    
-    # Filter notes
-    filtered_notes = filter_notes(notes, search_term, tag_filter)
-    
-    # Sort: pinned first, then by last updated
-    filtered_notes.sort(key=lambda x: (not x.get('pinned', False), x.get('last_updated', '')), reverse=True)
-    
-    if not filtered_notes:
+            insights_fingerprint = hashlib.sha1(insights_sample(notes).encode()).hexdigest()
+            
+            def lookup_insights():
+                if not notes:
+                    return None, False, False
+                return get_insights_memo().get(
+                    model_name(gemini_model), insights_fingerprint,
+                    lambda: get_smart_insights(gemini_model, notes, cache=get_ai_cache())
+                )
+            
+            def show_insights():
+                insights, stale, refreshing = lookup_insights()
+                error = get_insights_memo().failure(model_name(gemini_model), insights_fingerprint)
+                if error is not None:
+                    st.warning(f"AI insights unavailable: {error}")
+                    if st.button("🔄 Retry insights", key="insights_retry"):
+                        get_insights_memo().retry(model_name(gemini_model))
+                        st.rerun()
+                if insights:
+                    st.markdown(f'<div class="ai-suggestion">{insights}</div>', unsafe_allow_html=True)
+                    if stale and error is None:
+                        st.caption("⏳ Your notes changed, refreshing insights...")
+                elif refreshing:
+                    st.info("🧠 Analyzing your recent notes...")
+                elif error is None:
+                    st.info("Write more notes to get AI insights!")
+            
+            # Poll only while a refresh is running, without rerunning the page
+            _, _, insights_refreshing = lookup_insights()
+            st.fragment(run_every=2 if insights_refreshing else None)(show_insights)()
+    
+    # Any change to the query starts again from the first page
+    page_query = (search_mode, search_term, tuple(tag_filter), match_all_tags, page_size)
+    if st.session_state.page_query != page_query:
+        st.session_state.page_query = page_query
+        st.session_state.page_cursors = [None]
+    cursor = st.session_state.page_cursors[-1]
+    
+    # Filter notes and cut out the visible page
+    snippets = {}
+    if search_mode in ("ranked", "semantic") and tokenize(search_term):
+        # Already in relevance order; the cursor is an offset into the top-k
+        if search_mode == "ranked":
+            ranked_notes, snippets = rank_notes(db, search_term, tag_filter, match_all_tags)
+        else:
+            allowed = db.tagged(tag_filter, match_all=match_all_tags) if tag_filter else None
+            hits = db.indexes['vectors'].search(search_term, k=RANKED_RESULTS)
+            # A query sharing nothing with a note scores 0 against it
+            ranked_notes = [db.notes[i] for i, score in hits
+                            if score > 0 and i in db.notes and (allowed is None or i in allowed)]
+        offset = cursor or 0
+        page_notes = ranked_notes[offset:offset + page_size]
+        next_cursor = offset + page_size if len(ranked_notes) > offset + page_size else None
+    else:
+        # Pinned first, then by last updated; the cursor is the sort key of
+        # the last card on the page
+        if search_mode != "substring" and (not search_term or tokenize(search_term)):
+            # Filter, order and page in the store (one SQL query on SQLite)
+            page_ids, next_cursor = db.find(search_term, tag_filter, match_all_tags,
+                                            after=cursor, limit=page_size)
+        else:
+            allowed = None
+            if search_term or tag_filter:
+                allowed = {n['id'] for n in filter_notes(notes, search_term, tag_filter,
+                                                         match_all_tags=match_all_tags)}
+            page_ids, next_cursor = db.page(after=cursor, limit=page_size, allowed=allowed)
+        page_notes = [db.notes[i] for i in page_ids if i in db.notes]
+    
+    if not page_notes:
         st.info("No notes found. Create your first note!")
     
     # Display notes
-    for note in filtered_notes:
+    for note in page_notes:
         card_class = "note-card pinned" if note.get('pinned', False) else "note-card"
         
         with st.container():
@@ -604,51 +913,98 @@ if st.session_state.view == 'dashboard':
                 st.markdown(f'<div class="note-title">{note["title"]}</div>', unsafe_allow_html=True)
                 
                 # Preview
-                preview = note['content'][:150] + "..." if len(note['content']) > 150 else note['content']
+                # Derived fields are stored at save time; the fallbacks only
+                # run for notes the background migration hasn't reached yet
+                if needs_annotation(note):
+                    note = annotate(note)
+                preview = snippets.get(note['id'], note['preview'])
                 st.markdown(f'<div class="note-preview">{preview}</div>', unsafe_allow_html=True)
                 
                 # Tags
-                if note.get('tags'):
-                    tags_html = ''.join([f'<span class="tag">#{tag}</span>' for tag in note['tags']])
+                ai_tags = [tag for tag in note.get('ai_tags', []) if tag not in note.get('tags', [])]
+                if note.get('tags') or ai_tags:
+                    tags_html = ''.join([f'<span class="tag">#{tag}</span>' for tag in note.get('tags', [])])
+                    tags_html += ''.join([f'<span class="tag">🤖 #{tag}</span>' for tag in ai_tags])
                     st.markdown(tags_html, unsafe_allow_html=True)
                 
                 # Meta info
-                words = word_count(note['content'])
-                read_time = reading_time(note['content'])
+                words = note['word_count']
+                read_time = note['reading_time']
                 updated = note.get('last_updated', note['timestamp'])[:16]
                 
                 st.markdown(f'<div class="note-meta">📝 {words} words • ⏱️ {read_time} min read • 📅 {updated}</div>', 
                           unsafe_allow_html=True)
+                
+                # Only rendered when opened: an expander would run (and render
+                # every card's body) on each rerun even while collapsed
+                if st.toggle("👁️ Read", key=f"read_{note['id']}"):
+                    st.markdown(get_renderer().render(note['content']), unsafe_allow_html=True)
             
             with col2:
                 if st.button("✏️", key=f"edit_{note['id']}", help="Edit note"):
-                    st.session_state.current_note = note
-                    st.session_state.view = 'edit'
+                    open_note(note['id'])
                     st.rerun()
             
             with col3:
                 if st.button("🗑️", key=f"delete_{note['id']}", help="Delete note"):
-                    notes.remove(note)
-                    db['notes'] = notes
-                    save_db(db)
+                    delete_note(note['id'])
                     st.rerun()
             
             st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Page navigation
+    page_number = len(st.session_state.page_cursors)
+    if page_number > 1 or next_cursor is not None:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if page_number > 1 and st.button("◀ Previous", use_container_width=True):
+                st.session_state.page_cursors.pop()
+                st.rerun()
+        with col2:
+            st.markdown(f'<div class="note-meta" style="text-align: center;">Page {page_number}</div>',
+                        unsafe_allow_html=True)
+        with col3:
+            if next_cursor is not None and st.button("Next ▶", use_container_width=True):
+                st.session_state.page_cursors.append(next_cursor)
+                st.rerun()
 
 elif st.session_state.view == 'edit':
     # Edit view
-    is_new = st.session_state.current_note is None
-    note = st.session_state.current_note or {
-        'id': generate_id(),
-        'title': '',
-        'content': '',
-        'tags': [],
-        'timestamp': datetime.now().isoformat(),
-        'pinned': False
-    }
+    is_new = st.session_state.current_note_id is None
+    if is_new:
+        note = {
+            'id': st.session_state.new_note_id,
+            'title': '',
+            'content': '',
+            'tags': [],
+            'timestamp': datetime.now().isoformat(),
+            'pinned': False
+        }
+    else:
+        current = db.notes.get(st.session_state.current_note_id)
+        if current is None:
+            st.warning("This note was deleted in another session.")
+            close_note()
+            st.stop()
+        # Edit a copy of the version editing started from; the stored dict
+        # is shared with other sessions until saved
+        note = dict(st.session_state.edit_base or current)
+    stored_text = (note['title'], note['content'])
     
     st.markdown(f"### {'📝 New Note' if is_new else '✏️ Edit Note'}")
     
+    # A recovered draft replaces the stored text for this editing session
+    draft = st.session_state.draft
+    if draft is not None and draft['id'] == note['id'] and (draft['title'], draft['content']) != stored_text:
+        note['title'], note['content'] = draft['title'], draft['content']
+        moved_on = not is_new and draft.get('version') != current.get('version')
+        st.info(f"Recovered unsaved changes from {draft['saved_at'][:16].replace('T', ' ')}."
+                + (" The note was saved elsewhere since; saving keeps this text." if moved_on else ""))
+        if st.button("🗑️ Discard draft", key="discard_draft"):
+            get_drafts().discard(note['id'])
+            st.session_state.draft = None
+            st.rerun()
+    
     # Title
     title = st.text_input("Title:", value=note['title'])
     
@@ -667,51 +1023,59 @@ elif st.session_state.view == 'edit':
             st.markdown("**🎓 AI Assistant**")
             col_ai1, col_ai2, col_ai3 = st.columns(3)
             
+            # Each button queues a background job and returns immediately
             with col_ai1:
                 if st.button("✨ Improve", key="ai_improve", help="Get improvement suggestions"):
-                    with st.spinner("AI thinking..."):
-                        suggestion = generate_ai_suggestions(gemini_model, content, "improve")
-                        st.session_state.ai_suggestions['improve'] = suggestion
+                    start_ai_suggestion(gemini_model, content, "improve")
             
             with col_ai2:
                 if st.button("📝 Continue", key="ai_continue", help="Continue writing"):
-                    with st.spinner("AI writing..."):
-                        suggestion = generate_ai_suggestions(gemini_model, content, "continue")
-                        st.session_state.ai_suggestions['continue'] = suggestion
+                    start_ai_suggestion(gemini_model, content, "continue")
             
             with col_ai3:
                 if st.button("🏷️ Tags", key="ai_tags", help="Suggest tags"):
-                    with st.spinner("AI tagging..."):
-                        suggestion = generate_ai_suggestions(gemini_model, content, "tags")
-                        st.session_state.ai_suggestions['tags'] = suggestion
+                    start_ai_suggestion(gemini_model, content, "tags")
             
-            # Display AI suggestions
-            for sug_type, sug_content in st.session_state.ai_suggestions.items():
-                if sug_content:
-                    with st.expander(f"✨ {sug_type.title()} Suggestions"):
-                        st.markdown(f'<div class="ai-suggestion">{sug_content}</div>', unsafe_allow_html=True)
-                        if st.button(f"Clear {sug_type}", key=f"clear_{sug_type}"):
-                            del st.session_state.ai_suggestions[sug_type]
-                            st.rerun()
+            # Display AI suggestions, streaming in while the jobs run
+            render_ai_jobs(["improve", "continue", "tags"])
     
     with col2:
         st.markdown("**Preview**")
         if content:
             try:
-                html_content = markdown.markdown(content, extensions=['codehilite', 'fenced_code'])
-                st.markdown(html_content, unsafe_allow_html=True)
+                # Only blocks edited since the last rerun are rendered again
+                st.markdown(get_renderer().render(content), unsafe_allow_html=True)
             except:
                 st.markdown(content)
         else:
             st.info("Preview will appear here...")
         
+        if note.get('ai_summary'):
+            st.caption(f"🤖 {note['ai_summary']}")
+        
+        # Related notes straight from the vector index, no corpus scan
+        if not is_new:
+            related = [(db.notes[i], score) for i, score in db.indexes['vectors'].related(note['id'], k=5)
+                       if i in db.notes and score > 0]
+            if related:
+                st.markdown("**🔗 Related notes**")
+                for related_note, score in related:
+                    if st.button(f"{related_note['title']} ({score:.0%})", key=f"related_{related_note['id']}"):
+                        open_note(related_note['id'])
+                        st.rerun()
+        
         # AI Summary
         if gemini_model and settings.get('ai_enabled') and content and len(content) > 100:
             if st.button("📋 AI Summary", key="ai_summary"):
-                with st.spinner("Summarizing..."):
-                    summary = generate_ai_suggestions(gemini_model, content, "summarize")
-                    st.markdown("**Quick Summary:**")
-                    st.markdown(f'<div class="ai-suggestion">{summary}</div>', unsafe_allow_html=True)
+                start_ai_suggestion(gemini_model, content, "summarize")
+            render_ai_jobs(["summarize"])
+    
+    # Autosave: unsaved text is staged on every rerun (an in-memory update)
+    # and written to the note's draft at most once per interval
+    if (title, content) != stored_text:
+        get_drafts().stage(note['id'], title, content, version=None if is_new else note.get('version'))
+    else:
+        get_drafts().discard(note['id'])  # edited back to the saved text
     
     # Options
     col1, col2, col3 = st.columns(3)
@@ -730,10 +1094,8 @@ elif st.session_state.view == 'edit':
     # AI title suggestions
     if gemini_model and settings.get('ai_enabled') and content and not title:
         if st.button("🎯 AI Title Ideas", key="ai_title"):
-            with st.spinner("Generating titles..."):
-                title_suggestions = generate_ai_suggestions(gemini_model, content, "title")
-                st.markdown("**Suggested Titles:**")
-                st.markdown(f'<div class="ai-suggestion">{title_suggestions}</div>', unsafe_allow_html=True)
+            start_ai_suggestion(gemini_model, content, "title")
+        render_ai_jobs(["title"])
     
     if extracted_tags:
         st.info(f"Tags found: {', '.join([f'#{tag}' for tag in extracted_tags])}")
@@ -750,29 +1112,21 @@ elif st.session_state.view == 'edit':
                 note['pinned'] = pinned
                 note['last_updated'] = datetime.now().isoformat()
                 
-                if is_new:
-                    notes.append(note)
+                # Appends a single upsert record instead of rewriting the database
+                try:
+                    save_note(note, base=st.session_state.edit_base)
+                except NoteConflict as e:
+                    st.error(f"Not saved: {e}. Reopen the note to see the latest version.")
                 else:
-                    # Update existing note
-                    for i, existing_note in enumerate(notes):
-                        if existing_note['id'] == note['id']:
-                            notes[i] = note
-                            break
-                
-                db['notes'] = notes
-                save_db(db)
-                
-                st.success("Note saved!")
-                st.session_state.view = 'dashboard'
-                st.session_state.current_note = None
-                st.rerun()
+                    st.success("Note saved!")
+                    close_note()
+                    st.rerun()
             else:
                 st.error("Please provide both title and content")
     
     with col2:
         if st.button("🏠 Dashboard", use_container_width=True):
-            st.session_state.view = 'dashboard'
-            st.session_state.current_note = None
+            close_note()
             st.rerun()
     
     with col3:
@@ -799,6 +1153,39 @@ elif st.session_state.view == 'edit':
                     )
                 except Exception as e:
                     st.error(f"PDF export failed: {str(e)}")
+    
+    # Revision history: browse earlier saves and restore one. Behind a
+    # toggle so the history file is only read, and the chosen revision
+    # only rebuilt and diffed, while it is open (an expander would do both
+    # on every rerun of the editor)
+    if not is_new and st.toggle("🕘 History", key=f"show_history_{note['id']}"):
+        history = get_history()
+        revisions = history.revisions(note['id'])
+        if not revisions:
+            st.caption("No earlier versions yet. Every save adds one.")
+        else:
+            labels = {rev.number: f"#{rev.number} • {rev.at[:16].replace('T', ' ')} • {rev.title}"
+                      for rev in revisions}
+            number = st.selectbox("Revision", list(reversed(list(labels))),
+                                  format_func=labels.get, key=f"history_{note['id']}")
+            old_title, old_content = history.content(note['id'], number)
+            diff = ''.join(difflib.unified_diff(old_content.splitlines(keepends=True),
+                                                content.splitlines(keepends=True),
+                                                f"revision #{number}", "editor"))
+            st.code(diff or "Same as the editor.", language="diff")
+            if st.button("↩️ Restore this revision", key="history_restore"):
+                restored = dict(current)
+                restored['title'] = old_title
+                restored['content'] = old_content
+                restored['tags'] = extract_tags(old_content)
+                restored['last_updated'] = datetime.now().isoformat()
+                try:
+                    save_note(restored, base=current)
+                except NoteConflict as e:
+                    st.error(f"Not restored: {e}. Try again.")
+                else:
+                    open_note(note['id'])  # the editor picks up the restored text
+                    st.rerun()
 
 # Settings in sidebar
 with st.sidebar:
@@ -817,53 +1204,88 @@ with st.sidebar:
                 settings['vault_password'] = password
                 st.success("Vault locked!")
         
-        db['settings'] = settings
-        save_db(db)
+        save_settings({k: settings[k] for k in ('locked', 'vault_password') if k in settings})
     
     # Import/Export
+    # Bulk AI processing
+    if gemini_model and settings.get('ai_enabled'):
+        st.markdown("### 🤖 Bulk AI")
+        bulk = get_bulk_state()
+        bulk_job = bulk["job"]
+        if bulk_job is not None and bulk_job.status == 'running':
+            render_bulk_progress(bulk_job)
+        else:
+            if bulk_job is not None:
+                st.caption(f"Last run {bulk_job.status}: {bulk_job.done}/{bulk_job.total} notes"
+                           + (f", {len(bulk_job.failed)} failed" if bulk_job.failed else ""))
+            if os.path.exists(bulk_checkpoint_path()):
+                if st.button("▶️ Resume interrupted run"):
+                    bulk["job"] = BulkJob.resume(bulk_checkpoint_path())
+                    start_bulk(db, gemini_model, bulk["job"])
+                    st.rerun()
+            bulk_task = st.selectbox("Task:", list(BULK_TASKS), format_func=lambda x: BULK_TASK_LABELS[x])
+            bulk_scope = st.radio("Notes:", ["All notes", "Current search results"])
+            if st.button("🚀 Run on notes"):
+                scope_notes = notes if bulk_scope == "All notes" else filter_notes(
+                    notes, search_term, tag_filter, store=db, match_all_tags=match_all_tags)
+                bulk["job"] = BulkJob(bulk_task, [n['id'] for n in scope_notes], bulk_checkpoint_path())
+                start_bulk(db, gemini_model, bulk["job"])
+                st.rerun()
+    
     st.markdown("### 📥 Import/Export")
     
-    # Export all notes
+    # Export all notes; written note by note to a spooled temp file
+    export_format = st.selectbox("Export format", list(EXPORT_FORMATS),
+                                 format_func=lambda fmt: EXPORT_FORMATS[fmt][0])
     if st.button("📤 Export All Notes"):
-        export_data = {
-            "notes": notes,
-            "exported_at": datetime.now().isoformat(),
-            "total_notes": len(notes)
-        }
+        with st.spinner(f"Exporting {len(notes)} notes..."):
+            with export_notes(notes, export_format, renderer=get_renderer()) as export_file:
+                export_data = export_file.read()
         
         st.download_button(
-            label="Download JSON",
-            data=json.dumps(export_data, indent=2),
-            file_name=f"noirnotes_export_{datetime.now().strftime('%Y%m%d')}.json",
-            mime="application/json"
+            label=f"Download {EXPORT_FORMATS[export_format][0]}",
+            data=export_data,
+            file_name=export_filename(export_format),
+            mime=EXPORT_FORMATS[export_format][1]
         )
     
-    # Import notes
-    uploaded_file = st.file_uploader("📂 Import Notes", type=['json'])
+    # Import notes: parsed incrementally and committed in batches. Notes
+    # already stored (same title and content) are skipped, and each upload is
+    # processed once even though it stays in the uploader across reruns.
+    if 'imported_uploads' not in st.session_state:
+        st.session_state.imported_uploads = {}
+    uploaded_file = st.file_uploader("📂 Import Notes", type=['json', 'ndjson', 'jsonl', 'gz', 'zst', 'msgpack'])
     if uploaded_file:
-        try:
-            import_data = json.load(uploaded_file)
-            imported_notes = import_data.get('notes', [])
+        upload_key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+        summary = st.session_state.imported_uploads.get(upload_key)
+        if summary is None:
+            progress_bar = st.progress(0.0, text="Importing...")
             
-            # Add unique IDs to avoid conflicts
-            for note in imported_notes:
-                note['id'] = generate_id()
-                note['imported_at'] = datetime.now().isoformat()
+            def show_progress(progress):
+                progress_bar.progress(progress.fraction or 0.0,
+                                      text=f"Imported {progress.imported} • skipped {progress.skipped} duplicates")
             
-            notes.extend(imported_notes)
-            db['notes'] = notes
-            save_db(db)
-            
-            st.success(f"Imported {len(imported_notes)} notes!")
-            st.rerun()
-        except Exception as e:
-            st.error(f"Import failed: {str(e)}")
+            try:
+                uploaded_file.seek(0)
+                result = import_notes(get_store(), uploaded_file, generate_id,
+                                      total_bytes=uploaded_file.size, on_progress=show_progress)
+                summary = st.session_state.imported_uploads[upload_key] = (result.imported, result.skipped)
+            except Exception as e:
+                st.error(f"Import failed: {str(e)}")
+            progress_bar.empty()
+            if summary is not None and summary[0]:
+                st.rerun()  # show the new notes
+        if summary is not None:
+            st.success(f"Imported {summary[0]} notes ({summary[1]} duplicates skipped)")
 
     st.markdown("---")
     
     # AI Status
     if gemini_model:
         st.success("🎓 AI Assistant: Active")
+        cache_stats = get_ai_cache().stats()
+        st.caption(f"Response cache: {cache_stats['hits']} hits • {cache_stats['misses']} misses • "
+                   f"{cache_stats['entries']} saved")
     else:
         st.warning("🎓 AI Assistant: Unavailable")
         st.caption("Add GEMINI_API_KEY to Streamlit secrets")
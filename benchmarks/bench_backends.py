@@ -0,0 +1,91 @@
+# JSON log store vs SQLite store at increasing corpus sizes.
+#
+#     python benchmarks/bench_backends.py [sizes...]
+#
+# For each size both backends are loaded with the same synthetic notes and
+# timed on: opening the store (load plus index build), saving one note,
+# the first dashboard page, a search + tag filtered page, and a ranked
+# top-20 search. Query timings are medians in milliseconds.
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import make_corpus  # noqa: E402
+from ids import new_id  # noqa: E402
+from note_store import NoteStore  # noqa: E402
+from search_index import NoteOrder, SearchIndex, TagIndex  # noqa: E402
+from sqlite_store import SqliteStore  # noqa: E402
+
+REPEATS = 50
+TAGS = ['work', 'ideas', 'journal', 'code', 'reading', 'todo']
+
+
+def make_notes(size, rng):
+    notes = make_corpus(size, rng)
+    for i, note in enumerate(notes):
+        note['id'] = new_id()
+        note['tags'] = rng.sample(TAGS, 2)
+        note['pinned'] = i % 100 == 0
+        note['timestamp'] = note['last_updated'] = f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:00:00"
+    return notes
+
+
+def open_json(path):
+    store = NoteStore(path)
+    store.attach('search', SearchIndex(lookup=store.get))
+    store.attach('tags', TagIndex())
+    store.attach('order', NoteOrder())
+    return store
+
+
+def median_ms(fn, repeats=REPEATS):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench(name, open_store, path, notes, rng):
+    open_store(path).replace_all({"notes": notes, "settings": {}})
+    start = time.perf_counter()
+    store = open_store(path)
+    opened = time.perf_counter() - start
+
+    ids = list(store.notes)
+    queries = [' '.join(rng.choice(notes)['content'].split()[:2]) for _ in range(REPEATS)]
+
+    def save(i):
+        note = dict(store.notes[ids[i]])
+        note['content'] += ' edited'
+        store.put(note)
+
+    results = [
+        opened,
+        median_ms(save),
+        median_ms(lambda i: store.page(limit=25)),
+        median_ms(lambda i: store.find(queries[i], ['work'], limit=25)),
+        median_ms(lambda i: store.rank(queries[i], k=20)),
+    ]
+    print(f"{len(notes):>8} {name:>7} {results[0]:>8.2f} {results[1]:>8.3f} {results[2]:>8.3f}"
+          f" {results[3]:>9.3f} {results[4]:>8.3f}")
+
+
+def main(sizes):
+    rng = random.Random(42)
+    print(f"{'notes':>8} {'backend':>7} {'open s':>8} {'save ms':>8} {'page ms':>8} {'find ms':>9} {'rank ms':>8}")
+    for size in sizes:
+        notes = make_notes(size, rng)
+        with tempfile.TemporaryDirectory() as tmp:
+            bench("json", open_json, os.path.join(tmp, 'notes.json'), notes, rng)
+            bench("sqlite", SqliteStore, os.path.join(tmp, 'notes.sqlite'), notes, rng)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
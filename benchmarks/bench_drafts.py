@@ -0,0 +1,44 @@
+# Draft autosave: cost of stage() on the rerun path and write coalescing.
+#
+#     python benchmarks/bench_drafts.py [seconds] [note KB]
+#
+# Stages a growing draft of one note as fast as possible for a few seconds
+# (far more often than reruns happen) and reports the median stage() time,
+# how many writes the journal made for it, and that the last staged text is
+# what ended up on disk.
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drafts import AUTOSAVE_SECONDS, DraftJournal  # noqa: E402
+
+
+def main(seconds, note_kb):
+    body = 'x' * (note_kb * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = DraftJournal(os.path.join(tmp, 'drafts'))
+        timings = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            text = f"{body}{len(timings)}"
+            began = time.perf_counter()
+            journal.stage('note', 'Title', text, version=1)
+            timings.append(time.perf_counter() - began)
+        time.sleep(AUTOSAVE_SECONDS + 0.5)  # let the trailing write land
+
+        with open(os.path.join(journal.directory, 'note.json'), 'rb') as f:
+            landed = text.encode() in f.read()
+        print(f"stage()   {statistics.median(timings) * 1e6:8.2f} us median over {len(timings)} calls")
+        print(f"writes    {journal.writes:8d}    (interval {AUTOSAVE_SECONDS} s over {seconds} s)")
+        print(f"last text {'on disk' if landed else 'MISSING'}")
+        if not landed or journal.error:
+            sys.exit(f"draft autosave failed: {journal.error or 'last draft not written'}")
+
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 5.0, int(args[1]) if len(args) > 1 else 50)
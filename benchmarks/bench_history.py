@@ -0,0 +1,91 @@
+# Revision history: cost on the save path, size on disk and restore time.
+#
+#     python benchmarks/bench_history.py [notes] [saves per note]
+#
+# Simulates editing sessions (a fifth of the lines changed per save) on a
+# JSON store, timing store.put and the history.record call the app's save
+# adds after it (diffing happens on the history's writer thread, waited
+# for after each round). Then reports the history file size
+# against storing every revision in full, checks every revision rebuilds
+# to exactly what was saved, times the slowest rebuild, and prunes.
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_backends import make_notes  # noqa: E402
+from history import NoteHistory  # noqa: E402
+from note_store import NoteStore  # noqa: E402
+
+
+def edit(content, rng):
+    lines = content.split(' ')
+    for _ in range(3):
+        lines[rng.randrange(len(lines))] = f"edit{rng.randrange(1000)}"
+    return ' '.join(lines)
+
+
+def main(count, saves):
+    rng = random.Random(42)
+    notes = make_notes(count, rng)
+    for note in notes:
+        # Multi-line bodies, as written in the editor
+        words = note['content'].split()
+        note['content'] = '\n'.join(' '.join(words[i:i + 8]) for i in range(0, len(words), 8))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = NoteStore(os.path.join(tmp, 'notes.json'))
+        store.replace_all({"notes": notes, "settings": {}})
+        history = NoteHistory(os.path.join(tmp, 'history.log'))
+        saved = {}
+        puts, records = [], []
+        start_day = datetime(2024, 1, 1)
+        for round_ in range(saves):
+            for i, note_id in enumerate(list(store.notes)):
+                base = store.notes[note_id]
+                note = dict(base)
+                note['content'] = '\n'.join(edit(line, rng) if rng.random() < 0.2 else line
+                                            for line in note['content'].split('\n'))
+                note['last_updated'] = (start_day + timedelta(days=round_, seconds=i)).isoformat()
+                start = time.perf_counter()
+                stored = store.put(note, base=base)
+                puts.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                history.record(stored, previous=base)
+                records.append(time.perf_counter() - start)
+                texts = saved.setdefault(note_id, [base['content']])
+                if note['content'] != texts[-1]:
+                    texts.append(note['content'])  # unchanged saves add no revision
+            history.flush()
+        if history.error:
+            sys.exit(f"history writer failed: {history.error}")
+
+        full_bytes = sum(len(text.encode()) for texts in saved.values() for text in texts)
+        size = os.path.getsize(history.path)
+        print(f"store.put      {statistics.median(puts) * 1000:8.3f} ms")
+        print(f"history.record {statistics.median(records) * 1000:8.3f} ms")
+        print(f"history file   {size / 1e6:8.2f} MB  vs {full_bytes / 1e6:.2f} MB as full copies")
+
+        worst = 0.0
+        for note_id in store.notes:
+            for rev in history.revisions(note_id):
+                start = time.perf_counter()
+                _, content = history.content(note_id, rev.number)
+                worst = max(worst, time.perf_counter() - start)
+                if content != saved[note_id][rev.number - 1]:
+                    sys.exit(f"revision {rev.number} of {note_id} does not match its save")
+        print(f"slowest rebuild {worst * 1000:7.3f} ms")
+
+        start = time.perf_counter()
+        dropped = history.prune(now=start_day + timedelta(days=saves + 400))
+        print(f"prune          {time.perf_counter() - start:8.3f} s   dropped {dropped} revisions,"
+              f" {os.path.getsize(history.path) / 1e6:.2f} MB left")
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [1000, 40][len(args):]))
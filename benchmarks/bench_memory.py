@@ -0,0 +1,64 @@
+# Resident memory of an open note store against the size of the corpus.
+#
+#     python benchmarks/bench_memory.py [sizes...]
+#
+# Opens a JSON-backed store with the same indexes get_store() in app.py
+# attaches over synthetic notebooks whose bodies grow with each run, and
+# reports the Python heap still held once loading is done (tracemalloc) next
+# to the total size of the note bodies. With bodies kept in the content file
+# and a search index of per-note term counts, the heap should follow the
+# note count, not the body size.
+import gc
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_backends import make_notes  # noqa: E402
+from embeddings import HashingEmbedder, VectorIndex  # noqa: E402
+from note_stats import NoteStats  # noqa: E402
+from note_store import NoteStore  # noqa: E402
+from search_index import NoteOrder, SearchIndex, TagIndex  # noqa: E402
+
+BODY_REPEATS = (1, 4, 16)
+
+
+def measure(notes):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'notes.json')
+        NoteStore(path).replace_all({"notes": notes, "settings": {}})
+        body_bytes = sum(len(note['content'].encode()) for note in notes)
+        gc.collect()
+        tracemalloc.start()
+        store = NoteStore(path)
+        store.attach('search', SearchIndex(lookup=store.get))
+        store.attach('tags', TagIndex())
+        store.attach('order', NoteOrder())
+        store.attach('stats', NoteStats())
+        vectors = VectorIndex(os.path.join(tmp, 'notes_vectors.npy'), HashingEmbedder())
+        store.attach('vectors', vectors)
+        gc.collect()
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        store.all_notes()[0]['content']  # bodies still read back
+        vectors.close()
+        return body_bytes, held, peak
+
+
+def main(sizes):
+    rng = random.Random(42)
+    print(f"{'notes':>8} {'bodies MB':>10} {'held MB':>8} {'peak MB':>8} {'held/note':>10}")
+    for size in sizes:
+        base = make_notes(size, rng)
+        for repeats in BODY_REPEATS:
+            notes = [{**note, 'content': "\n\n".join([note['content']] * repeats)} for note in base]
+            body_bytes, held, peak = measure(notes)
+            print(f"{size:>8} {body_bytes / 1e6:>10.1f} {held / 1e6:>8.1f} {peak / 1e6:>8.1f}"
+                  f" {held / size:>9.0f}B")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000])
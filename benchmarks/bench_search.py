@@ -0,0 +1,95 @@
+# Query latency of the search index against corpus size.
+#
+#     python benchmarks/bench_search.py [sizes...]
+#
+# Builds a synthetic corpus per size and reports the median latency of
+# boolean search, ranked (BM25) search and the old substring scan, then of
+# search and rank for type-ahead prefixes of 1 to 3 characters (the first
+# keystrokes in the search box, with "Best match" the default mode).
+# Prefixes shorter than MIN_PREFIX must search and rank in under
+# SHORT_QUERY_SHARE of the time of the substring scan they replaced (or
+# SHORT_QUERY_FLOOR_MS, on corpora small enough for the scan to be instant);
+# the script exits non-zero when they don't.
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import MIN_PREFIX, SearchIndex  # noqa: E402
+
+VOCABULARY = 20000
+WORDS_PER_NOTE = 150
+QUERIES = 200
+PREFIX_QUERIES = 20
+PREFIX_LENGTHS = (1, 2, 3)
+SHORT_QUERY_SHARE = 0.5
+SHORT_QUERY_FLOOR_MS = 5.0
+
+
+def make_corpus(size, rng):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(VOCABULARY)]
+    return [
+        {
+            'id': str(i),
+            'title': ' '.join(rng.choices(words, k=4)),
+            'content': ' '.join(rng.choices(words, k=WORDS_PER_NOTE)),
+        }
+        for i in range(size)
+    ]
+
+
+def median_ms(fn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def substring_scan(notes, query):
+    query = query.lower()
+    return [n for n in notes if query in n['title'].lower() or query in n['content'].lower()]
+
+
+def main(sizes):
+    rng = random.Random(42)
+    header = f"{'notes':>8} {'build s':>8} {'search ms':>10} {'rank ms':>8} {'scan ms':>8}"
+    header += ''.join(f" {f'pre{n} s/r ms':>16}" for n in PREFIX_LENGTHS)
+    print(header)
+    over_budget = []
+    for size in sizes:
+        notes = make_corpus(size, rng)
+        start = time.perf_counter()
+        index = SearchIndex()
+        index.rebuild(notes)
+        build = time.perf_counter() - start
+
+        samples = [rng.choice(notes)['content'].split() for _ in range(QUERIES)]
+        queries = [' '.join(words[:2]) for words in samples]
+        search = median_ms(index.search, queries)
+        rank = median_ms(lambda q: index.rank(q, k=20), queries)
+        scan = median_ms(lambda q: substring_scan(notes, q), queries[:10])
+        line = f"{size:>8} {build:>8.2f} {search:>10.3f} {rank:>8.3f} {scan:>8.2f}"
+        for length in PREFIX_LENGTHS:
+            prefixes = [words[0][:length] for words in samples[:PREFIX_QUERIES]]
+            prefix_search = median_ms(index.search, prefixes)
+            prefix_rank = median_ms(lambda q: index.rank(q, k=20), prefixes)
+            line += f" {f'{prefix_search:.2f}/{prefix_rank:.2f}':>16}"
+            budget = max(scan * SHORT_QUERY_SHARE, SHORT_QUERY_FLOOR_MS)
+            if length < MIN_PREFIX and max(prefix_search, prefix_rank) > budget:
+                over_budget.append(f"{size} notes, {length}-character prefix: "
+                                   f"{max(prefix_search, prefix_rank):.2f} ms over {budget:.2f} ms")
+        print(line)
+    for failure in over_budget:
+        print(f"over budget: {failure}")
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
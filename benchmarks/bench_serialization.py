@@ -0,0 +1,90 @@
+# Snapshot formats: size on disk and load/save time for a large notebook.
+#
+#     python benchmarks/bench_serialization.py [notes]
+#
+# Every format serialization.py can produce with the installed packages is
+# first checked to round-trip a tricky document (unicode, nesting, empty
+# strings, large ints) and to be detected on load. Then a NoteStore snapshot
+# of the synthetic corpus is written and reopened in each format, and an
+# export is read back through the importer. Exits non-zero on any mismatch.
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization  # noqa: E402
+from bench_backends import make_notes  # noqa: E402
+from export import FORMATS as EXPORT_FORMATS, export_notes  # noqa: E402
+from importer import iter_notes  # noqa: E402
+from note_store import NoteStore  # noqa: E402
+
+SAMPLE = {
+    "notes": [
+        {"id": "01HZY3N8Q4", "title": "Ünïcödé — ✨ 笔记", "content": "line\nbreak \"quoted\" \\ tab\t",
+         "tags": [], "pinned": False, "version": 2 ** 53, "ratio": 0.1, "extra": None},
+        {"id": "x", "title": "", "content": "", "tags": ["a", "b"], "nested": {"list": [[], {}]}},
+    ],
+    "settings": {"theme": "nebula", "locked": True},
+}
+
+
+def check_round_trips():
+    failures = []
+    for fmt in serialization.available_formats():
+        data = serialization.dumps(SAMPLE, fmt)
+        if serialization.loads(data) != SAMPLE:
+            failures.append(f"{fmt}: round trip changed the data")
+        if serialization.detect(data) != fmt:
+            failures.append(f"{fmt}: detected as {serialization.detect(data)}")
+    # Databases written by older versions are plain, possibly indented, JSON text
+    legacy = json.dumps(SAMPLE, indent=2).encode()
+    if serialization.loads(legacy) != SAMPLE:
+        failures.append("legacy JSON snapshot no longer loads")
+    for fmt in EXPORT_FORMATS:
+        if fmt.startswith('json'):
+            exported = export_notes(SAMPLE['notes'], fmt)
+            if list(iter_notes(exported)) != SAMPLE['notes']:
+                failures.append(f"{fmt} export does not import back")
+    if 'msgpack+gzip' in serialization.available_formats():
+        packed = io.BytesIO(serialization.dumps({"notes": SAMPLE['notes']}, 'msgpack+gzip'))
+        if list(iter_notes(packed)) != SAMPLE['notes']:
+            failures.append("msgpack+gzip file does not import back")
+    return failures
+
+
+def bench_snapshots(notes):
+    print(f"{'format':>14} {'size MB':>9} {'save s':>8} {'load s':>8}")
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in serialization.available_formats():
+            path = os.path.join(tmp, f"notes-{fmt}.db")
+            store = NoteStore(path, snapshot_format=fmt)
+            store.replace_all({"notes": notes, "settings": {}})
+            start = time.perf_counter()
+            store.compact(background=False)
+            saved = time.perf_counter() - start
+            size = os.path.getsize(path)
+
+            start = time.perf_counter()
+            reopened = NoteStore(path)
+            loaded = time.perf_counter() - start
+            if reopened.notes != store.notes:
+                failures.append(f"{fmt}: reopened store differs")
+            print(f"{fmt:>14} {size / 1e6:>9.2f} {saved:>8.3f} {loaded:>8.3f}")
+    return failures
+
+
+def main(count):
+    failures = check_round_trips()
+    failures += bench_snapshots(make_notes(count, random.Random(42)))
+    if failures:
+        sys.exit("serialization check failed:\n  " + "\n  ".join(failures))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
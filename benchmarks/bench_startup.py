@@ -0,0 +1,151 @@
+# Startup budget for app.py: cold import time and the warm-rerun data path.
+#
+#     python benchmarks/bench_startup.py [--notes N] [--cold-budget S] [--warm-budget MS]
+#
+# Cold start imports every module app.py imports at the top level in a fresh
+# interpreter (median of several runs) and checks that none of the heavy
+# optional dependencies come along. The warm rerun replays what each script
+# run does against an already-built store: refresh, one dashboard page,
+# tag counts, stats and the cached markdown for the page. Exits non-zero
+# when either budget is exceeded, so it can gate CI.
+import argparse
+import ast
+import os
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COLD_RUNS = 5
+WARM_RUNS = 50
+COLD_BUDGET_S = 1.5
+WARM_BUDGET_MS = 40.0
+PAGE_SIZE = 25
+
+# Must only be imported on first use (AI request, PDF export, preview,
+# vector index)
+HEAVY_MODULES = ('google.generativeai', 'reportlab', 'markdown', 'pygments', 'numpy')
+
+
+def app_imports():
+    with open(os.path.join(ROOT, 'app.py')) as f:
+        tree = ast.parse(f.read())
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            lines.append(ast.unparse(node))
+    return lines
+
+
+def cold_start():
+    child = "\n".join([
+        "import sys, time",
+        f"sys.path.insert(0, {ROOT!r})",
+        "start = time.perf_counter()",
+        *app_imports(),
+        "elapsed = time.perf_counter() - start",
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]",
+        "print(elapsed, ','.join(heavy))",
+    ])
+    timings, heavy = [], set()
+    for _ in range(COLD_RUNS):
+        result = subprocess.run([sys.executable, '-c', child], capture_output=True, text=True, cwd=ROOT)
+        if result.returncode != 0:
+            sys.exit(f"importing app.py's modules failed:\n{result.stderr}")
+        elapsed, loaded = result.stdout.split()[0], result.stdout.split()[1:]
+        timings.append(float(elapsed))
+        heavy.update(m for m in ''.join(loaded).split(',') if m)
+    return statistics.median(timings), sorted(heavy)
+
+
+def make_notes(count, rng):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+    notes = []
+    for i in range(count):
+        body = ' '.join(rng.choices(words, k=120))
+        tags = rng.sample(words[:50], 2)
+        notes.append({
+            'title': ' '.join(rng.choices(words, k=4)),
+            'content': f"{body}\n\n" + ' '.join(f"#{tag}" for tag in tags),
+            'tags': tags,
+            'timestamp': f"2024-01-01T00:00:{i % 60:02d}",
+            'pinned': i % 50 == 0,
+        })
+    return notes
+
+
+def warm_rerun(count):
+    from embeddings import HashingEmbedder, VectorIndex
+    from ids import new_id
+    from note_stats import NoteStats
+    from note_store import NoteStore
+    from render import MarkdownRenderer
+    from search_index import NoteOrder, SearchIndex, TagIndex
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'notes.json')
+        store = NoteStore(path)
+        with store.batch():
+            for note in make_notes(count, rng):
+                note['id'] = new_id()
+                store.put(note)
+        # Same indexes as get_store() in app.py
+        store.attach('search', SearchIndex(lookup=store.get))
+        store.attach('tags', TagIndex())
+        store.attach('stats', NoteStats())
+        store.attach('order', NoteOrder())
+        store.attach('vectors', VectorIndex(os.path.join(tmp, 'vectors.npy'), HashingEmbedder()))
+        renderer = MarkdownRenderer()
+
+        def rerun():
+            store.refresh()
+            store.all_notes()
+            ids, _ = store.page(limit=PAGE_SIZE)
+            store.tag_counts()
+            stats = store.indexes['stats']
+            stats.total_notes, stats.total_words, stats.pinned_count
+            for note_id in ids:
+                renderer.render(store.notes[note_id]['content'])
+
+        rerun()  # first run fills the render cache, as the first session does
+        timings = []
+        for _ in range(WARM_RUNS):
+            start = time.perf_counter()
+            rerun()
+            timings.append((time.perf_counter() - start) * 1000)
+        store.indexes['vectors'].flush()
+        return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=5000)
+    parser.add_argument('--cold-budget', type=float, default=COLD_BUDGET_S, help="seconds")
+    parser.add_argument('--warm-budget', type=float, default=WARM_BUDGET_MS, help="milliseconds")
+    args = parser.parse_args()
+
+    cold, heavy = cold_start()
+    warm = warm_rerun(args.notes)
+    print(f"cold import   {cold:8.3f} s   (budget {args.cold_budget} s)")
+    print(f"warm rerun    {warm:8.2f} ms  (budget {args.warm_budget} ms, {args.notes} notes)")
+
+    failures = []
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if cold > args.cold_budget:
+        failures.append(f"cold import took {cold:.3f} s")
+    if warm > args.warm_budget:
+        failures.append(f"warm rerun took {warm:.2f} ms")
+    if failures:
+        sys.exit("startup regression: " + "; ".join(failures))
+
+
+if __name__ == '__main__':
+    main()
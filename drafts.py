@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from serialization import json_dumps, json_loads
+
+AUTOSAVE_SECONDS = 2.0  # at most one draft write per note per interval
+# Drafts staged this recently belong to an editor that is still open, not
+# to a crashed or closed one, and are not offered for recovery
+ACTIVE_SECONDS = 60.0
+
+
+class DraftJournal:
+    # Unsaved editor content, one small JSON file per note in `directory`,
+    # kept apart from the note store (drafts never rewrite the database).
+    #
+    # stage() only records the latest text in memory and wakes the writer
+    # thread, so it costs the rerun nothing measurable. The writer is a
+    # throttle: a note's first draft is written at once, and anything staged
+    # within the next `interval` seconds is coalesced into one trailing
+    # write. Each write is a fsynced temp file renamed over the old draft,
+    # so a crash leaves the previous draft or the new one.
+
+    def __init__(self, directory, interval=AUTOSAVE_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.error = None
+        self.writes = 0
+        self._pending = {}  # note id -> draft waiting to be written
+        self._written = {}  # note id -> monotonic time of its last write
+        self._staged = {}   # note id -> monotonic time it was last staged
+        self._cond = threading.Condition()
+        # Held across a write batch and by discard(), so a draft being
+        # written cannot reappear after it was discarded
+        self._io_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def _path(self, note_id):
+        return os.path.join(self.directory, f"{note_id}.json")
+
+    # --- Staging ---
+
+    def stage(self, note_id, title, content, version=None):
+        # `version` is the stored version the draft was edited from (None
+        # for a note that was never saved)
+        draft = {"id": note_id, "title": title, "content": content, "version": version,
+                 "saved_at": datetime.now().isoformat()}
+        with self._cond:
+            self._pending[note_id] = draft
+            self._staged[note_id] = time.monotonic()
+            self._cond.notify()
+
+    def discard(self, note_id):
+        # Drops a note's draft, staged or written (after a save, or on request).
+        # Cheap when there is none, so the editor can call it on every rerun.
+        with self._cond:
+            known = note_id in self._staged or note_id in self._written
+        if not known and not os.path.exists(self._path(note_id)):
+            return
+        with self._io_lock:
+            with self._cond:
+                self._pending.pop(note_id, None)
+                self._staged.pop(note_id, None)
+                written = self._written.pop(note_id, None)
+            if written is not None or os.path.exists(self._path(note_id)):
+                try:
+                    os.remove(self._path(note_id))
+                except FileNotFoundError:
+                    pass
+
+    def flush(self):
+        # Writes every staged draft now, whatever the interval
+        with self._io_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                now = time.monotonic()
+                self._written.update((note_id, now) for note_id in batch)
+            self._write_all(batch)
+
+    # --- Writer thread ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    due = [self._written.get(note_id, float('-inf')) + self.interval
+                           for note_id in self._pending]
+                    if due and min(due) <= now:
+                        break
+                    self._cond.wait(min(due) - now if due else None)
+            with self._io_lock:
+                with self._cond:
+                    now = time.monotonic()
+                    ready = [note_id for note_id in self._pending
+                             if self._written.get(note_id, float('-inf')) + self.interval <= now]
+                    batch = {note_id: self._pending.pop(note_id) for note_id in ready}
+                    self._written.update((note_id, now) for note_id in batch)
+                self._write_all(batch)
+
+    def _write_all(self, batch):
+        for note_id, draft in batch.items():
+            path = self._path(note_id)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(json_dumps(draft))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                self.writes += 1
+            except OSError as e:
+                self.error = str(e)
+
+    # --- Recovery ---
+
+    def load(self, note_id):
+        # The draft for `note_id`: the staged one if any, else the one on disk
+        with self._cond:
+            draft = self._pending.get(note_id)
+        if draft is not None:
+            return draft
+        try:
+            with open(self._path(note_id), 'rb') as f:
+                return json_loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def recoverable(self):
+        # Drafts on disk not being edited right now, newest first: what a
+        # crashed server or a closed tab left behind
+        now = time.monotonic()
+        with self._cond:
+            active = {note_id for note_id, staged in self._staged.items()
+                      if now - staged < ACTIVE_SECONDS}
+        drafts = []
+        for entry in os.scandir(self.directory):
+            note_id, ext = os.path.splitext(entry.name)
+            if ext != '.json' or note_id in active:
+                continue
+            draft = self.load(note_id)
+            if draft is not None:
+                drafts.append(draft)
+        drafts.sort(key=lambda draft: draft.get('saved_at', ''), reverse=True)
+        return drafts
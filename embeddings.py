@@ -0,0 +1,316 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from note_stats import content_hash
+from search_index import tokenize
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+# Very common words carry no meaning for similarity and would dominate the
+# hashed vectors
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its of on or so "
+    "that the their there this to was we were what when which who will with you your".split()
+)
+
+META_FLUSH_DELAY = 1.0  # seconds; row metadata is written at most this often
+INITIAL_CAPACITY = 1024
+
+
+def note_text(note):
+    return f"{note.get('title', '')}\n{note.get('content', '')}"
+
+
+def _digest(note):
+    # Rows are keyed on the embedded text, so a title edit re-embeds too
+    return content_hash(note_text(note))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbedder:
+    # Local, CPU-only embedder: sublinear term frequencies feature-hashed
+    # (crc32, signed) into a fixed number of buckets, then L2-normalised
+    remote = False
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(t for t in tokenize(text) if t not in STOPWORDS)
+            for term, tf in counts.items():
+                h = zlib.crc32(term.encode())
+                sign = 1.0 if h & 0x80000000 else -1.0
+                out[row, h % self.dim] += sign * (1.0 + math.log(tf))
+        return _normalize(out)
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+
+class GeminiEmbedder:
+    # Gemini text embeddings; network-bound, so the index embeds on a worker
+    remote = True
+
+    def __init__(self, model="models/text-embedding-004", dim=768, api_key=None):
+        self.model = model
+        self.api_key = api_key
+        self.dim = dim
+        self.name = f"gemini-{model.rsplit('/', 1)[-1]}"
+
+    def _embed(self, texts, task_type):
+        import google.generativeai as genai
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+        result = genai.embed_content(model=self.model, content=list(texts), task_type=task_type)
+        return _normalize(np.asarray(result['embedding'], dtype=np.float32).reshape(len(texts), self.dim))
+
+    def embed(self, texts):
+        return self._embed(texts, "retrieval_document")
+
+    def embed_query(self, text):
+        return self._embed([text], "retrieval_query")[0]
+
+
+class VectorIndex:
+    # Note embeddings in a memory-mapped float32 matrix (one row per note)
+    # plus a small JSON file mapping note ids to rows and the content hash each
+    # row was computed from. A restart only re-embeds notes that changed.
+    #
+    # Rows are allocated without any cross-process coordination, so only one
+    # process at a time uses the files: it holds an exclusive lock on them
+    # for as long as it runs. Any other process works on a private matrix in
+    # a temporary directory and embeds its notes afresh.
+
+    def __init__(self, path, embedder, batch_size=64):
+        self.path = path
+        self.meta_path = os.path.splitext(path)[0] + ".json"
+        self._owner_fd = None
+        self._private_dir = None
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._rows = {}        # note id -> [row, content hash]
+        self._row_ids = {}     # row -> note id
+        self._free = []
+        self._high_water = 0
+        self._flush_timer = None
+        self._closed = False
+        # Remote embedders and large (re)builds run here, off the save path;
+        # ids queued for embedding are tracked so a delete can cancel them
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._queued = set()
+        self._claim()
+        self._load()
+
+    # --- Storage ---
+
+    def _claim(self):
+        if fcntl is None:
+            return
+        fd = os.open(os.path.splitext(self.path)[0] + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self._private_dir = tempfile.TemporaryDirectory(prefix="driftnotes-vectors-")
+            self.path = os.path.join(self._private_dir.name, os.path.basename(self.path))
+            self.meta_path = os.path.splitext(self.path)[0] + ".json"
+            return
+        self._owner_fd = fd  # held, and the lock with it, until the process exits
+
+    def close(self):
+        # Finishes queued embeddings, writes the metadata once more and gives
+        # up ownership of the shared files; nothing is written after this
+        self._worker.shutdown(wait=True)
+        with self._lock:
+            self._closed = True
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self.flush()
+            if self._owner_fd is not None:
+                os.close(self._owner_fd)
+                self._owner_fd = None
+
+    @property
+    def private(self):
+        # True when another process owns the shared vector files
+        return self._private_dir is not None
+
+    def _load(self):
+        meta = None
+        if os.path.exists(self.meta_path) and os.path.exists(self.path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get('embedder') != self.embedder.name or meta.get('dim') != self.embedder.dim:
+                meta = None  # different embedder: start over
+        if meta is None:
+            self.matrix = np.lib.format.open_memmap(
+                self.path, mode='w+', dtype=np.float32, shape=(INITIAL_CAPACITY, self.embedder.dim))
+            self._rows = {}
+        else:
+            self.matrix = np.load(self.path, mmap_mode='r+')
+            self._rows = meta['rows']
+        self._row_ids = {row: note_id for note_id, (row, _) in self._rows.items()}
+        used = set(self._row_ids)
+        self._high_water = max(used) + 1 if used else 0
+        self._free = sorted(set(range(self._high_water)) - used, reverse=True)
+        self._live = np.zeros(len(self.matrix), dtype=bool)
+        if used:
+            self._live[list(used)] = True
+
+    def _grow(self, capacity):
+        tmp_path = self.path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float32, shape=(capacity, self.embedder.dim))
+        grown[:len(self.matrix)] = self.matrix
+        grown.flush()
+        del grown
+        self.matrix.flush()
+        os.replace(tmp_path, self.path)
+        self.matrix = np.load(self.path, mmap_mode='r+')
+        live = np.zeros(capacity, dtype=bool)
+        live[:len(self._live)] = self._live
+        self._live = live
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if self._high_water == len(self.matrix):
+            self._grow(len(self.matrix) * 2)
+        self._high_water += 1
+        return self._high_water - 1
+
+    def _schedule_flush(self):
+        # Debounced: bursts of saves produce one metadata write
+        if self._flush_timer is None and not self._closed:
+            self._flush_timer = threading.Timer(META_FLUSH_DELAY, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        # A timer that fired just as close() ran has nothing left to do
+        with self._lock:
+            if not self._closed:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush_timer = None
+            self.matrix.flush()
+            tmp_path = self.meta_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"embedder": self.embedder.name, "dim": self.embedder.dim, "rows": self._rows}, f)
+            os.replace(tmp_path, self.meta_path)
+
+    # --- Index protocol (see NoteStore.attach) ---
+
+    def rebuild(self, notes):
+        # Drops rows for deleted notes and embeds only new or changed notes
+        with self._lock:
+            current = {note['id'] for note in notes}
+            for note_id in [i for i in self._rows if i not in current]:
+                self._remove(note_id)
+            stale = [note for note in notes if self._is_stale(note)]
+        self._embed(stale)
+
+    def add(self, note):
+        if self._is_stale(note):
+            self._embed([note])
+
+    def remove(self, note_id):
+        with self._lock:
+            self._remove(note_id)
+            self._schedule_flush()
+
+    def _remove(self, note_id):
+        self._queued.discard(note_id)
+        entry = self._rows.pop(note_id, None)
+        if entry is not None:
+            self.matrix[entry[0]] = 0
+            self._live[entry[0]] = False
+            self._row_ids.pop(entry[0], None)
+            self._free.append(entry[0])
+
+    def _is_stale(self, note):
+        entry = self._rows.get(note['id'])
+        return entry is None or entry[1] != _digest(note)
+
+    def _embed(self, notes):
+        if not notes:
+            return
+        with self._lock:
+            self._queued.update(note['id'] for note in notes)
+        if self.embedder.remote or len(notes) > self.batch_size:
+            self._worker.submit(self._embed_now, list(notes))
+        else:
+            self._embed_now(notes)
+
+    def _embed_now(self, notes):
+        for start in range(0, len(notes), self.batch_size):
+            chunk = notes[start:start + self.batch_size]
+            vectors = self.embedder.embed([note_text(note) for note in chunk])
+            with self._lock:
+                for note, vector in zip(chunk, vectors):
+                    if note['id'] not in self._queued:
+                        continue  # deleted while waiting
+                    self._queued.discard(note['id'])
+                    entry = self._rows.get(note['id'])
+                    row = entry[0] if entry is not None else self._allocate()
+                    self.matrix[row] = vector
+                    self._live[row] = True
+                    self._row_ids[row] = note['id']
+                    self._rows[note['id']] = [row, _digest(note)]
+        with self._lock:
+            self._schedule_flush()
+
+    # --- Queries ---
+
+    def _top_k(self, scores, k, exclude=()):
+        scores = np.where(self._live[:len(scores)], scores, -np.inf)
+        for note_id in exclude:
+            entry = self._rows.get(note_id)
+            if entry is not None:
+                scores[entry[0]] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._row_ids[row], float(scores[row])) for row in top]
+
+    def search_many(self, texts, k=20):
+        # Batched cosine top-k: one matrix product for all query texts
+        queries = np.stack([self.embedder.embed_query(text) for text in texts])
+        with self._lock:
+            scores = queries @ self.matrix[:self._high_water].T
+            return [self._top_k(row, k) for row in scores]
+
+    def search(self, text, k=20):
+        return self.search_many([text], k)[0]
+
+    def related(self, note_id, k=5):
+        with self._lock:
+            entry = self._rows.get(note_id)
+            if entry is None:
+                return []
+            scores = self.matrix[:self._high_water] @ self.matrix[entry[0]]
+            return self._top_k(scores, k, exclude=(note_id,))
@@ -0,0 +1,215 @@
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from render import MarkdownRenderer
+from serialization import compress_stream, json_dumps, zstandard
+
+SPOOL_BYTES = 8 * 1024 * 1024  # exports larger than this spill to disk
+POOL_THRESHOLD = 200           # fewer notes than this render in-process
+POOL_WINDOW = 512              # notes in flight in the process pool at once
+
+# format -> (label, MIME type, file extension)
+FORMATS = {
+    "json": ("JSON backup", "application/json", ".json"),
+    "json-gzip": ("JSON backup (gzip)", "application/gzip", ".json.gz"),
+    "ndjson": ("Newline-delimited JSON", "application/x-ndjson", ".ndjson"),
+    "markdown": ("Markdown files (zip)", "application/zip", ".zip"),
+    "pdf": ("PDF with table of contents", "application/pdf", ".pdf"),
+}
+if zstandard is not None:
+    FORMATS["json-zstd"] = ("JSON backup (zstd)", "application/zstd", ".json.zst")
+
+
+def export_notes(notes, fmt, renderer=None, workers=None):
+    # Writes `notes` in `fmt` to a spooled temporary file and returns it
+    # rewound; the caller closes it
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    fmt, _, compression = fmt.partition("-")
+    if fmt == "json" and compression:
+        with compress_stream(out, compression) as stream:
+            write_json(notes, stream)
+    elif fmt == "json":
+        write_json(notes, out)
+    elif fmt == "ndjson":
+        write_ndjson(notes, out)
+    elif fmt == "markdown":
+        write_markdown_zip(notes, out)
+    elif fmt == "pdf":
+        write_pdf(notes, out, renderer, workers)
+    else:
+        raise ValueError(f"unknown export format: {fmt}")
+    out.seek(0)
+    return out
+
+
+def export_filename(fmt):
+    return f"noirnotes_export_{datetime.now().strftime('%Y%m%d')}{FORMATS[fmt][2]}"
+
+
+# --- Text formats ---
+
+def write_json(notes, out):
+    # Same document as the original single-string export, written note by note
+    out.write(b'{\n  "notes": [')
+    for i, note in enumerate(notes):
+        out.write(b',\n    ' if i else b'\n    ')
+        out.write(json_dumps(note))
+    out.write(b'\n  ],\n  "exported_at": ')
+    out.write(json_dumps(datetime.now().isoformat()))
+    out.write(f',\n  "total_notes": {len(notes)}\n}}\n'.encode())
+
+
+def write_ndjson(notes, out):
+    for note in notes:
+        out.write(json_dumps(note))
+        out.write(b'\n')
+
+
+def _slug(title):
+    slug = re.sub(r'[^\w\- ]+', '', title or '').strip().replace(' ', '-')
+    return slug[:60] or "untitled"
+
+
+def write_markdown_zip(notes, out):
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for note in notes:
+            # The id keeps file names unique when titles repeat
+            name = f"{_slug(note.get('title'))}-{note['id']}.md"
+            archive.writestr(name, f"# {note.get('title', '')}\n\n{note.get('content', '')}\n")
+
+
+# --- PDF ---
+# ReportLab is imported by the functions below, only when a PDF is made
+
+# HTML from the markdown renderer mapped onto the small tag set ReportLab
+# paragraphs understand; anything else is dropped, keeping its text
+_PDF_TAGS = [
+    (re.compile(r'<(/?)h[1-6][^>]*>'), r'<\1b>'),
+    (re.compile(r'<(/?)strong>'), r'<\1b>'),
+    (re.compile(r'<(/?)em>'), r'<\1i>'),
+    (re.compile(r'<code>'), '<font face="Courier">'),
+    (re.compile(r'</code>'), '</font>'),
+    (re.compile(r'<li>'), '• '),
+    (re.compile(r'</li>'), '<br/>'),
+    (re.compile(r'<br\s*/?>'), '<br/>'),
+]
+_KEEP_RE = re.compile(r'<(?!/?(?:b|i|font|a)\b|br/>)[^>]*>')
+
+
+def pdf_markup(html):
+    for pattern, replacement in _PDF_TAGS:
+        html = pattern.sub(replacement, html)
+    html = _KEEP_RE.sub('', html)
+    # Line breaks inside preformatted blocks would otherwise collapse
+    return html.strip().replace('\n', '<br/>')
+
+
+_worker_renderer = None
+
+
+def _render_worker(text):
+    # Runs in a pool worker: (block, html) pairs, for the parent process to
+    # add to its renderer cache
+    global _worker_renderer
+    if _worker_renderer is None:
+        _worker_renderer = MarkdownRenderer()
+    blocks = _worker_renderer.split(text)
+    return list(zip(blocks, _worker_renderer.blocks(text)))
+
+
+def _pdf_blocks(note, html_blocks):
+    blocks = [pdf_markup(html) for html in html_blocks]
+    return note.get('title', ''), [block for block in blocks if block]
+
+
+def _rendered(notes, renderer, workers):
+    # Yields (title, blocks) per note in order, rendered through `renderer`
+    # so exports share the preview cache. Big exports send the notes that
+    # are not fully cached to a process pool, a bounded window at a time,
+    # and cache what comes back.
+    renderer = renderer or MarkdownRenderer()
+    if len(notes) < POOL_THRESHOLD or workers == 0:
+        for note in notes:
+            yield _pdf_blocks(note, renderer.blocks(note.get('content', '')))
+        return
+    it = iter(notes)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            window = list(islice(it, POOL_WINDOW))
+            if not window:
+                break
+            cached = [renderer.cached_blocks(note.get('content', '')) for note in window]
+            missing = [note.get('content', '') for note, html in zip(window, cached) if html is None]
+            rendered = pool.map(_render_worker, missing, chunksize=32)
+            for note, html in zip(window, cached):
+                if html is None:
+                    pairs = next(rendered)
+                    for block, block_html in pairs:
+                        renderer.remember(block, block_html)
+                    html = [block_html for _, block_html in pairs]
+                yield _pdf_blocks(note, html)
+
+
+def _after_flowable(doc, flowable):
+    # Feeds note headings to the table of contents and PDF outline
+    key = getattr(flowable, '_toc_key', None)
+    if key is not None:
+        # The outline takes plain text; the TOC entry is parsed as markup
+        text = flowable.getPlainText()
+        doc.canv.bookmarkPage(key)
+        doc.canv.addOutlineEntry(text, key, 0)
+        doc.notify('TOCEntry', (0, escape(text), doc.page, key))
+
+
+def _styles():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    styles = getSampleStyleSheet()
+    title = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18,
+                           spaceAfter=30, textColor=colors.black)
+    content = ParagraphStyle('CustomContent', parent=styles['Normal'], fontSize=11,
+                             spaceAfter=12, textColor=colors.black)
+    return title, content
+
+
+def write_pdf(notes, out, renderer=None, workers=None, toc=None):
+    # One document for all notes, each starting on a new page. With more
+    # than one note a table of contents comes first.
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer
+    from reportlab.platypus.tableofcontents import TableOfContents
+
+    toc = len(notes) > 1 if toc is None else toc
+    doc = SimpleDocTemplate(out, pagesize=letter, title="DriftNotes export")
+    doc.afterFlowable = lambda flowable: _after_flowable(doc, flowable)
+    title_style, content_style = _styles()
+    story = []
+    if toc:
+        contents = TableOfContents()
+        contents.levelStyles = [ParagraphStyle('TOCEntry', fontSize=11, leading=14)]
+        story += [Paragraph("Contents", title_style), contents]
+
+    for i, (title, blocks) in enumerate(_rendered(notes, renderer, workers)):
+        if story:
+            story.append(PageBreak())
+        heading = Paragraph(escape(title), title_style)
+        heading._toc_key = f"note{i}"
+        story += [heading, Spacer(1, 12)]
+        for block in blocks:
+            try:
+                story.append(Paragraph(block, content_style))
+            except ValueError:
+                # Markup ReportLab still rejects; keep the text readable
+                story.append(Paragraph(escape(re.sub(r'<[^>]+>', '', block)), content_style))
+
+    if toc:
+        doc.multiBuild(story)
+    else:
+        doc.build(story)
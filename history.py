@@ -0,0 +1,315 @@
+import difflib
+import os
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from serialization import json_dumps, json_loads
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+SNAPSHOT_EVERY = 10  # a full copy at least every this many revisions of a note
+
+# Retention: a note's newest KEEP_RECENT revisions and everything younger
+# than KEEP_DAYS are kept, then the last revision of each day up to
+# KEEP_DAILY_DAYS. History of deleted notes goes once it is KEEP_DAYS old.
+KEEP_RECENT = 20
+KEEP_DAYS = 30
+KEEP_DAILY_DAYS = 365
+
+# Pruning runs once the file is this big and has doubled since the last prune
+MIN_PRUNE_BYTES = 4 * 1024 * 1024
+
+# One saved state of a note; `full` marks a complete copy rather than a
+# delta against the revision before it
+Revision = namedtuple('Revision', 'number at title offset length full')
+
+
+# --- Deltas ---
+
+def make_delta(old, new):
+    # Line-based edit script from `old` to `new`: [start, end] copies those
+    # lines of `old`, a string is inserted as it is
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    lines = old.splitlines(keepends=True)
+    return ''.join(''.join(lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def retained(revisions, now, alive=True):
+    # Numbers of the revisions the retention policy keeps
+    recent = now - timedelta(days=KEEP_DAYS)
+    daily = now - timedelta(days=KEEP_DAILY_DAYS)
+    if not alive:
+        return {rev.number for rev in revisions if _time(rev) >= recent}
+    keep = {rev.number for rev in revisions[-KEEP_RECENT:]}
+    days = set()
+    for rev in reversed(revisions):
+        at = _time(rev)
+        if at >= recent:
+            keep.add(rev.number)
+        elif at >= daily and rev.at[:10] not in days:
+            keep.add(rev.number)
+            days.add(rev.at[:10])
+    return keep
+
+
+def _time(rev):
+    try:
+        return datetime.fromisoformat(rev.at)
+    except (TypeError, ValueError):
+        return datetime.max  # unreadable timestamps are never pruned
+
+
+# --- History file ---
+
+class NoteHistory:
+    # Revision history for every note in one append-only file next to the
+    # database, kept apart from the note store so the notes loaded on each
+    # rerun stay the same size. Each revision is a line-based delta against
+    # the one before, with a full copy every SNAPSHOT_EVERY revisions so any
+    # revision is rebuilt from at most that many records.
+    #
+    # record() only queues the saved note: diffing and writing happen on a
+    # background thread. The file is read (metadata only) on first use, and
+    # several processes may append to it under an fcntl lock.
+
+    def __init__(self, path, exists=None, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.snapshot_every = snapshot_every
+        self.exists = exists  # note_id -> bool, to prune history of deleted notes
+        self.error = None
+        self._revisions = None  # note id -> [Revision], oldest first
+        self._offset = 0
+        self._seen = None
+        self._pruned_size = 0
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()  # not self._lock: the writer holds that while diffing
+
+    # --- Locking ---
+
+    @contextmanager
+    def _locked(self, shared=False):
+        # Same scheme as NoteStore._locked: the flock is taken once per thread
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+            finally:
+                os.close(fd)
+
+    # --- Reading ---
+
+    def _catch_up(self):
+        # Reads revisions appended since we last looked; a file that shrank or
+        # was replaced (pruned by another process) is read again from the start
+        seen = _stat(self.path)
+        if self._revisions is not None and seen == self._seen:
+            return
+        if (self._revisions is None or seen is None or self._seen is None
+                or seen[0] != self._seen[0] or seen[1] < self._offset):
+            self._revisions = {}
+            self._offset = 0
+        if seen is not None:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # torn write from a crash, truncated at the next append
+                    record = json_loads(line)
+                    self._revisions.setdefault(record['id'], []).append(Revision(
+                        record['n'], record['at'], record['title'], self._offset, len(line), 'full' in record))
+                    self._offset += len(line)
+        if not self._pruned_size:
+            self._pruned_size = self._offset
+        self._seen = seen
+
+    def revisions(self, note_id):
+        # A note's revisions, oldest first
+        with self._locked(shared=True):
+            self._catch_up()
+            return list(self._revisions.get(note_id, ()))
+
+    def content(self, note_id, number):
+        # (title, content) of one revision
+        with self._locked(shared=True):
+            self._catch_up()
+            revisions = self._revisions.get(note_id, [])
+            for index, rev in enumerate(revisions):
+                if rev.number == number:
+                    return rev.title, self._rebuild(revisions, index)
+            raise KeyError(f"note {note_id} has no revision {number}")
+
+    def _rebuild(self, revisions, index):
+        start = index
+        while not revisions[start].full:
+            start -= 1
+        text = None
+        with open(self.path, 'rb') as f:
+            for rev in revisions[start:index + 1]:
+                f.seek(rev.offset)
+                record = json_loads(f.read(rev.length))
+                text = record['full'] if rev.full else apply_delta(text, record['delta'])
+        return text
+
+    # --- Writing ---
+
+    def record(self, note, previous=None):
+        # Queues a revision for `note` as just saved and returns at once.
+        # `previous`, the note as it was before the save, becomes the first
+        # revision of a note that has no history yet.
+        self._queue.put((note, previous))
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def flush(self):
+        # Waits until every queued revision is written
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            note, previous = self._queue.get()
+            try:
+                self._write(note, previous)
+            except Exception as e:
+                self.error = str(e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, note, previous):
+        with self._locked():
+            self._catch_up()
+            revisions = self._revisions.get(note['id'], [])
+            states = [note] if revisions or previous is None else [previous, note]
+            title = content = None
+            since_full = 0
+            if revisions:
+                title = revisions[-1].title
+                content = self._rebuild(revisions, len(revisions) - 1)
+                since_full = next(i for i, rev in enumerate(reversed(revisions)) if rev.full) + 1
+            number = revisions[-1].number if revisions else 0
+            lines = []
+            for state in states:
+                new_title, new_content = state.get('title', ''), state.get('content', '')
+                if (new_title, new_content) == (title, content):
+                    continue  # saved without touching the text, e.g. pinned
+                number += 1
+                at = state.get('last_updated') or state.get('timestamp') or datetime.now().isoformat()
+                line, full = self._encode(note['id'], number, at, new_title, new_content, content, since_full)
+                since_full = 1 if full else since_full + 1
+                lines.append((Revision(number, at, new_title, 0, len(line), full), line))
+                title, content = new_title, new_content
+            if lines:
+                self._append(note['id'], lines)
+        if self._offset >= max(MIN_PRUNE_BYTES, 2 * self._pruned_size):
+            self.prune()
+
+    def _encode(self, note_id, number, at, title, content, base, since_full):
+        # (line, is full copy): a delta against `base` unless the chain since
+        # the last full copy is long enough or the delta saves nothing
+        record = {"id": note_id, "n": number, "at": at, "title": title}
+        if base is not None and since_full < self.snapshot_every:
+            delta = make_delta(base, content)
+            if len(json_dumps(delta)) < len(content):
+                record["delta"] = delta
+        if "delta" not in record:
+            record["full"] = content
+        return json_dumps(record) + b'\n', "full" in record
+
+    def _append(self, note_id, lines):
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            # Drop a torn tail left by a crashed writer so we start on a clean line
+            if os.fstat(fd).st_size != self._offset:
+                os.ftruncate(fd, self._offset)
+            os.lseek(fd, self._offset, os.SEEK_SET)
+            os.write(fd, b''.join(line for _, line in lines))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        revisions = self._revisions.setdefault(note_id, [])
+        for rev, line in lines:
+            revisions.append(rev._replace(offset=self._offset))
+            self._offset += len(line)
+        self._seen = _stat(self.path)
+
+    # --- Pruning ---
+
+    def prune(self, now=None):
+        # Rewrites the file with only the revisions the retention policy
+        # keeps, re-encoding the deltas between them. Returns how many went.
+        now = now or datetime.now()
+        with self._locked():
+            self._catch_up()
+            if not self._offset:
+                return 0
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            kept = {}
+            dropped = 0
+            offset = 0
+            with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for note_id, revisions in self._revisions.items():
+                    alive = self.exists is None or self.exists(note_id)
+                    keep = retained(revisions, now, alive)
+                    dropped += len(revisions) - len(keep)
+                    text = base = None
+                    since_full = 0
+                    for rev in revisions:
+                        src.seek(rev.offset)
+                        record = json_loads(src.read(rev.length))
+                        text = record['full'] if rev.full else apply_delta(text, record['delta'])
+                        if rev.number not in keep:
+                            continue
+                        line, full = self._encode(note_id, rev.number, rev.at, rev.title, text, base, since_full)
+                        since_full = 1 if full else since_full + 1
+                        kept.setdefault(note_id, []).append(Revision(rev.number, rev.at, rev.title, offset, len(line), full))
+                        dst.write(line)
+                        offset += len(line)
+                        base = text
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, self.path)
+            self._revisions = kept
+            self._offset = self._pruned_size = offset
+            self._seen = _stat(self.path)
+            return dropped
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size)
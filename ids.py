@@ -0,0 +1,81 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+# ULID-style ids: 26 Crockford base32 characters, a 48-bit millisecond
+# timestamp followed by 80 random bits. They sort by creation time as plain
+# strings and are unique across processes without coordination.
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 26
+_ID_RE = re.compile(f"^[{ALPHABET}]{{{ID_LENGTH}}}$")
+_RANDOM_MAX = (1 << 80) - 1
+
+_lock = threading.Lock()
+_last = (0, 0)  # (ms, random part) of the last id from new_id()
+
+
+def _encode(ms, rand):
+    value = (ms << 80) | rand
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def new_id():
+    # Strictly increasing within a process: ids made in the same millisecond
+    # increment the random part instead of drawing a new one
+    global _last
+    with _lock:
+        ms = int(time.time() * 1000)
+        last_ms, last_rand = _last
+        if ms <= last_ms and last_rand < _RANDOM_MAX:
+            ms, rand = last_ms, last_rand + 1
+        else:
+            rand = int.from_bytes(os.urandom(10), 'big')
+        _last = (ms, rand)
+    return _encode(ms, rand)
+
+
+def id_at(ms, seed):
+    # Deterministic id for a given time: the random part is derived from
+    # `seed`, so every process computes the same id for the same input
+    rand = int.from_bytes(hashlib.sha1(seed.encode()).digest()[:10], 'big')
+    return _encode(max(0, int(ms)), rand)
+
+
+def is_id(value):
+    return isinstance(value, str) and _ID_RE.match(value) is not None
+
+
+def id_time(value):
+    # Creation time encoded in an id, as a datetime
+    ms = 0
+    for char in value[:10]:
+        ms = ms * 32 + ALPHABET.index(char)
+    return datetime.fromtimestamp(ms / 1000)
+
+
+def _ms(iso):
+    try:
+        return datetime.fromisoformat(iso).timestamp() * 1000
+    except (TypeError, ValueError):
+        return 0
+
+
+def migrated_id(note, position=None):
+    # Replacement for a pre-ULID id, placed at the note's creation time.
+    # `position` tells apart notes that shared one old id.
+    seed = note['id'] if position is None else f"{note['id']}#{position}"
+    return id_at(_ms(note.get('timestamp')), seed)
+
+
+def note_rev(note):
+    # Sort key for "most recently updated": an id at the last update time,
+    # unique per (note, update)
+    updated = note.get('last_updated') or note.get('timestamp') or ''
+    return id_at(_ms(updated), f"{note['id']}@{updated}")
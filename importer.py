@@ -0,0 +1,243 @@
+import json
+import re
+from datetime import datetime
+
+import serialization
+from note_stats import DERIVED_FIELDS, content_hash
+
+CHUNK_BYTES = 1024 * 1024
+BATCH_SIZE = 500  # notes per store batch (one locked append each)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+_DOCUMENT_RE = re.compile(r'\{\s*"notes"\s*:')
+
+
+def dedup_key(note):
+    # Notes with the same title and content are the same note, whatever
+    # their ids or timestamps
+    return note.get('title', ''), content_hash(note.get('content', ''))
+
+
+# --- Incremental parsing ---
+
+class _Reader:
+    # Text buffer over a binary file, refilled a chunk at a time
+    def __init__(self, fileobj, chunk=CHUNK_BYTES, head=b""):
+        self.fileobj = fileobj
+        self.chunk = chunk
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._pending = head
+
+    def fill(self):
+        data = self.fileobj.read(self.chunk)
+        if not data:
+            self.eof = True
+            data, self._pending = self._pending, b""
+            self.buffer = self.buffer[self.pos:] + data.decode('utf-8')
+        else:
+            data, self._pending = self._pending + data, b""
+            # Keep a multi-byte character split across chunks for the next read
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                if e.start < len(data) - 3:
+                    raise
+                text, self._pending = data[:e.start].decode('utf-8'), data[e.start:]
+            self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+    def skip(self, chars=_WHITESPACE):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def value(self):
+        # Decodes the next complete JSON value, reading more input as needed
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                self.fill()  # a number may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def find(self, needle):
+        while True:
+            index = self.buffer.find(needle, self.pos)
+            if index >= 0:
+                self.pos = index + len(needle)
+                return True
+            if self.eof:
+                return False
+            # Keep enough of the tail to match a needle split across chunks
+            self.pos = max(self.pos, len(self.buffer) - len(needle))
+            self.fill()
+
+
+def iter_notes(fileobj):
+    # Yields notes one at a time from an export: the JSON backup document
+    # ({"notes": [...], ...}), a bare JSON array, or newline-delimited JSON.
+    # Only one note is decoded at a time, never the whole file. Gzip and zstd
+    # compressed exports are decompressed on the fly; a msgpack export has no
+    # incremental decoder here and is decoded whole.
+    stream = serialization.open_stream(fileobj)
+    head = stream.read(64)
+    if serialization.sniff_encoding(head) == 'msgpack':
+        value = serialization.loads(head + stream.read())
+        yield from value.get('notes', []) if isinstance(value, dict) else value
+        return
+    reader = _Reader(stream, head=head)
+    first = reader.skip()
+    if first == '[':
+        reader.pos += 1
+        yield from _iter_array(reader)
+        return
+    if first != '{':
+        if first:
+            raise ValueError("not a DriftNotes export")
+        return
+    if not _is_document(reader):
+        # Newline-delimited notes; a backup document whose "notes" key is not
+        # first ends up here too and is decoded whole
+        while reader.skip():
+            value = reader.value()
+            if isinstance(value, dict) and isinstance(value.get('notes'), list):
+                yield from value['notes']
+            else:
+                yield value
+        return
+    reader.find('"notes"')
+    reader.skip()
+    reader.pos += 1  # the colon
+    if reader.skip() != '[':
+        raise ValueError("export notes are not a list")
+    reader.pos += 1
+    yield from _iter_array(reader)
+
+
+def _is_document(reader):
+    # The backup document opens with its "notes" key; NDJSON opens with a note
+    while len(reader.buffer) - reader.pos < 64 and not reader.eof:
+        reader.fill()
+    return _DOCUMENT_RE.match(reader.buffer, reader.pos) is not None
+
+
+def _iter_array(reader):
+    while True:
+        char = reader.skip(_WHITESPACE + ',')
+        if char == ']':
+            return
+        if not char:
+            raise ValueError("export ended inside the notes list")
+        yield reader.value()
+
+
+# --- Import ---
+
+class ImportProgress:
+    def __init__(self, total_bytes=None):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.imported = 0
+        self.skipped = 0
+
+    @property
+    def fraction(self):
+        if not self.total_bytes:
+            return None
+        return min(1.0, self.bytes_read / self.total_bytes)
+
+
+def import_notes(store, fileobj, new_id, total_bytes=None, on_progress=None, batch_size=BATCH_SIZE):
+    # Adds the notes in `fileobj` to `store` under fresh ids, skipping any
+    # note whose title and content are already stored (or appeared earlier in
+    # the same file), so importing the same export twice adds nothing.
+    # Commits one store batch per `batch_size` notes; returns the progress.
+    progress = ImportProgress(total_bytes)
+    # Stored notes carry their content hash, so their bodies are not read
+    seen = {(note.get('title', ''), note.get('content_hash')) if 'content_hash' in note else dedup_key(note)
+            for note in store.notes.values()}
+    used_ids = set()
+    now = datetime.now().isoformat()
+    reader_file = _CountingFile(fileobj, progress)
+
+    batch = []
+    for note in iter_notes(reader_file):
+        if not _valid(note):
+            progress.skipped += 1
+            continue
+        note = {k: v for k, v in note.items() if k not in DERIVED_FIELDS and k != 'version'}
+        # Defaults first, so the key matches the note as it will be stored
+        note.setdefault('title', 'Untitled')
+        note.setdefault('content', '')
+        note.setdefault('timestamp', now)
+        key = dedup_key(note)
+        if key in seen:
+            progress.skipped += 1
+            continue
+        seen.add(key)
+        note_id = new_id()
+        while note_id in store.notes or note_id in used_ids:
+            note_id = new_id()
+        used_ids.add(note_id)
+        note['id'] = note_id
+        note['imported_at'] = now
+        batch.append(note)
+        if len(batch) >= batch_size:
+            _commit(store, batch, progress, on_progress)
+            batch = []
+    _commit(store, batch, progress, on_progress)
+    return progress
+
+
+def _valid(note):
+    # Fields the store and its indexes read as text; a note with anything
+    # else in them is skipped rather than stored
+    if not isinstance(note, dict):
+        return False
+    if not isinstance(note.get('title', ''), str) or not isinstance(note.get('content', ''), str):
+        return False
+    tags = note.get('tags', [])
+    return isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)
+
+
+def _commit(store, batch, progress, on_progress):
+    if batch:
+        with store.batch():
+            for note in batch:
+                store.put(note)
+        progress.imported += len(batch)
+    if on_progress is not None:
+        on_progress(progress)
+
+
+class _CountingFile:
+    # Passes reads through, recording how far into the upload the parser is
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.progress.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        position = self.fileobj.seek(offset, whence)
+        self.progress.bytes_read = position
+        return position
+
+    def tell(self):
+        return self.fileobj.tell()
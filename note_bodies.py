@@ -0,0 +1,118 @@
+import mmap
+import sys
+import tempfile
+import threading
+from collections.abc import Mapping
+
+# A body file is repacked once this much of it belongs to replaced or
+# deleted notes, and more than is still live
+MIN_REPACK_BYTES = 64 * 1024 * 1024
+
+
+class ContentFile:
+    # Append-only file of note bodies (UTF-8), private to this process and
+    # read back through mmap. The file is unlinked on creation, so it goes
+    # away with the last record that points into it.
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        self._map = None
+        self._mapped = 0
+        self.size = 0
+        self.garbage = 0
+
+    def append(self, text):
+        # (offset, length) of the stored text
+        data = text.encode('utf-8')
+        with self._lock:
+            offset = self.size
+            self._file.write(data)
+            self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset, length):
+        if not length:
+            return ''
+        if offset + length > self._mapped:
+            self._remap()
+        return self._map[offset:offset + length].decode('utf-8')
+
+    def release(self, length):
+        # Marks `length` bytes as belonging to a note that was replaced
+        self.garbage += length
+
+    @property
+    def live(self):
+        return self.size - self.garbage
+
+    def _remap(self):
+        # The old map is not closed: a reader may still be slicing it, and it
+        # is unmapped once the last reference goes
+        with self._lock:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped = self.size
+
+
+class NoteRecord(Mapping):
+    # A stored note: metadata (title, preview, tags, derived fields) stays in
+    # memory and the body is read from a ContentFile when 'content' is asked
+    # for. Reads like the dict it was built from; dict(record) copies it out,
+    # and it pickles as that plain dict.
+    __slots__ = ('_fields', '_bodies', '_offset', '_length')
+
+    def __init__(self, note, bodies):
+        fields = {key: value for key, value in note.items() if key != 'content'}
+        tags = fields.get('tags')
+        if isinstance(tags, list):
+            fields['tags'] = [sys.intern(tag) if isinstance(tag, str) else tag for tag in tags]
+        self._fields = fields
+        content = note.get('content')
+        if isinstance(content, str):
+            self._bodies = bodies
+            self._offset, self._length = bodies.append(content)
+        else:
+            # Missing or malformed content is kept as it is
+            self._bodies = None
+            if 'content' in note:
+                fields['content'] = content
+
+    def __getitem__(self, key):
+        if key == 'content' and self._bodies is not None:
+            return self._bodies.read(self._offset, self._length)
+        return self._fields[key]
+
+    def __contains__(self, key):
+        return key in self._fields or (key == 'content' and self._bodies is not None)
+
+    def __iter__(self):
+        yield from self._fields
+        if self._bodies is not None:
+            yield 'content'
+
+    def __len__(self):
+        return len(self._fields) + (self._bodies is not None)
+
+    def __repr__(self):
+        return f"NoteRecord({self._fields!r})"
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def same_as(self, note):
+        # Whether the dict `note` holds exactly what this record does. Bodies
+        # are compared through the content hash stored with every saved note
+        # (see note_stats.annotate) when there is one, without reading them.
+        stored_body = self._bodies is not None
+        if stored_body != isinstance(note.get('content'), str):
+            return False
+        fields = {key: value for key, value in note.items() if not (stored_body and key == 'content')}
+        if fields != self._fields:
+            return False
+        return not stored_body or 'content_hash' in fields or self['content'] == note['content']
+
+    def release(self):
+        # Called when the store drops this record for a newer one
+        if self._bodies is not None:
+            self._bodies.release(self._length)
@@ -0,0 +1,89 @@
+import hashlib
+import re
+
+PREVIEW_CHARS = 150
+
+# Fields derived from a note's content; recomputed on every save
+DERIVED_FIELDS = ('word_count', 'reading_time', 'preview', 'content_hash')
+
+
+def word_count(text):
+    return len(re.findall(r'\w+', text))
+
+
+def reading_time(text, words=None):
+    if words is None:
+        words = word_count(text)
+    return max(1, round(words / 200))  # 200 WPM average
+
+
+def extract_tags(content):
+    return re.findall(r'#(\w+)', content)
+
+
+def make_preview(text):
+    return text[:PREVIEW_CHARS] + "..." if len(text) > PREVIEW_CHARS else text
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def annotate(note):
+    # Returns a copy of `note` with its derived fields filled in. Notes that
+    # already have tags keep them; otherwise they are extracted from the content.
+    note = dict(note)
+    content = note.get('content', '')
+    digest = content_hash(content)
+    if note.get('content_hash') != digest:
+        words = word_count(content)
+        note['word_count'] = words
+        note['reading_time'] = reading_time(content, words)
+        note['preview'] = make_preview(content)
+        note['content_hash'] = digest
+    if 'tags' not in note:
+        note['tags'] = extract_tags(content)
+    return note
+
+
+def needs_annotation(note):
+    return 'content_hash' not in note
+
+
+def note_words(note):
+    words = note.get('word_count')
+    return word_count(note.get('content', '')) if words is None else words
+
+
+class NoteStats:
+    # Running totals for the dashboard header, adjusted per put/delete
+    # instead of being recounted over every note on each rerun
+
+    def __init__(self):
+        self.total_words = 0
+        self.pinned_count = 0
+        self._per_note = {}
+
+    def rebuild(self, notes):
+        self.total_words = 0
+        self.pinned_count = 0
+        self._per_note = {}
+        for note in notes:
+            self.add(note)
+
+    def add(self, note):
+        self.remove(note['id'])
+        words = note_words(note)
+        pinned = bool(note.get('pinned', False))
+        self._per_note[note['id']] = (words, pinned)
+        self.total_words += words
+        self.pinned_count += pinned
+
+    def remove(self, note_id):
+        words, pinned = self._per_note.pop(note_id, (0, False))
+        self.total_words -= words
+        self.pinned_count -= pinned
+
+    @property
+    def total_notes(self):
+        return len(self._per_note)
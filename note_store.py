@@ -0,0 +1,624 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import serialization
+from ids import is_id, migrated_id, note_rev
+from note_bodies import MIN_REPACK_BYTES, ContentFile, NoteRecord
+from note_stats import DERIVED_FIELDS, annotate
+from serialization import json_dumps, json_loads
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+DEFAULT_SETTINGS = {"theme": "nebula", "locked": False, "ai_enabled": True}
+
+# Compaction only kicks in once the log is at least this big, and then only
+# when the log has grown larger than the last snapshot (amortised O(1) per save)
+MIN_COMPACT_BYTES = 256 * 1024
+
+# Fields that change on every save (or are recomputed from the merged
+# content) and never count as a merge conflict
+_VOLATILE_FIELDS = {'version', 'last_updated', 'rev', *DERIVED_FIELDS}
+
+
+class NoteConflict(Exception):
+    # Raised when another session changed the same field of the same note
+    def __init__(self, field, current):
+        super().__init__(f"'{field}' was changed by another session")
+        self.field = field
+        self.current = current
+
+
+class NoteStore:
+    # Notes live in a snapshot file (the original JSON layout) plus an
+    # append-only log of per-note upserts/deletes. Saving a note appends one
+    # line; the snapshot is only rewritten by a background compaction.
+    #
+    # Several processes may share the files: appends and log rotation hold an
+    # exclusive fcntl lock, reloads hold a shared one, and each writer first
+    # catches up on the log tail so per-note versions can be checked.
+    #
+    # The snapshot is written in `snapshot_format` (see serialization.py) and
+    # read back in whatever format it was found in, so switching formats
+    # takes effect at the next compaction without a migration step.
+    #
+    # In memory each note is a NoteRecord: metadata and preview only, with
+    # the body in a process-local mmapped file (see note_bodies.py). With the
+    # search index holding term counts rather than positions and reading
+    # bodies back through get(), resident memory follows the note count and
+    # vocabulary rather than the length of the bodies.
+
+    def __init__(self, path, min_compact_bytes=MIN_COMPACT_BYTES, snapshot_format='json'):
+        serialization.parse_format(snapshot_format)  # fail early on a missing package
+        self.path = path
+        self.snapshot_format = snapshot_format
+        base, _ = os.path.splitext(path)
+        self.log_path = base + ".log"
+        self.frozen_log_path = base + ".log.1"
+        self.lock_path = base + ".lock"
+        self.compact_lock_path = base + ".compact.lock"
+        self.min_compact_bytes = min_compact_bytes
+        self.notes = {}
+        self._previous = {}
+        self._bodies = ContentFile()
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._compacting = threading.Lock()
+        self._compactor = None
+        self._pending = None
+        self._log_bytes = 0
+        self._log_offset = 0
+        self._snapshot_bytes = 0
+        # Bumped on every change so callers can cache derived state per generation
+        self.generation = 0
+        self._notes_list = None
+        # Derived indexes kept in step with every put/delete (see attach())
+        self.indexes = {}
+        self._loading = False
+        with self._locked(shared=True):
+            self._load()
+
+    # --- Locking ---
+
+    @contextmanager
+    def _locked(self, shared=False):
+        # Thread lock plus a process-wide fcntl lock on the first level only;
+        # flock is per open file, so re-locking from the same thread would hang
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+            finally:
+                os.close(fd)  # closing the descriptor releases the flock
+
+    @contextmanager
+    def _compaction_lock(self):
+        # Yields False if another thread or process is already compacting
+        if not self._compacting.acquire(blocking=False):
+            yield False
+            return
+        fd = None
+        try:
+            if fcntl is not None:
+                fd = os.open(self.compact_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+        finally:
+            if fd is not None:
+                os.close(fd)
+            self._compacting.release()
+
+    # --- Loading ---
+
+    def _load(self):
+        # Also used to reload after another process compacted or rewrote the
+        # files. Records of notes that did not change are kept, and only the
+        # changed ones are re-indexed, so a reload costs about one snapshot
+        # parse instead of rebuilding every index.
+        previous = self._previous = self.notes
+        self._loading = True
+        self.notes = {}
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._log_bytes = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = serialization.loads(f.read())
+            self._snapshot_bytes = os.path.getsize(self.path)
+            for note in _unique_ids(data.pop('notes', [])):
+                self._keep(note)
+            self.settings.update(data.get('settings', {}))
+        else:
+            self._snapshot_bytes = self._write_snapshot([], self.settings)
+
+        # A frozen log is one being folded into the snapshot by a compaction
+        # (or left behind by a crashed one); replaying it is harmless because
+        # it is always older than the live log
+        self._log_offset = 0
+        if os.path.exists(self.frozen_log_path):
+            self._log_bytes += self._replay(self.frozen_log_path)
+        if os.path.exists(self.log_path):
+            self._log_offset = self._replay(self.log_path)
+            self._log_bytes += self._log_offset
+
+        self._seen_snapshot = _stat(self.path)
+        self._seen_log = _stat(self.log_path)
+        self._loading = False
+        self._previous = {}
+        for note_id, note in previous.items():
+            if self.notes.get(note_id) is not note:
+                note.release()
+        changed = [note for note_id, note in self.notes.items() if previous.get(note_id) is not note]
+        removed = previous.keys() - self.notes.keys()
+        if len(changed) + len(removed) > len(self.notes) // 2:
+            self._rebuild_indexes()
+        else:
+            for index in self.indexes.values():
+                for note_id in removed:
+                    index.remove(note_id)
+                for note in changed:
+                    index.add(note)
+        self._changed()
+
+    def _replay(self, log_path, offset=0):
+        size = offset
+        with open(log_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # torn write from a crash, dropped at the next append
+                self._apply(json_loads(line))
+                size += len(line)
+        return size - offset
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'put':
+            note = self._keep(record['note'])
+            if not self._loading:
+                for index in self.indexes.values():
+                    index.add(note)
+        elif op == 'delete':
+            old = self.notes.pop(record['id'], None)
+            if old is not None:
+                if old is not self._previous.get(record['id']):
+                    old.release()  # else _load releases it
+                if not self._loading:
+                    for index in self.indexes.values():
+                        index.remove(record['id'])
+        elif op == 'settings':
+            self.settings.update(record['settings'])
+
+    def _catch_up(self):
+        snapshot = _stat(self.path)
+        log = _stat(self.log_path)
+        if snapshot != self._seen_snapshot:
+            self._load()
+        elif log != self._seen_log:
+            # A log that shrank or is a different file was rotated by a
+            # compaction elsewhere; our offset means nothing in it
+            replaced = self._seen_log is not None and log is not None and log[0] != self._seen_log[0]
+            if log is None or replaced or log[2] < self._log_offset:
+                self._load()
+            else:
+                replayed = self._replay(self.log_path, offset=self._log_offset)
+                self._log_offset += replayed
+                self._log_bytes += replayed
+                self._seen_log = log
+                self._changed()
+
+    def refresh(self):
+        # Picks up writes made by other processes. Cheap when nothing changed:
+        # two stat calls against the mtimes/sizes we last saw
+        if (_stat(self.path), _stat(self.log_path)) != (self._seen_snapshot, self._seen_log):
+            with self._locked(shared=True):
+                self._catch_up()
+        return self.generation
+
+    def _keep(self, note):
+        # Stores `note` as a NoteRecord in place of any older version. While
+        # reloading, the record from before the reload is reused if unchanged
+        # (_load releases the ones that are not).
+        note_id = note['id']
+        reusable = self._previous.get(note_id)
+        if self._loading and reusable is not None and reusable.same_as(note):
+            self.notes[note_id] = reusable
+            return reusable
+        record = NoteRecord(note, self._bodies)
+        old = self.notes.get(note_id)
+        if old is not None and old is not reusable:
+            old.release()
+        self.notes[note_id] = record
+        return record
+
+    def _changed(self):
+        self.generation += 1
+        self._notes_list = None
+        # Bodies of replaced notes pile up in the content file until it is
+        # rewritten with only the live ones. Records already handed out keep
+        # the old file open until they are dropped.
+        if self._bodies.garbage > max(MIN_REPACK_BYTES, self._bodies.live):
+            bodies = ContentFile()
+            self.notes = {note_id: NoteRecord(note, bodies) for note_id, note in self.notes.items()}
+            self._bodies = bodies
+
+    # --- Indexes ---
+
+    def attach(self, name, index):
+        # An index implements rebuild(notes), add(note) and remove(note_id)
+        with self._lock:
+            self.indexes[name] = index
+            index.rebuild(list(self.notes.values()))
+
+    def _rebuild_indexes(self):
+        notes = list(self.notes.values())
+        for index in self.indexes.values():
+            index.rebuild(notes)
+
+    def search(self, query):
+        # Note ids matching a query against the attached 'search' index
+        with self._lock:
+            return self.indexes['search'].search(query)
+
+    def tagged(self, tags, match_all=True):
+        # Note ids carrying all (or any) of `tags`, from the 'tags' index
+        with self._lock:
+            return self.indexes['tags'].match(tags, match_all=match_all)
+
+    def tag_counts(self):
+        with self._lock:
+            return self.indexes['tags'].counts()
+
+    def page(self, after=None, limit=25, allowed=None):
+        # One page of note ids in dashboard order, from the 'order' index
+        with self._lock:
+            return self.indexes['order'].page(after=after, limit=limit, allowed=allowed)
+
+    def rank(self, query, k=20, allowed=None):
+        # Top-k (note_id, score) pairs by relevance, best first
+        with self._lock:
+            return self.indexes['search'].rank(query, k=k, allowed=allowed)
+
+    def query_terms(self, query):
+        # Index terms a query can match, for highlighting snippets
+        with self._lock:
+            return self.indexes['search'].query_terms(query)
+
+    def find(self, search="", tags=(), match_all=True, after=None, limit=25):
+        # One page of note ids in dashboard order matching a search and tags
+        with self._lock:
+            allowed = self.tagged(tags, match_all=match_all) if tags else None
+            if search:
+                found = self.search(search)
+                allowed = found if allowed is None else allowed & found
+            return self.page(after=after, limit=limit, allowed=allowed)
+
+    # --- Writing ---
+
+    def _append(self, records):
+        data = b''.join(json_dumps(r) + b'\n' for r in records)
+        with open(self.log_path, 'ab') as f:
+            # Drop a torn tail left by a crashed writer so we start on a clean line
+            if f.tell() != self._log_offset:
+                f.truncate(self._log_offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_offset += len(data)
+        self._log_bytes += len(data)
+        self._seen_log = _stat(self.log_path)
+        for record in records:
+            self._apply(record)
+        self._changed()
+
+    def _write(self, record):
+        if self._pending is not None:
+            self._pending.append(record)
+            self._apply(record)
+            self._changed()
+            return
+        with self._locked():
+            self._catch_up()
+            self._append([self._prepare(record)])
+        self._maybe_compact()
+
+    @contextmanager
+    def batch(self):
+        # Coalesces a burst of writes into one locked append and one fsync.
+        # Records are applied in memory immediately and re-validated on flush.
+        with self._lock:
+            if self._pending is not None:
+                yield
+                return
+            self._pending = []
+            try:
+                yield
+            except BaseException:
+                # The records applied so far were never logged; drop them by
+                # reloading, and rebuild the indexes in case one failed
+                # halfway through an add
+                self._pending = None
+                with self._locked(shared=True):
+                    self._load()
+                self._rebuild_indexes()
+                raise
+            records, self._pending = self._pending, None
+            latest = coalesce(records)
+            if latest:
+                conflicts = []
+                with self._locked():
+                    self._catch_up()
+                    prepared = []
+                    for record in latest.values():
+                        try:
+                            prepared.append(self._prepare(record))
+                        except NoteConflict as e:
+                            # Undo the optimistic in-memory apply for this note
+                            conflicts.append(e)
+                            self._apply({"op": "put", "note": e.current})
+                    if prepared:
+                        self._append(prepared)
+                self._maybe_compact()
+                if conflicts:
+                    raise conflicts[0]  # the rest of the batch was committed
+
+    def _prepare(self, record):
+        # Runs under the exclusive lock, against state that includes every
+        # other process's writes: bump versions and merge concurrent edits
+        if record['op'] != 'put':
+            return record
+        current = self.notes.get(record['note']['id'])
+        return {"op": "put", "note": prepare_note(record['note'], record.get('base'), current)}
+
+    def put(self, note, base=None):
+        # `note` carries the version it was read at; `base` is that original
+        # read, used to merge with edits other sessions saved in the meantime.
+        # Returns the note as stored (with its new version).
+        record = {"op": "put", "note": dict(note)}
+        if base is not None:
+            record['base'] = dict(base)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(record)
+                self._apply(record)
+                self._changed()
+                return record['note']
+            with self._locked():
+                self._catch_up()
+                prepared = self._prepare(record)
+                self._append([prepared])
+            self._maybe_compact()
+            return prepared['note']
+
+    def delete(self, note_id):
+        with self._lock:
+            self._write({"op": "delete", "id": note_id})
+
+    def update_settings(self, changes):
+        # Only the changed keys are logged, so two sessions flipping different
+        # settings don't overwrite each other
+        with self._lock:
+            self._write({"op": "settings", "settings": dict(changes)})
+
+    def migrate_ids(self):
+        # Re-keys notes that predate ULID-style ids, keeping the old id as
+        # `legacy_id`. New ids are derived from the old ones, so processes
+        # migrating the same file at once agree on them.
+        with self._lock:
+            legacy = [note for note in self.notes.values() if not is_id(note['id'])]
+        if not legacy:
+            return 0
+        with self.batch():
+            for note in legacy:
+                migrated = {k: v for k, v in note.items() if k != 'version'}
+                migrated['id'] = migrated_id(note)
+                migrated['legacy_id'] = note['id']
+                self.put(migrated)
+                self.delete(note['id'])
+        return len(legacy)
+
+    def replace_all(self, data):
+        # Whole-database write, used for bulk rewrites only
+        self.wait_for_compaction()
+        with self._locked():
+            self._bodies = ContentFile()
+            self.notes = {note['id']: NoteRecord(note, self._bodies) for note in data.get('notes', [])}
+            self.settings = dict(data.get('settings', self.settings))
+            self._snapshot_bytes = self._write_snapshot(list(self.notes.values()), self.settings)
+            for log_path in (self.frozen_log_path, self.log_path):
+                if os.path.exists(log_path):
+                    os.remove(log_path)
+            self._log_bytes = 0
+            self._log_offset = 0
+            self._seen_snapshot = _stat(self.path)
+            self._seen_log = None
+            self._rebuild_indexes()
+            self._changed()
+
+    def backfill(self, update, chunk=200):
+        # Lazily migrates notes in a background thread: `update(note)` returns
+        # a replacement dict or None. Replacements are applied in memory a
+        # chunk at a time (no log records) and persisted by the next compaction.
+        def run():
+            ids = list(self.notes)
+            changed = False
+            for start in range(0, len(ids), chunk):
+                with self._lock:
+                    for note_id in ids[start:start + chunk]:
+                        note = self.notes.get(note_id)
+                        new = update(note) if note is not None else None
+                        if new is not None:
+                            new = self._keep(new)
+                            for index in self.indexes.values():
+                                index.add(new)
+                            changed = True
+                    self._changed()
+            if changed:
+                self.compact()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, note_id):
+        # The stored note, or None; for indexes that read notes back later
+        return self.notes.get(note_id)
+
+    def all_notes(self):
+        # The list is rebuilt only when the generation changes
+        with self._lock:
+            if self._notes_list is None:
+                self._notes_list = list(self.notes.values())
+            return self._notes_list
+
+    def to_dict(self):
+        return {"notes": self.all_notes(), "settings": dict(self.settings)}
+
+    # --- Compaction ---
+
+    def _maybe_compact(self):
+        if self._log_bytes >= max(self.min_compact_bytes, self._snapshot_bytes):
+            self.compact()
+
+    def compact(self, background=True):
+        if background:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact, daemon=True)
+            self._compactor.start()
+        else:
+            self._compact()
+
+    def _compact(self):
+        with self._compaction_lock() as acquired:
+            if not acquired:
+                return
+            with self._locked():
+                self._catch_up()
+                # Freeze the live log so saves carry on into a fresh one while
+                # the snapshot is written. A frozen log left by a crashed
+                # compaction is extended rather than overwritten.
+                if os.path.exists(self.log_path):
+                    if os.path.exists(self.frozen_log_path):
+                        with open(self.log_path, 'rb') as src, open(self.frozen_log_path, 'ab') as dst:
+                            dst.write(src.read())
+                        os.remove(self.log_path)
+                    else:
+                        os.replace(self.log_path, self.frozen_log_path)
+                self._seen_log = None
+                self._log_offset = 0
+                self._log_bytes = 0
+                notes = list(self.notes.values())
+                settings = dict(self.settings)
+
+            size = self._write_snapshot(notes, settings)
+
+            with self._locked():
+                self._snapshot_bytes = size
+                self._seen_snapshot = _stat(self.path)
+                if os.path.exists(self.frozen_log_path):
+                    os.remove(self.frozen_log_path)
+
+    def _write_snapshot(self, notes, settings):
+        # Write-to-temp then rename: readers see the old or the new file, never half
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = serialization.dumps({"notes": notes, "settings": settings}, self.snapshot_format)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def wait_for_compaction(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+
+def prepare_note(note, base, current):
+    # The note as it will be stored: merged with concurrent edits when
+    # `current` has moved past the version `note` was read at, with derived
+    # fields (word count, preview etc., computed once here rather than on
+    # every rerun) and its revision key, and with the version bumped
+    note = dict(note)
+    if current is not None and current.get('version', 0) != note.get('version', 0):
+        note = _merge(base or {}, note, current)
+    note = annotate(note)
+    note['rev'] = note_rev(note)
+    note['version'] = (current or {}).get('version', 0) + 1
+    return note
+
+
+def coalesce(records):
+    # Later writes to the same note or setting replace earlier ones;
+    # returns {key: record} in write order
+    latest = {}
+    for record in records:
+        key = record.get('id') or record.get('note', {}).get('id') or 'settings'
+        if key == 'settings' and 'settings' in latest:
+            merged = dict(latest.pop('settings')['settings'])
+            merged.update(record['settings'])
+            record = {"op": "settings", "settings": merged}
+        latest.pop(key, None)
+        latest[key] = record
+    return latest
+
+
+def _merge(base, mine, theirs):
+    # Three-way merge of one note: keep every field the other session changed
+    # unless we changed it too, in which case it is a genuine conflict
+    merged = dict(theirs)
+    for field in set(base) | set(mine):
+        if field in _VOLATILE_FIELDS or mine.get(field) == base.get(field):
+            continue
+        if theirs.get(field) not in (base.get(field), mine.get(field)):
+            raise NoteConflict(field, theirs)
+        if field in mine:
+            merged[field] = mine[field]
+        else:
+            merged.pop(field, None)
+    merged['last_updated'] = mine.get('last_updated', theirs.get('last_updated'))
+    return merged
+
+
+def _unique_ids(notes):
+    # Old snapshots can hold several notes under one pre-ULID id, which would
+    # collapse into one once keyed by id. The first keeps the id (migrate_ids
+    # re-keys it later); each repeat gets a new id right away, seeded with its
+    # position in the list so every process loading the file agrees on it.
+    seen = set()
+    for position, note in enumerate(notes):
+        if note['id'] in seen and not is_id(note['id']):
+            note = dict(note, id=migrated_id(note, position), legacy_id=note['id'])
+        seen.add(note['id'])
+        yield note
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # The inode tells a replaced file from the old one even when size and
+    # mtime happen to match
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
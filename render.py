@@ -0,0 +1,173 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# Extensions the app renders with: previews, dashboard cards and exports all
+# share one cache (export.pdf_markup strips the highlighting markup)
+EXTENSIONS = ['codehilite', 'fenced_code']
+MAX_CACHED_BLOCKS = 4096
+
+_FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+_LIST_RE = re.compile(r'^ {0,3}([-*+]|\d+[.)])\s')
+_QUOTE_RE = re.compile(r'^ {0,3}>')
+# Reference-style link definitions apply to the whole document, so a note
+# that uses them cannot be rendered block by block
+_REFERENCE_RE = re.compile(r'^ {0,3}\[[^\]]+\]:\s*\S', re.MULTILINE)
+# Raw HTML blocks run to the tag that closes them, blank lines included
+# (the block-level tags Python-Markdown passes through untouched)
+_HTML_TAGS = (
+    "address|article|aside|blockquote|body|canvas|colgroup|dd|details|div|dl|dt|fieldset|"
+    "figcaption|figure|footer|form|h[1-6]|header|hgroup|html|iframe|legend|li|main|map|math|"
+    "menu|nav|noscript|object|ol|output|p|pre|progress|script|section|style|summary|table|"
+    "tbody|td|textarea|tfoot|th|thead|tr|ul|video"
+)
+_HTML_OPEN_RE = re.compile(rf'^<({_HTML_TAGS})(?=[\s/>]|$)', re.IGNORECASE)
+_COMMENT_OPEN = '<!--'
+
+
+def _html_end(tag):
+    # Returns a function telling, line by line, whether the raw HTML block
+    # opened by `tag` (or a comment, for None) has been closed
+    if tag is None:
+        return lambda line: '-->' in line
+    opened = re.compile(rf'<{tag}(?=[\s>])', re.IGNORECASE)
+    closed = re.compile(rf'</{tag}\s*>', re.IGNORECASE)
+    depth = 0
+
+    def ended(line):
+        nonlocal depth
+        depth += len(opened.findall(line)) - len(closed.findall(line))
+        return depth <= 0
+    return ended
+
+
+def split_blocks(text):
+    # Splits markdown at blank lines into independently renderable blocks.
+    # Fenced code and raw HTML blocks stay whole, and indented lines, further
+    # list items or quoted paragraphs after a blank line are kept with the
+    # block they continue.
+    blocks, current, fence, html = [], [], None, None
+    for line in text.splitlines():
+        if html is not None:
+            current.append(line)
+            if html(line):
+                html = None
+            continue
+        match = _FENCE_RE.match(line)
+        if fence is not None:
+            current.append(line)
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+            continue
+        if match:
+            fence = match.group(1)
+        if not line.strip() and fence is None:
+            if current:
+                blocks.append(current)
+                current = []
+            continue
+        if not current:
+            tag = _HTML_OPEN_RE.match(line)
+            if tag or line.startswith(_COMMENT_OPEN):
+                ended = _html_end(tag.group(1) if tag else None)
+                if not ended(line if tag else line[len(_COMMENT_OPEN):]):
+                    html = ended
+            elif blocks and (line[:1] in (' ', '\t') or _continues(blocks[-1][0], line)):
+                current = blocks.pop()
+                current.append('')
+        current.append(line)
+    if current:
+        blocks.append(current)
+    return ["\n".join(block) for block in blocks]
+
+
+def _continues(first, line):
+    # A list item or quoted line after a blank line joins the list or quote
+    # the previous block started
+    return bool((_LIST_RE.match(line) and _LIST_RE.match(first)) or
+                (_QUOTE_RE.match(line) and _QUOTE_RE.match(first)))
+
+
+class MarkdownRenderer:
+    # Renders markdown one block at a time, caching each block's HTML by
+    # content hash (LRU). Editing a long note only re-renders the blocks that
+    # changed, and a note already shown elsewhere renders for free.
+
+    def __init__(self, extensions=EXTENSIONS, max_entries=MAX_CACHED_BLOCKS):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # block hash -> html
+        self._lock = threading.Lock()
+        # The Markdown instance is built on first use and then reused
+        # (building one loads every extension, Pygments included) but is not
+        # thread-safe, so it has its own lock
+        self._extensions = list(extensions)
+        self._engine = None
+        self._engine_lock = threading.Lock()
+
+    def _convert(self, text):
+        with self._engine_lock:
+            if self._engine is None:
+                import markdown
+                self._engine = markdown.Markdown(extensions=self._extensions)
+            html = self._engine.convert(text)
+            self._engine.reset()
+        return html
+
+    @staticmethod
+    def _key(block):
+        return hashlib.sha1(block.encode()).hexdigest()
+
+    def _cached(self, block):
+        key = self._key(block)
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = self._convert(block)
+        self.remember(block, html)
+        return html
+
+    def remember(self, block, html):
+        # Caches HTML rendered elsewhere (e.g. by an export pool worker)
+        key = self._key(block)
+        with self._lock:
+            self._cache[key] = html
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def split(self, text):
+        # The blocks `text` is rendered and cached as
+        if _REFERENCE_RE.search(text):
+            return [text]
+        return split_blocks(text)
+
+    def cached_blocks(self, text):
+        # HTML for each block of `text` if every one is cached, else None;
+        # never renders
+        blocks = []
+        with self._lock:
+            for block in self.split(text):
+                html = self._cache.get(self._key(block))
+                if html is None:
+                    return None
+                blocks.append(html)
+            self.hits += len(blocks)
+        return blocks
+
+    def blocks(self, text):
+        # HTML for each block of `text`, in order
+        return [self._cached(block) for block in self.split(text)]
+
+    def render(self, text):
+        return "\n".join(self.blocks(text))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "blocks": len(self._cache)}
@@ -0,0 +1,408 @@
+import heapq
+import html
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+
+from ids import note_rev
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# BM25F parameters; a title hit counts TITLE_BOOST times a content hit
+K1 = 1.2
+B = 0.75
+TITLE_BOOST = 2.0
+SNIPPET_CHARS = 150
+
+# Type-ahead: the last word filters on every term it is a prefix of, but
+# ranks and highlights as at most MAX_EXPANSIONS of them, the most common of
+# the first EXPAND_SCAN. A last word shorter than MIN_PREFIX stands for too
+# many terms to filter on them all, so it only matches that bounded set, cut
+# further to the SHORT_EXPANSIONS most common terms so the first keystroke
+# in ranked mode scores a few thousand notes at most (substring matching is
+# the "Exact substring" search mode's job).
+MIN_PREFIX = 3
+MAX_EXPANSIONS = 50
+SHORT_EXPANSIONS = 8
+EXPAND_SCAN = 2000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    # Inverted index over note titles and content: term -> {note_id: content
+    # term count}, with each note's title terms counted separately. Counts
+    # rather than positions keep the index to one entry per distinct term in
+    # a note however long its body is; phrases are confirmed against the
+    # note text instead (see _match_phrase).
+
+    def __init__(self, lookup=None):
+        # `lookup(note_id)` returns a stored note, body included, for phrase
+        # checks (a store's get(), so bodies stay in its content file).
+        # Without one the index keeps the notes it is given.
+        self.lookup = lookup
+        self._reset()
+
+    def _reset(self):
+        self.postings = {}
+        self.doc_terms = {}
+        self.title_terms = {}  # note id -> {term: count in the title}
+        self.title_len = {}
+        self.content_len = {}
+        self._total_title = 0
+        self._total_content = 0
+        self._terms = []  # sorted vocabulary, for prefix (type-ahead) lookups
+        self._notes = {}   # only without a lookup
+
+    def rebuild(self, notes):
+        self._reset()
+        for note in notes:
+            self._index(note)
+        self._terms = sorted(self.postings)
+
+    def add(self, note):
+        self.remove(note['id'])
+        for term in self._index(note):
+            if len(self.postings[term]) == 1:
+                insort(self._terms, term)
+
+    def remove(self, note_id):
+        for term in self.doc_terms.pop(note_id, ()):
+            docs = self.postings[term]
+            del docs[note_id]
+            if not docs:
+                del self.postings[term]
+                i = bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+        self.title_terms.pop(note_id, None)
+        self._notes.pop(note_id, None)
+        self._total_title -= self.title_len.pop(note_id, 0)
+        self._total_content -= self.content_len.pop(note_id, 0)
+
+    def _index(self, note):
+        note_id = note['id']
+        title_tokens = tokenize(note.get('title', ''))
+        content_tokens = tokenize(note.get('content', ''))
+        title_counts = Counter(title_tokens)
+        counts = Counter(content_tokens)
+        for term in title_counts:
+            counts.setdefault(term, 0)
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[note_id] = count
+        self.doc_terms[note_id] = tuple(counts)
+        self.title_terms[note_id] = dict(title_counts)
+        self.title_len[note_id] = len(title_tokens)
+        self.content_len[note_id] = len(content_tokens)
+        self._total_title += len(title_tokens)
+        self._total_content += len(content_tokens)
+        if self.lookup is None:
+            self._notes[note_id] = note
+        return counts
+
+    def _note(self, note_id):
+        if self.lookup is None:
+            return self._notes.get(note_id)
+        return self.lookup(note_id)
+
+    # --- Querying ---
+
+    def matching_terms(self, prefix):
+        # Every index term the last word of a query filters on
+        if len(prefix) < MIN_PREFIX:
+            return self.expand(prefix)
+        start = bisect_left(self._terms, prefix)
+        end = bisect_left(self._terms, prefix + '\U0010ffff', start)
+        return self._terms[start:end]
+
+    def expand(self, prefix):
+        # Index terms starting with `prefix`, bounded (see MAX_EXPANSIONS and
+        # SHORT_EXPANSIONS) for scoring and highlighting; the prefix itself
+        # is always kept when it is a term
+        limit = MAX_EXPANSIONS if len(prefix) >= MIN_PREFIX else SHORT_EXPANSIONS
+        i = bisect_left(self._terms, prefix)
+        end = min(i + EXPAND_SCAN, len(self._terms))
+        terms = []
+        while i < end and self._terms[i].startswith(prefix):
+            terms.append(self._terms[i])
+            i += 1
+        if len(terms) > limit:
+            common = heapq.nlargest(limit, terms, key=lambda term: len(self.postings[term]))
+            if prefix in self.postings and prefix not in common:
+                common[-1] = prefix
+            terms = common
+        return terms
+
+    def search(self, query):
+        # Words are ANDed, `OR` between words/phrases unions them, "quoted text"
+        # is a phrase, and the last bare word matches as a prefix (type-ahead)
+        result = set()
+        for clauses in self._parse(query):
+            if clauses:
+                result |= self._match_all(clauses)
+        return result
+
+    def _parse(self, query):
+        return parse_query(query)
+
+    def _match_all(self, clauses):
+        matched = None
+        for kind, value in clauses:
+            if kind == 'term':
+                docs = self.postings.get(value, {}).keys()
+            elif kind == 'prefix':
+                docs = self._match_terms(self.matching_terms(value))
+            else:
+                docs = self._match_phrase(value)
+            matched = set(docs) if matched is None else matched & docs
+            if not matched:
+                return set()
+        return matched or set()
+
+    def _match_terms(self, terms):
+        # Notes containing any of `terms`. A prefix can stand for a large
+        # part of the vocabulary; past one posting per note it is cheaper to
+        # test each note's own terms (stopping at its first hit) than to union
+        if sum(len(self.postings[term]) for term in terms) <= len(self.doc_terms):
+            docs = set()
+            for term in terms:
+                docs |= self.postings[term].keys()
+            return docs
+        terms = set(terms)
+        return {note_id for note_id, own in self.doc_terms.items() if not terms.isdisjoint(own)}
+
+    def _match_phrase(self, terms):
+        # Notes holding every term of the phrase, confirmed by finding the
+        # words in order in the title or the content (never across the two)
+        if not terms:
+            return set()
+        lists = [self.postings.get(term) for term in terms]
+        if not all(lists):
+            return set()
+        docs = set(min(lists, key=len))
+        for plist in lists:
+            docs &= plist.keys()
+        if len(terms) == 1:
+            return docs
+        pattern = re.compile(r'(?<!\w)' + r'\W+'.join(map(re.escape, terms)) + r'(?!\w)')
+        matched = set()
+        for note_id in docs:
+            note = self._note(note_id)
+            if note is not None and (pattern.search(note.get('title', '').lower())
+                                     or pattern.search(note.get('content', '').lower())):
+                matched.add(note_id)
+        return matched
+
+    # --- Ranking ---
+
+    def query_terms(self, query):
+        # Every index term the query can match, prefixes expanded
+        terms = set()
+        for clauses in self._parse(query):
+            for kind, value in clauses:
+                if kind == 'term':
+                    terms.add(value)
+                elif kind == 'prefix':
+                    terms.update(self.expand(value))
+                else:
+                    terms.update(value)
+        return terms
+
+    def rank(self, query, k=20, allowed=None):
+        # Top-k (note_id, score) pairs by BM25F over title and content.
+        # heapq.nlargest keeps this O(matches * log k) instead of a full sort.
+        matched = self.search(query)
+        if allowed is not None:
+            matched &= allowed
+        if not matched:
+            return []
+
+        n_docs = len(self.doc_terms)
+        avg_title = max(self._total_title / n_docs, 1)
+        avg_content = max(self._total_content / n_docs, 1)
+        # One scoring clause per query word or phrase term; an expanded
+        # prefix is one clause scored by its best variant, so a short prefix
+        # counts like a single word however many terms it stands for
+        clauses = {}
+        for group in self._parse(query):
+            for kind, value in group:
+                variants = self.expand(value) if kind == 'prefix' else [value] if kind == 'term' else value
+                key = (kind, value) if kind == 'prefix' else None
+                for term in variants:
+                    clauses.setdefault(key or term, set()).add(term)
+        weights = []
+        for terms in clauses.values():
+            variants = []
+            for term in terms:
+                docs = self.postings.get(term)
+                if docs:
+                    idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                    variants.append((term, idf, docs))
+            if variants:
+                weights.append(variants)
+
+        # Term at a time: each variant walks its postings or the matches,
+        # whichever is shorter, so a broad prefix costs its capped expansion
+        # rather than every match times every variant
+        scores = dict.fromkeys(matched, 0.0)
+        for variants in weights:
+            best = {}
+            for term, idf, docs in variants:
+                if len(docs) <= len(scores):
+                    hits = ((i, n) for i, n in docs.items() if i in scores)
+                else:
+                    hits = ((i, docs[i]) for i in scores if i in docs)
+                for note_id, in_content in hits:
+                    in_title = self.title_terms[note_id].get(term, 0)
+                    tf = (TITLE_BOOST * in_title / (1 - B + B * self.title_len[note_id] / avg_title)
+                          + in_content / (1 - B + B * self.content_len[note_id] / avg_content))
+                    value = idf * tf / (K1 + tf)
+                    if value > best.get(note_id, 0.0):
+                        best[note_id] = value
+            for note_id, value in best.items():
+                scores[note_id] += value
+
+        top = heapq.nlargest(k, ((value, i) for i, value in scores.items()))
+        return [(note_id, value) for value, note_id in top]
+
+
+def parse_query(query):
+    # OR-separated groups of ANDed clauses: ('term', t), ('prefix', t) for the
+    # last bare word, or ('phrase', [t, ...])
+    groups = [[]]
+    parts = QUERY_RE.findall(query)
+    for n, (phrase, word) in enumerate(parts):
+        if word == 'OR':
+            groups.append([])
+        elif phrase:
+            groups[-1].append(('phrase', tokenize(phrase)))
+        else:
+            terms = tokenize(word)
+            for i, term in enumerate(terms):
+                last = n == len(parts) - 1 and i == len(terms) - 1
+                groups[-1].append(('prefix' if last else 'term', term))
+    return groups
+
+
+def make_snippet(text, terms, width=SNIPPET_CHARS):
+    # An HTML-escaped window of `text` around the first query hit, with every
+    # hit wrapped in <mark>. Falls back to the start of the text.
+    if not terms:
+        hit = None
+    else:
+        pattern = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, terms), key=len, reverse=True)) + r')\b',
+                             re.IGNORECASE)
+        hit = pattern.search(text)
+    start = 0 if hit is None else max(0, hit.start() - width // 3)
+    window = text[start:start + width]
+    parts = []
+    last = 0
+    if hit is not None:
+        for m in pattern.finditer(window):
+            parts.append(html.escape(window[last:m.start()]))
+            parts.append(f'<mark>{html.escape(m.group(0))}</mark>')
+            last = m.end()
+    parts.append(html.escape(window[last:]))
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if start + width < len(text) else ''
+    return prefix + ''.join(parts) + suffix
+
+
+class TagIndex:
+    # tag -> set of note ids, so tag filters are set operations and the
+    # sidebar's per-tag counts are just set sizes
+
+    def __init__(self):
+        self.notes_by_tag = {}
+        self.tags_by_note = {}
+
+    def rebuild(self, notes):
+        self.notes_by_tag = {}
+        self.tags_by_note = {}
+        for note in notes:
+            self.add(note)
+
+    def add(self, note):
+        self.remove(note['id'])
+        tags = set(note.get('tags', []))
+        self.tags_by_note[note['id']] = tags
+        for tag in tags:
+            self.notes_by_tag.setdefault(tag, set()).add(note['id'])
+
+    def remove(self, note_id):
+        for tag in self.tags_by_note.pop(note_id, ()):
+            ids = self.notes_by_tag[tag]
+            ids.discard(note_id)
+            if not ids:
+                del self.notes_by_tag[tag]
+
+    def counts(self):
+        return {tag: len(ids) for tag, ids in self.notes_by_tag.items()}
+
+    def match(self, tags, match_all=True):
+        # Notes carrying every tag (intersection) or any of them (union)
+        sets = sorted((self.notes_by_tag.get(tag, set()) for tag in tags), key=len)
+        if not sets:
+            return set()
+        if match_all:
+            return set.intersection(*sets)
+        return set.union(*sets)
+
+
+class NoteOrder:
+    # Dashboard order (pinned first, then most recently updated) kept as a
+    # sorted key list, updated per put/delete instead of re-sorting each rerun.
+    # Keys sort ascending; pages are read from the end backwards.
+
+    def __init__(self):
+        self.keys = []
+        self.key_by_id = {}
+
+    @staticmethod
+    def sort_key(note):
+        # `rev` is stored on save; notes not saved since get it computed
+        return (bool(note.get('pinned', False)), note.get('rev') or note_rev(note), note['id'])
+
+    def rebuild(self, notes):
+        self.key_by_id = {note['id']: self.sort_key(note) for note in notes}
+        self.keys = sorted(self.key_by_id.values())
+
+    def add(self, note):
+        self.remove(note['id'])
+        key = self.sort_key(note)
+        self.key_by_id[note['id']] = key
+        insort(self.keys, key)
+
+    def remove(self, note_id):
+        key = self.key_by_id.pop(note_id, None)
+        if key is not None:
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+
+    def page(self, after=None, limit=25, allowed=None):
+        # Up to `limit` note ids following the cursor `after` (the key of the
+        # last note on the previous page), optionally restricted to `allowed`.
+        # Returns (ids, cursor for the next page or None).
+        end = len(self.keys) if after is None else bisect_left(self.keys, tuple(after))
+        if allowed is not None and len(allowed) * 8 < end:
+            # Small result set: sort just those keys rather than walk the list
+            keys = sorted((self.key_by_id[i] for i in allowed if i in self.key_by_id), reverse=True)
+            if after is not None:
+                keys = [key for key in keys if key < tuple(after)]
+            window = keys[:limit + 1]
+        else:
+            window = []
+            i = end - 1
+            while i >= 0 and len(window) <= limit:
+                key = self.keys[i]
+                if allowed is None or key[2] in allowed:
+                    window.append(key)
+                i -= 1
+        ids = [key[2] for key in window[:limit]]
+        next_cursor = window[limit - 1] if len(window) > limit else None
+        return ids, next_cursor
@@ -0,0 +1,141 @@
+import gzip
+import json
+from collections.abc import Mapping
+
+# Optional accelerators: orjson for JSON, msgpack for a binary encoding and
+# zstandard for compression. Plain JSON and gzip always work without them.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_LEVEL = 3
+
+# A format is an encoding optionally followed by "+" and a compression,
+# e.g. "json", "json+zstd", "msgpack+gzip"
+ENCODINGS = ('json', 'msgpack')
+COMPRESSIONS = ('gzip', 'zstd')
+
+
+def _plain(obj):
+    # Encoders only know dicts; stored notes are read-only mappings
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"cannot serialize {type(obj).__name__}")
+
+
+def json_dumps(obj):
+    # Compact JSON as bytes
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_plain)
+        except TypeError:
+            pass  # e.g. non-string keys or huge ints; the stdlib copes
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_plain).encode()
+
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_format(fmt):
+    encoding, _, compression = fmt.partition('+')
+    if encoding not in ENCODINGS or (compression and compression not in COMPRESSIONS):
+        raise ValueError(f"unknown serialization format: {fmt}")
+    _require(encoding)
+    _require(compression)
+    return encoding, compression or None
+
+
+def _require(name):
+    missing = {'msgpack': msgpack, 'zstd': zstandard}
+    if name in missing and missing[name] is None:
+        package = 'zstandard' if name == 'zstd' else name
+        raise RuntimeError(f"the {name} format needs the '{package}' package installed")
+
+
+def available_formats():
+    return [f"{encoding}{'+' + compression if compression else ''}"
+            for encoding in ENCODINGS for compression in (None, *COMPRESSIONS)
+            if not (encoding == 'msgpack' and msgpack is None)
+            and not (compression == 'zstd' and zstandard is None)]
+
+
+def dumps(obj, fmt='json'):
+    encoding, compression = parse_format(fmt)
+    data = json_dumps(obj) if encoding == 'json' else msgpack.packb(obj, use_bin_type=True, default=_plain)
+    if compression == 'gzip':
+        data = gzip.compress(data, compresslevel=6)
+    elif compression == 'zstd':
+        data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def _unwrap(data):
+    # (compression, decompressed bytes), recognised by magic number
+    for compression, magic in (('zstd', ZSTD_MAGIC), ('gzip', GZIP_MAGIC)):
+        if data.startswith(magic):
+            _require(compression)
+            if compression == 'gzip':
+                return compression, gzip.decompress(data)
+            return compression, zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return None, data
+
+
+def sniff_encoding(raw):
+    # 'json' or 'msgpack' from the first bytes of uncompressed data
+    return 'json' if raw.lstrip()[:1] in (b'{', b'[', b'') else 'msgpack'
+
+
+def detect(data):
+    # The format of serialized bytes, from magic numbers and the first byte
+    compression, raw = _unwrap(data)
+    encoding = sniff_encoding(raw)
+    return f"{encoding}+{compression}" if compression else encoding
+
+
+def loads(data):
+    # Decodes bytes written by dumps() in any format, or plain JSON text
+    if isinstance(data, str):
+        return json_loads(data)
+    _, raw = _unwrap(data)
+    if sniff_encoding(raw) == 'json':
+        return json_loads(raw)
+    _require('msgpack')
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+def open_stream(fileobj):
+    # A binary stream yielding the decompressed content of `fileobj`, for
+    # incremental readers; uncompressed input is returned as it is
+    head = fileobj.read(4)
+    fileobj.seek(-len(head), 1)
+    if head[:4] == ZSTD_MAGIC:
+        _require('zstd')
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    if head[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return fileobj
+
+
+def compress_stream(fileobj, compression):
+    # A writable binary stream compressing into `fileobj`; closing it
+    # finishes the frame but leaves `fileobj` open
+    _require(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+    raise ValueError(f"unknown compression: {compression}")
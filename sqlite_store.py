@@ -0,0 +1,392 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+from ids import note_rev
+from note_bodies import ContentFile, NoteRecord
+from note_store import DEFAULT_SETTINGS, NoteStore
+from search_index import MAX_EXPANSIONS, TITLE_BOOST, parse_query
+from serialization import json_dumps, json_loads
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id TEXT PRIMARY KEY,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    rev TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_order ON notes (pinned, rev, id);
+CREATE INDEX IF NOT EXISTS notes_seq ON notes (seq);
+CREATE TABLE IF NOT EXISTS note_tags (
+    tag TEXT NOT NULL,
+    note_id TEXT NOT NULL,
+    PRIMARY KEY (tag, note_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS note_tags_note ON note_tags (note_id);
+CREATE TABLE IF NOT EXISTS tombstones (id TEXT PRIMARY KEY, seq INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5 (
+    title, content, tokenize = "unicode61 remove_diacritics 0 tokenchars '_'"
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_vocab USING fts5vocab (notes_fts, row);
+"""
+
+ORDER_BY = "ORDER BY n.pinned DESC, n.rev DESC, n.id DESC"
+
+
+def fts_query(query):
+    # The search box syntax (see search_index.parse_query) as an FTS5 query
+    groups = []
+    for clauses in parse_query(query):
+        parts = []
+        for kind, value in clauses:
+            if kind == 'phrase':
+                if value:
+                    parts.append('"' + ' '.join(value) + '"')
+            else:
+                parts.append(f'"{value}"' + ('*' if kind == 'prefix' else ''))
+        if parts:
+            groups.append('(' + ' AND '.join(parts) + ')')
+    return ' OR '.join(groups)
+
+
+class SqliteStore(NoteStore):
+    # The NoteStore interface over one SQLite database (WAL mode): a notes
+    # table holding each note as JSON, an FTS5 index of titles and content,
+    # and a tag table. Filtering, search, ranking and the dashboard order run
+    # as SQL; `notes` is still kept in memory for O(1) lookups by id, as
+    # NoteRecords with their bodies in a content file like NoteStore's.
+    #
+    # Every write bumps a sequence number stored with the row (or with a
+    # tombstone for deletes), so other processes catch up by reading only the
+    # rows past the last sequence they saw.
+
+    def __init__(self, path):
+        self.path = path
+        self.notes = {}
+        self._previous = {}
+        self._bodies = ContentFile()
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._pending = None
+        self._seq = 0
+        self._data_version = None
+        self.generation = 0
+        self._notes_list = None
+        self.indexes = {}
+        self._loading = False
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self._db.executescript(SCHEMA)
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"SQLite backend needs FTS5 support: {e}") from e
+        with self._lock:
+            self._load()
+
+    # --- Locking ---
+
+    @contextmanager
+    def _locked(self, shared=False):
+        # Writers hold an IMMEDIATE transaction, SQLite's cross-process write
+        # lock; readers only need the thread lock (WAL gives them a snapshot)
+        with self._lock:
+            if shared or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            self._lock_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                self._load()  # memory may hold records that were rolled back
+                raise
+            else:
+                self._db.execute("COMMIT")
+            finally:
+                self._lock_depth -= 1
+
+    # --- Loading ---
+
+    def _load(self):
+        self.notes = {}
+        self._bodies = ContentFile()
+        for note_id, data in self._db.execute("SELECT id, data FROM notes"):
+            self.notes[note_id] = NoteRecord(json_loads(data), self._bodies)
+        self._seq = self._db.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+        self._load_settings()
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._rebuild_indexes()
+        self._changed()
+
+    def _load_settings(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        for key, value in self._db.execute("SELECT key, value FROM settings"):
+            self.settings[key] = json_loads(value)
+
+    def _catch_up(self):
+        seq = self._db.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+        if seq != self._seq:
+            rows = self._db.execute("SELECT data FROM notes WHERE seq > ?", (self._seq,)).fetchall()
+            for (data,) in rows:
+                self._apply({"op": "put", "note": json_loads(data)})
+            for (note_id,) in self._db.execute("SELECT id FROM tombstones WHERE seq > ?", (self._seq,)):
+                self._apply({"op": "delete", "id": note_id})
+            self._seq = seq
+            self._changed()
+        self._load_settings()
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        # data_version only changes when another connection commits
+        with self._lock:
+            if self._db.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+                self._catch_up()
+            return self.generation
+
+    # --- Queries ---
+
+    @contextmanager
+    def _allowed(self, allowed):
+        # Yields a SQL condition restricting notes to the id set `allowed`
+        if allowed is None:
+            yield "1", ()
+            return
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS allowed_ids (id TEXT PRIMARY KEY)")
+        self._db.execute("DELETE FROM allowed_ids")
+        self._db.executemany("INSERT OR IGNORE INTO allowed_ids VALUES (?)", ((i,) for i in allowed))
+        try:
+            yield "n.id IN (SELECT id FROM allowed_ids)", ()
+        finally:
+            self._db.execute("DELETE FROM allowed_ids")
+
+    def _tag_condition(self, tags, match_all):
+        # Point lookups on the (tag, note_id) primary key per candidate note
+        tags = list(dict.fromkeys(tags))
+        exists = "EXISTS (SELECT 1 FROM note_tags t WHERE t.note_id = n.id AND t.tag {})"
+        if match_all:
+            return ' AND '.join([exists.format("= ?")] * len(tags)), tuple(tags)
+        return exists.format(f"IN ({','.join('?' * len(tags))})"), tuple(tags)
+
+    def search(self, query):
+        match = fts_query(query)
+        if not match:
+            return set()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT n.id FROM notes_fts JOIN notes n ON n.rowid = notes_fts.rowid"
+                " WHERE notes_fts MATCH ?", (match,))
+            return {note_id for (note_id,) in rows}
+
+    def tagged(self, tags, match_all=True):
+        if not tags:
+            return set()
+        tags = list(dict.fromkeys(tags))
+        sql = f"SELECT note_id FROM note_tags WHERE tag IN ({','.join('?' * len(tags))}) GROUP BY note_id"
+        params = tuple(tags)
+        if match_all:
+            sql += " HAVING COUNT(*) = ?"
+            params += (len(tags),)
+        with self._lock:
+            return {note_id for (note_id,) in self._db.execute(sql, params)}
+
+    def tag_counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT tag, COUNT(*) FROM note_tags GROUP BY tag"))
+
+    def _page(self, conditions, params, after, limit):
+        if after is not None:
+            pinned, rev, note_id = after
+            conditions.append("(n.pinned, n.rev, n.id) < (?, ?, ?)")
+            params += (int(pinned), rev, note_id)
+        rows = self._db.execute(
+            f"SELECT n.pinned, n.rev, n.id FROM notes n WHERE {' AND '.join(conditions) or '1'}"
+            f" {ORDER_BY} LIMIT ?", (*params, limit + 1)).fetchall()
+        ids = [row[2] for row in rows[:limit]]
+        last = rows[limit - 1] if len(rows) > limit else None
+        next_cursor = (bool(last[0]), last[1], last[2]) if last else None
+        return ids, next_cursor
+
+    def page(self, after=None, limit=25, allowed=None):
+        with self._lock, self._allowed(allowed) as (condition, params):
+            return self._page([condition], params, after, limit)
+
+    def find(self, search="", tags=(), match_all=True, after=None, limit=25):
+        # Search, tag filter, ordering and paging in one query
+        conditions, params = [], ()
+        if search:
+            match = fts_query(search)
+            if not match:
+                return [], None
+            conditions.append("n.rowid IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)")
+            params += (match,)
+        if tags:
+            sql, tag_params = self._tag_condition(tags, match_all)
+            conditions.append(sql)
+            params += tag_params
+        with self._lock:
+            return self._page(conditions, params, after, limit)
+
+    def rank(self, query, k=20, allowed=None):
+        # bm25() is lower-is-better; scores are negated to match SearchIndex
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock, self._allowed(allowed) as (condition, params):
+            rows = self._db.execute(
+                f"SELECT n.id, bm25(notes_fts, {TITLE_BOOST}, 1.0) AS score"
+                f" FROM notes_fts JOIN notes n ON n.rowid = notes_fts.rowid"
+                f" WHERE notes_fts MATCH ? AND {condition} ORDER BY score LIMIT ?",
+                (match, *params, k))
+            return [(note_id, -score) for note_id, score in rows]
+
+    def query_terms(self, query):
+        terms = set()
+        with self._lock:
+            for clauses in parse_query(query):
+                for kind, value in clauses:
+                    if kind == 'term':
+                        terms.add(value)
+                    elif kind == 'prefix':
+                        rows = self._db.execute(
+                            "SELECT term FROM notes_vocab WHERE term >= ? AND term < ?"
+                            " ORDER BY doc DESC LIMIT ?",
+                            (value, value + '\U0010ffff', MAX_EXPANSIONS))
+                        terms.update(term for (term,) in rows)
+                    else:
+                        terms.update(value)
+        return terms
+
+    # --- Writing ---
+
+    def _next_seq(self):
+        self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'seq'")
+        self._seq = self._db.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+        return self._seq
+
+    def _store(self, record):
+        op = record['op']
+        if op == 'put':
+            note = record['note']
+            self._db.execute(
+                "INSERT INTO notes (id, pinned, rev, seq, data) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET pinned = excluded.pinned, rev = excluded.rev,"
+                " seq = excluded.seq, data = excluded.data",
+                (note['id'], int(bool(note.get('pinned', False))), note['rev'], self._next_seq(),
+                 json_dumps(note).decode()))
+            rowid = self._db.execute("SELECT rowid FROM notes WHERE id = ?", (note['id'],)).fetchone()[0]
+            self._db.execute("DELETE FROM notes_fts WHERE rowid = ?", (rowid,))
+            self._db.execute("INSERT INTO notes_fts (rowid, title, content) VALUES (?, ?, ?)",
+                             (rowid, note.get('title', ''), note.get('content', '')))
+            self._db.execute("DELETE FROM note_tags WHERE note_id = ?", (note['id'],))
+            self._db.executemany("INSERT OR IGNORE INTO note_tags (tag, note_id) VALUES (?, ?)",
+                                 ((tag, note['id']) for tag in note.get('tags', [])))
+            self._db.execute("DELETE FROM tombstones WHERE id = ?", (note['id'],))
+        elif op == 'delete':
+            row = self._db.execute("SELECT rowid FROM notes WHERE id = ?", (record['id'],)).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM notes_fts WHERE rowid = ?", row)
+                self._db.execute("DELETE FROM notes WHERE rowid = ?", row)
+                self._db.execute("DELETE FROM note_tags WHERE note_id = ?", (record['id'],))
+                self._db.execute("INSERT OR REPLACE INTO tombstones (id, seq) VALUES (?, ?)",
+                                 (record['id'], self._next_seq()))
+        elif op == 'settings':
+            self._db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                 ((key, json_dumps(value).decode()) for key, value in record['settings'].items()))
+            self._next_seq()
+
+    def _append(self, records):
+        # Called inside the write transaction opened by _locked()
+        for record in records:
+            self._store(record)
+            self._apply(record)
+        self._changed()
+
+    def _maybe_compact(self):
+        pass
+
+    def compact(self, background=True):
+        # Folds the WAL back into the database file
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def wait_for_compaction(self):
+        pass
+
+    def replace_all(self, data):
+        with self._locked():
+            # Tombstone every current note so other processes drop the ones
+            # not re-added; re-added notes clear their tombstone again
+            self._db.execute("INSERT OR REPLACE INTO tombstones (id, seq) SELECT id, ? FROM notes",
+                             (self._next_seq(),))
+            for table in ("notes", "notes_fts", "note_tags", "settings"):
+                self._db.execute(f"DELETE FROM {table}")
+            self.notes = {}
+            self._bodies = ContentFile()
+            self._loading = True
+            try:
+                for note in data.get('notes', []):
+                    self._append([{"op": "put", "note": _with_rev(note)}])
+                self._append([{"op": "settings", "settings": dict(data.get('settings', self.settings))}])
+            finally:
+                self._loading = False
+            self._rebuild_indexes()
+            self._changed()
+
+    def backfill(self, update, chunk=200):
+        # Same contract as NoteStore.backfill, but replacements are written
+        # straight to the database, a chunk per transaction
+        def run():
+            ids = list(self.notes)
+            for start in range(0, len(ids), chunk):
+                with self._locked():
+                    for note_id in ids[start:start + chunk]:
+                        note = self.notes.get(note_id)
+                        new = update(note) if note is not None else None
+                        if new is not None:
+                            self._append([{"op": "put", "note": _with_rev(new)}])
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+def _with_rev(note):
+    if note.get('rev'):
+        return note
+    return {**note, 'rev': note_rev(note)}
+
+
+def migrate_json(json_path, sqlite_path):
+    # One-shot copy of a JSON store (snapshot plus log) into a new SQLite
+    # database, built under a temporary name and renamed into place
+    source = NoteStore(json_path)
+    tmp_path = sqlite_path + ".tmp"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(tmp_path + suffix):
+            os.remove(tmp_path + suffix)
+    target = SqliteStore(tmp_path)
+    target.replace_all(source.to_dict())
+    target.compact()
+    target._db.close()
+    os.replace(tmp_path, sqlite_path)
+    return len(source.notes)
+
+
+if __name__ == '__main__':
+    # python sqlite_store.py noirnotes_db.json noirnotes_db.sqlite
+    if len(sys.argv) != 3:
+        sys.exit("usage: python sqlite_store.py SOURCE.json TARGET.sqlite")
+    print(f"migrated {migrate_json(sys.argv[1], sys.argv[2])} notes")
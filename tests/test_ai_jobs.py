@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_jobs import BackgroundMemo, FakeModel, JobRunner
+
+
+def _settled(memo):
+    # Waits for every computation the memo has started
+    memo.executor.shutdown(wait=True)
+    memo.executor = ThreadPoolExecutor(max_workers=1)
+
+
+def test_memo_recomputes_only_when_fingerprint_changes():
+    memo = BackgroundMemo(ThreadPoolExecutor(max_workers=1))
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    assert memo.get("slot", "a", lambda: compute("first")) == (None, True, True)
+    _settled(memo)
+    assert memo.get("slot", "a", lambda: compute("again")) == ("first", False, False)
+    assert memo.get("slot", "b", lambda: compute("second")) == ("first", True, True)
+    _settled(memo)
+    assert memo.get("slot", "b", lambda: compute("again")) == ("second", False, False)
+    assert calls == ["first", "second"]
+
+
+def test_memo_failure_is_not_cached_as_a_value():
+    memo = BackgroundMemo(ThreadPoolExecutor(max_workers=1))
+    attempts = []
+
+    def fail():
+        attempts.append(1)
+        raise RuntimeError("quota exceeded")
+
+    memo.get("slot", "a", fail)
+    _settled(memo)
+    # Reported, and not retried on every lookup
+    assert memo.get("slot", "a", fail) == (None, False, False)
+    assert str(memo.failure("slot", "a")) == "quota exceeded"
+    assert memo.failure("slot", "b") is None
+    assert len(attempts) == 1
+
+    memo.retry("slot")
+    done = threading.Event()
+    memo.get("slot", "a", lambda: done.set() or "insights")
+    _settled(memo)
+    assert done.is_set()
+    assert memo.get("slot", "a", fail) == ("insights", False, False)
+    assert memo.failure("slot", "a") is None
+
+
+# --- JobRunner, driven by the offline FakeModel ---
+
+def _stream(model, prompt):
+    # What the app submits: the text of each streamed chunk
+    return lambda: (chunk.text for chunk in model.generate_content(prompt, stream=True))
+
+
+def _wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.running and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_job_streams_text_and_reports_done():
+    runner = JobRunner()
+    finished = []
+    job = runner.submit("k", _stream(FakeModel(delay=0.02), "Summarize this"), on_done=finished.append)
+
+    seen = set()
+    while job.running:
+        seen.add(job.text)
+        time.sleep(0.005)
+    assert job.status == 'done'
+    assert job.text == "(offline reply) Summarize this "
+    # Partial text was visible before the reply was complete
+    assert any(text and text != job.text for text in seen)
+    assert finished == [job.text]
+
+
+def test_identical_requests_share_one_job():
+    runner = JobRunner()
+    calls = []
+
+    def stream():
+        calls.append(1)
+        return _stream(FakeModel(delay=0.01), "same prompt")()
+
+    job = runner.submit("k", stream)
+    assert runner.submit("k", stream) is job
+    _wait(job)
+    assert runner.submit("k", stream) is job  # finished jobs are reused too
+    assert runner.get("k") is job
+    assert len(calls) == 1
+    assert runner.submit("other", stream) is not job
+
+
+def test_cancel_stops_the_stream_and_allows_resubmit():
+    runner = JobRunner()
+    finished = []
+    job = runner.submit("k", _stream(FakeModel(delay=0.05), "a b c d e f g h"), on_done=finished.append)
+    time.sleep(0.08)
+    job.cancel()
+    text = job.text
+    time.sleep(0.15)
+    assert job.status == 'cancelled'
+    assert job.text == text
+    assert finished == []
+
+    again = runner.submit("k", _stream(FakeModel(delay=0), "a b"))
+    assert again is not job
+    _wait(again)
+    assert again.status == 'done'
+
+
+def test_timeout_gives_up_on_a_slow_stream():
+    runner = JobRunner(timeout=0.1)
+    finished = []
+    job = runner.submit("k", _stream(FakeModel(delay=0.06), "one two three four five"),
+                        on_done=finished.append)
+    _wait(job)
+    assert job.status == 'timeout'
+    time.sleep(0.4)
+    assert job.status == 'timeout'
+    assert finished == []
+
+
+def test_failed_job_reports_the_error():
+    def stream():
+        yield "partial "
+        raise RuntimeError("API key invalid")
+
+    job = JobRunner().submit("k", stream)
+    _wait(job)
+    assert job.status == 'error'
+    assert job.error == "API key invalid"
@@ -0,0 +1,83 @@
+import os
+import time
+
+from drafts import DraftJournal
+
+INTERVAL = 0.2
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_staged_drafts_are_coalesced(tmp_path):
+    journal = DraftJournal(str(tmp_path / "drafts"), interval=INTERVAL)
+    journal.stage("a", "Title", "t")
+    # The first draft of a note is written at once
+    _wait_for(lambda: journal.writes == 1)
+    assert journal.load("a")["content"] == "t"
+
+    # A burst of keystrokes within the interval becomes one trailing write
+    for i in range(50):
+        journal.stage("a", "Title", "typed " * i, version=3)
+    assert journal.writes == 1
+    assert journal.load("a")["content"] == "typed " * 49  # staged, not yet on disk
+    _wait_for(lambda: journal.writes == 2)
+    time.sleep(INTERVAL * 2)
+    assert journal.writes == 2
+    assert journal.error is None
+
+    draft = DraftJournal(journal.directory).load("a")
+    assert (draft["content"], draft["version"]) == ("typed " * 49, 3)
+
+
+def test_flush_writes_staged_drafts_now(tmp_path):
+    journal = DraftJournal(str(tmp_path / "drafts"), interval=60)
+    journal.stage("a", "A", "first")
+    _wait_for(lambda: journal.writes == 1)
+    journal.stage("a", "A", "second")
+    journal.flush()
+    assert journal.writes == 2
+    assert DraftJournal(journal.directory).load("a")["content"] == "second"
+
+
+def test_discard_drops_written_and_staged_drafts(tmp_path):
+    journal = DraftJournal(str(tmp_path / "drafts"), interval=INTERVAL)
+    journal.stage("a", "A", "written")
+    _wait_for(lambda: journal.writes == 1)
+    journal.stage("a", "A", "still staged")
+    journal.discard("a")
+
+    assert journal.load("a") is None
+    assert not os.path.exists(os.path.join(journal.directory, "a.json"))
+    # The staged text is not written once the interval is up
+    time.sleep(INTERVAL * 2)
+    assert journal.writes == 1
+    assert os.listdir(journal.directory) == []
+    journal.discard("never-staged")
+
+
+def test_recoverable_after_restart(tmp_path):
+    directory = str(tmp_path / "drafts")
+    journal = DraftJournal(directory, interval=INTERVAL)
+    journal.stage("old", "Old", "left behind", version=1)
+    time.sleep(0.01)
+    journal.stage("new", "New", "also left behind")
+    journal.flush()
+    # Drafts still being edited in this session are not offered
+    assert journal.recoverable() == []
+
+    # A restart (crashed server, closed tab) finds both, newest first
+    restarted = DraftJournal(directory, interval=INTERVAL)
+    assert [draft["id"] for draft in restarted.recoverable()] == ["new", "old"]
+    assert restarted.recoverable()[1]["version"] == 1
+
+    # Editing one again takes it out of the list; discarding removes it
+    restarted.stage("new", "New", "back in the editor")
+    assert [draft["id"] for draft in restarted.recoverable()] == ["old"]
+    restarted.discard("old")
+    restarted.flush()
+    assert DraftJournal(directory).recoverable()[0]["content"] == "back in the editor"
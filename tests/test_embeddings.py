@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from embeddings import HashingEmbedder, VectorIndex
+
+
+def _note(note_id, text):
+    return {"id": note_id, "title": note_id, "content": text}
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs fcntl locking")
+def test_second_process_index_does_not_share_rows(tmp_path):
+    path = str(tmp_path / "notes_vectors.npy")
+    first = VectorIndex(path, HashingEmbedder())
+    second = VectorIndex(path, HashingEmbedder())  # flock conflicts per open file, as across processes
+    assert not first.private and second.private
+
+    fillers = [_note(f"n{i}", f"filler text number {i}") for i in range(11)]
+    first.rebuild(fillers + [_note("fruit", "apples and pears")])
+    second.rebuild(fillers + [_note("cars", "engines and gearboxes")])
+
+    assert first.search("apples", k=1)[0][0] == "fruit"
+    assert first.search("apples", k=1)[0][1] > 0
+    assert second.search("engines", k=1)[0][0] == "cars"
+    assert "cars" not in {note_id for note_id, _ in first.search("engines", k=20)}
+
+    # Only the owner's rows persist; a restart reuses them
+    first.close()
+    second.close()
+    reopened = VectorIndex(path, HashingEmbedder())
+    assert not reopened.private
+    assert set(reopened._rows) == {note["id"] for note in fillers} | {"fruit"}
+    assert reopened.search("apples", k=1)[0][0] == "fruit"
+    reopened.close()
+
+
+def test_rows_grow_past_initial_capacity(tmp_path):
+    index = VectorIndex(str(tmp_path / "v.npy"), HashingEmbedder(dim=16), batch_size=5000)
+    notes = [_note(f"n{i}", f"word{i} shared") for i in range(1500)]
+    index.rebuild(notes)
+    assert len(index.matrix) >= 1500
+    assert index.search("word1499", k=1)[0][0] == "n1499"
+    index.close()
+
+
+def test_close_leaves_no_pending_flush(tmp_path):
+    # batch_size=1 sends the rebuild to the worker, which schedules a flush
+    index = VectorIndex(str(tmp_path / "v.npy"), HashingEmbedder(dim=16), batch_size=1)
+    index.rebuild([_note(f"n{i}", f"word{i}") for i in range(20)])
+    index.close()
+
+    assert index._flush_timer is None
+    index._schedule_flush()
+    assert index._flush_timer is None
+    reopened = VectorIndex(index.path, HashingEmbedder(dim=16))
+    assert set(reopened._rows) == {f"n{i}" for i in range(20)}
+    reopened.close()
@@ -0,0 +1,38 @@
+from export import export_notes
+from render import MarkdownRenderer
+
+
+def _notes(count):
+    return [{"id": f"n{i}", "title": f"Note {i}", "content": f"# Heading\n\nBody of note {i}.\n\n```\ncode\n```"}
+            for i in range(count)]
+
+
+def test_pdf_export_reuses_the_preview_cache():
+    renderer = MarkdownRenderer()
+    notes = _notes(3)
+    for note in notes:
+        renderer.render(note['content'])  # as the dashboard previews do
+    misses = renderer.stats()["misses"]
+
+    with export_notes(notes, "pdf", renderer=renderer) as out:
+        assert out.read(5) == b"%PDF-"
+    assert renderer.stats()["misses"] == misses
+
+
+def test_pooled_pdf_export_fills_the_cache():
+    renderer = MarkdownRenderer()
+    notes = _notes(250)
+    renderer.render(notes[0]['content'])
+    with export_notes(notes, "pdf", renderer=renderer, workers=2) as out:
+        assert out.read(5) == b"%PDF-"
+    assert renderer.cached_blocks(notes[-1]['content']) is not None
+
+
+def test_pdf_toc_takes_titles_that_look_like_markup():
+    notes = [{"id": "a", "title": "Using <b> for bold", "content": "x"},
+             {"id": "b", "title": "a <i> & <font", "content": "y"}]
+    with export_notes(notes, "pdf") as out:
+        pdf = out.read()
+    # Outline entries are plain PDF strings, shown as typed
+    assert b"/Title (Using <b> for bold)" in pdf
+    assert b"/Title (a <i> & <font)" in pdf
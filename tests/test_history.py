@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from history import KEEP_RECENT, NoteHistory, Revision, apply_delta, make_delta, retained
+
+START = datetime(2024, 1, 1)
+
+
+def _texts(count):
+    # Successive versions of a 30-line note, each changing one line
+    lines = [f"line {i} of the note\n" for i in range(30)]
+    texts = []
+    for i in range(count):
+        lines[i % len(lines)] = f"line {i % len(lines)} edited in save {i}\n"
+        texts.append(''.join(lines))
+    return texts
+
+
+def _record(history, note_id, texts, days_apart=1):
+    previous = None
+    for i, text in enumerate(texts):
+        note = {"id": note_id, "title": f"v{i}", "content": text,
+                "last_updated": (START + timedelta(days=i * days_apart)).isoformat()}
+        history.record(note, previous=previous)
+        previous = note
+    history.flush()
+    assert history.error is None
+
+
+def test_delta_round_trip():
+    old, new = _texts(2)
+    assert apply_delta(old, make_delta(old, new)) == new
+    assert apply_delta("", make_delta("", new)) == new
+    assert apply_delta(new, make_delta(new, "")) == ""
+
+
+def test_revisions_are_rebuilt_from_deltas(tmp_path):
+    path = str(tmp_path / "history.log")
+    history = NoteHistory(path, snapshot_every=4)
+    texts = _texts(11)
+    _record(history, "a", texts)
+
+    revisions = history.revisions("a")
+    assert [rev.number for rev in revisions] == list(range(1, 12))
+    # A full copy at least every snapshot_every revisions, deltas in between
+    assert [rev.full for rev in revisions] == [True, False, False, False] * 2 + [True, False, False]
+    for rev in revisions:
+        assert history.content("a", rev.number) == (f"v{rev.number - 1}", texts[rev.number - 1])
+
+    # Another process reads the same file
+    reader = NoteHistory(path, snapshot_every=4)
+    assert reader.content("a", 7)[1] == texts[6]
+    with pytest.raises(KeyError):
+        reader.content("a", 12)
+
+
+def test_unchanged_saves_add_no_revision(tmp_path):
+    history = NoteHistory(str(tmp_path / "history.log"))
+    text = _texts(1)[0]
+    for content in (text, text, text + "more\n"):
+        history.record({"id": "a", "title": "same", "content": content})
+    history.flush()
+    assert len(history.revisions("a")) == 2
+
+
+def test_retention_keeps_recent_and_daily_revisions():
+    now = START + timedelta(days=400)
+    revisions = [Revision(n, (START + timedelta(days=n * 10)).isoformat(), "", 0, 0, True)
+                 for n in range(40)]
+    keep = retained(revisions, now)
+    # Older than a year: only what the newest KEEP_RECENT hold on to
+    assert keep == set(range(4, 40))
+
+    # Past the newest KEEP_RECENT, a busy day keeps only its last save
+    busy = [Revision(n, (START + timedelta(minutes=n)).isoformat(), "", 0, 0, True)
+            for n in range(KEEP_RECENT + 5)]
+    assert retained(busy, START + timedelta(days=100)) == set(range(5, KEEP_RECENT + 5))
+
+    # Deleted notes keep only the last KEEP_DAYS
+    assert retained(revisions, now, alive=False) == {37, 38, 39}
+
+
+def test_prune_drops_old_revisions_and_restores_the_oldest_kept(tmp_path):
+    path = str(tmp_path / "history.log")
+    history = NoteHistory(path, exists=lambda note_id: note_id != "gone", snapshot_every=4)
+    texts = _texts(40)
+    _record(history, "a", texts, days_apart=10)
+    _record(history, "gone", texts[:3], days_apart=10)
+    size = (tmp_path / "history.log").stat().st_size
+
+    assert history.prune(now=START + timedelta(days=400)) == 4 + 3
+    assert (tmp_path / "history.log").stat().st_size < size
+    assert history.revisions("gone") == []
+
+    revisions = history.revisions("a")
+    assert [rev.number for rev in revisions] == list(range(5, 41))
+    # The oldest kept revision was a delta; it is now the full copy at the start
+    assert revisions[0].full
+    assert history.content("a", 5) == ("v4", texts[4])
+    for rev in revisions:
+        assert history.content("a", rev.number)[1] == texts[rev.number - 1]
+
+    # A fresh reader sees the pruned file, and new saves carry on from it
+    reader = NoteHistory(path, snapshot_every=4)
+    assert reader.content("a", 5)[1] == texts[4]
+    reader.record({"id": "a", "title": "v40", "content": texts[-1] + "appended\n"})
+    reader.flush()
+    assert reader.revisions("a")[-1].number == 41
+    assert history.content("a", 41)[1] == texts[-1] + "appended\n"
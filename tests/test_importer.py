@@ -0,0 +1,61 @@
+import io
+import itertools
+import json
+
+from importer import import_notes
+from note_store import NoteStore
+from search_index import SearchIndex, TagIndex
+
+
+def _store(tmp_path):
+    store = NoteStore(str(tmp_path / "notes.json"))
+    store.attach('search', SearchIndex(lookup=store.get))
+    store.attach('tags', TagIndex())
+    return store
+
+
+def _import(store, notes):
+    counter = itertools.count()
+    data = json.dumps({"notes": notes}).encode()
+    return import_notes(store, io.BytesIO(data), lambda: f"id{next(counter):04d}")
+
+
+def test_malformed_notes_are_skipped(tmp_path):
+    store = _store(tmp_path)
+    progress = _import(store, [
+        {"title": "ok one", "content": "a", "tags": ["x"]},
+        {"title": None, "content": "b"},
+        {"title": 42, "content": "c"},
+        {"title": "bad content", "content": ["c"]},
+        {"title": "bad tags", "content": "d", "tags": "x"},
+        {"title": "bad tag", "content": "e", "tags": ["x", 1]},
+        "not a note",
+        {"content": "no title"},
+    ])
+    assert (progress.imported, progress.skipped) == (2, 6)
+    assert sorted(note['title'] for note in store.notes.values()) == ["Untitled", "ok one"]
+
+    store.compact(background=False)
+    reopened = _store(tmp_path)  # indexes build over the snapshot
+    assert reopened.tag_counts() == {"x": 1}
+
+
+def test_importing_twice_adds_nothing(tmp_path):
+    store = _store(tmp_path)
+    notes = [{"title": f"note {i}", "content": f"body {i}"} for i in range(5)]
+    assert _import(store, notes).imported == 5
+    again = _import(store, notes + [{"title": "note 0", "content": "body 0"}])
+    assert (again.imported, again.skipped) == (0, 6)
+    assert len(store.notes) == 5
+
+
+def test_untitled_notes_are_not_imported_twice(tmp_path):
+    store = _store(tmp_path)
+    assert _import(store, [{"content": "no title here"}]).imported == 1
+    again = _import(store, [{"content": "no title here"}, {"title": "Untitled", "content": "no title here"}])
+    assert (again.imported, again.skipped) == (0, 2)
+    assert [note['title'] for note in store.notes.values()] == ["Untitled"]
+
+    # Also once the stored note is only known by its snapshot
+    store.compact(background=False)
+    assert _import(_store(tmp_path), [{"content": "no title here"}]).imported == 0
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from ids import is_id
+from note_store import NoteStore
+from search_index import SearchIndex
+
+
+def test_failed_batch_leaves_no_unlogged_notes(tmp_path):
+    path = str(tmp_path / "notes.json")
+    store = NoteStore(path)
+    store.attach('search', SearchIndex(lookup=store.get))
+    store.put({"id": "kept", "title": "kept", "content": "already saved"})
+
+    # The index rejects the second note halfway through the batch
+    with pytest.raises(AttributeError):
+        with store.batch():
+            store.put({"id": "first", "title": "ok one", "content": "a"})
+            store.put({"id": "second", "title": None, "content": "b"})
+
+    assert list(store.notes) == ["kept"]
+    assert store.search("ok") == set()
+    assert store.search("kept") == {"kept"}
+
+    # Nothing from the failed batch reaches the snapshot either
+    store.compact(background=False)
+    reopened = NoteStore(path)
+    reopened.attach('search', SearchIndex(lookup=reopened.get))
+    assert list(reopened.notes) == ["kept"]
+
+
+def test_batch_rolls_back_on_error_in_body(tmp_path):
+    store = NoteStore(str(tmp_path / "notes.json"))
+    store.put({"id": "a", "title": "a", "content": "before"})
+
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.put({"id": "a", "title": "a", "content": "after", "version": 1})
+            store.delete("a")
+            raise RuntimeError("interrupted")
+
+    assert store.notes["a"]["content"] == "before"
+    # The store still accepts writes afterwards
+    store.put({"id": "b", "title": "b", "content": ""})
+    assert set(NoteStore(store.path).notes) == {"a", "b"}
+
+
+def test_duplicate_legacy_ids_survive_migration(tmp_path):
+    path = tmp_path / "notes.json"
+    notes = [{"id": "abcd1234", "title": title, "content": title.lower(),
+              "timestamp": "2023-05-01T10:00:00"} for title in ("First", "Second", "Third")]
+    path.write_text(json.dumps({"notes": notes, "settings": {}}))
+
+    store = NoteStore(str(path))
+    assert sorted(note["title"] for note in store.notes.values()) == ["First", "Second", "Third"]
+    assert store.migrate_ids() == 1
+    assert all(is_id(note_id) for note_id in store.notes)
+    assert {note["legacy_id"] for note in store.notes.values()} == {"abcd1234"}
+
+    # Another process loading the same files derives the same ids
+    assert set(NoteStore(str(path)).notes) == set(store.notes)
+    store.compact(background=False)
+    reopened = NoteStore(str(path))
+    assert set(reopened.notes) == set(store.notes)
+    assert sorted(note["content"] for note in reopened.notes.values()) == ["first", "second", "third"]
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+
+import pytest
+
+from note_store import NoteConflict, NoteStore
+
+WRITERS = 6
+SAVES = 40
+COUNTER_ID = "01J0000000000000000COUNTER"
+
+
+def _writer(path, writer, saves, barrier):
+    # Each save adds one note of our own and bumps a shared counter note,
+    # retrying on conflict the way a session reopens and saves again. The
+    # bump also appends a line unique to this save: two sessions making the
+    # same edit merge cleanly by design, so only distinct edits must conflict
+    store = NoteStore(path, min_compact_bytes=4096)  # compacts often
+    barrier.wait()
+    for i in range(saves):
+        store.put({"id": f"w{writer}-{i}", "title": f"writer {writer}", "content": f"save {i}"})
+        while True:
+            store.refresh()
+            current = store.notes[COUNTER_ID]
+            note = dict(current)
+            note["count"] = current["count"] + 1
+            note["content"] = current["content"] + f"w{writer}-{i}\n"
+            try:
+                store.put(note, base=current)
+                break
+            except NoteConflict:
+                continue
+    store.wait_for_compaction()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fcntl locking and fork")
+def test_concurrent_writers_lose_no_updates(tmp_path):
+    path = str(tmp_path / "notes.json")
+    NoteStore(path).put({"id": COUNTER_ID, "title": "counter", "content": "", "count": 0})
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(WRITERS)
+    processes = [context.Process(target=_writer, args=(path, w, SAVES, barrier)) for w in range(WRITERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    store = NoteStore(path)
+    counter = store.notes[COUNTER_ID]
+    assert counter["count"] == WRITERS * SAVES
+    assert counter["version"] == WRITERS * SAVES + 1
+    bumps = counter["content"].splitlines()
+    assert sorted(bumps) == sorted(f"w{w}-{i}" for w in range(WRITERS) for i in range(SAVES))
+    for w in range(WRITERS):
+        for i in range(SAVES):
+            note = store.notes[f"w{w}-{i}"]
+            assert note["content"] == f"save {i}"
+            assert note["version"] == 1
+    assert len(store.notes) == WRITERS * SAVES + 1
+
+    # The same state after folding everything into the snapshot
+    store.compact(background=False)
+    reopened = NoteStore(path)
+    assert {i: dict(n) for i, n in reopened.notes.items()} == {i: dict(n) for i, n in store.notes.items()}
@@ -0,0 +1,44 @@
+import re
+
+import markdown
+import pytest
+
+from render import EXTENSIONS, MarkdownRenderer, split_blocks
+
+SAMPLES = [
+    "# Title\n\nA paragraph.\n\nAnother one.",
+    "- one\n- two\n\n- three\n\nafter the list",
+    "> quoted\n\n> still the same quote\n\nnot quoted",
+    "> a\nlazy continuation\n\n> b",
+    "<div>\n<p>a</p>\n\n<p>b</p>\n</div>\n\n*after*",
+    "<div class=\"box\">\n\n<div>\n\nnested\n\n</div>\n\n</div>\n\ntext",
+    "<!-- a comment\n\nover blank lines -->\n\ntext",
+    "<div>one line</div>\n\ntext",
+    "```python\ndef f():\n\n    return 1\n```\n\ntext",
+    "code:\n\n    indented\n\n    more\n\nend",
+]
+
+
+def _normalized(html):
+    # Blocks are joined with one newline; the whole document may use two
+    return re.sub(r'\n+', '\n', html).strip()
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_block_rendering_matches_whole_document(text):
+    whole = markdown.Markdown(extensions=EXTENSIONS).convert(text)
+    assert _normalized(MarkdownRenderer().render(text)) == _normalized(whole)
+
+
+def test_quote_and_html_blocks_stay_together():
+    assert split_blocks("> a\n\n> b\n\nc") == ["> a\n\n> b", "c"]
+    assert split_blocks("<div>\n\nx\n\n</div>\n\ny") == ["<div>\n\nx\n\n</div>", "y"]
+
+
+def test_unchanged_blocks_come_from_the_cache():
+    renderer = MarkdownRenderer()
+    renderer.render("one\n\ntwo\n\nthree")
+    renderer.render("one\n\ntwo\n\nthree, edited")
+    assert renderer.stats() == {"hits": 2, "misses": 4, "blocks": 4}
+    assert renderer.cached_blocks("one\n\ntwo") is not None
+    assert renderer.cached_blocks("one\n\nnew") is None
@@ -0,0 +1,74 @@
+from note_store import NoteStore
+from search_index import MAX_EXPANSIONS, SHORT_EXPANSIONS, SearchIndex
+
+
+def _index(notes):
+    index = SearchIndex()
+    index.rebuild([{"id": str(i), "title": title, "content": content}
+                   for i, (title, content) in enumerate(notes)])
+    return index
+
+
+def test_prefix_filter_matches_every_expansion():
+    # More "pro..." terms than a ranked prefix expands to, all commoner
+    # than the one in the note we are looking for
+    filler = [(f"pro{i:02d}", f"pro{i:02d} pro{i:02d}") for i in range(MAX_EXPANSIONS + 10)]
+    index = _index(filler * 2 + [("Prometheus setup", "scrape config")])
+    target = str(len(filler) * 2)
+
+    assert target in index.search("pro")
+    assert len(index.search("pro")) == len(filler) * 2 + 1
+    assert len(index.expand("pro")) == MAX_EXPANSIONS
+    assert target in {note_id for note_id, _ in index.rank("pro", k=200)}
+
+
+def test_short_query_matches_common_prefix_terms():
+    index = _index([("Prometheus setup", ""), ("Improve docs", ""), ("Grocery list", "eggs")])
+    assert index.search("pr") == {"0"}
+    assert index.search("p") == {"0"}
+    assert index.search("eg") == {"2"}
+    assert index.search("xq") == set()
+    # Earlier words are still exact terms
+    assert index.search("grocery li") == {"2"}
+    assert index.search("list gr") == {"2"}
+    assert index.search("gr list") == set()
+
+
+def test_short_prefix_is_bounded():
+    filler = [(f"pa{i:03d}", "") for i in range(MAX_EXPANSIONS * 3)]
+    index = _index(filler + [("pa000 again", "")])
+    assert set(index.matching_terms("pa")) == set(index.expand("pa"))
+    assert len(index.matching_terms("pa")) == SHORT_EXPANSIONS
+    # The most common term is always among them
+    assert "pa000" in index.matching_terms("pa")
+    assert len(index.matching_terms("pa0")) == 100
+    assert len(index.expand("pa0")) == MAX_EXPANSIONS
+    assert {note_id for note_id, _ in index.rank("pa", k=500)} == index.search("pa")
+
+
+def test_phrases_are_checked_against_the_stored_text(tmp_path):
+    store = NoteStore(str(tmp_path / "notes.json"))
+    store.attach('search', SearchIndex(lookup=store.get))
+    store.put({"id": "a", "title": "Release notes", "content": "The quick brown fox, jumps."})
+    store.put({"id": "b", "title": "Fox", "content": "brown and quick, a fox jumps"})
+    store.put({"id": "c", "title": "brown fox", "content": "jumps over"})
+
+    assert store.search('"quick brown fox"') == {"a"}
+    assert store.search('"fox jumps"') == {"a", "b"}
+    assert store.search('"brown fox"') == {"a", "c"}
+    # Never across the end of the title and the start of the content
+    assert store.search('"notes the"') == set()
+    assert store.search('"fox jumps over"') == set()
+
+    store.put({"id": "a", "title": "Release notes", "content": "rewritten", "version": 1})
+    assert store.search('"quick brown fox"') == set()
+
+
+def test_index_size_does_not_grow_with_repeated_text():
+    body = "alpha beta gamma delta, epsilon zeta. " * 3
+    short = _index([("title words", body)])
+    long = _index([("title words", body * 200)])
+    assert long.postings.keys() == short.postings.keys()
+    assert all(len(docs) == 1 for docs in long.postings.values())
+    assert long.postings["alpha"]["0"] == 600
+    assert long.rank("alpha")[0][0] == "0"
@@ -0,0 +1,83 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import serialization
+from note_store import NoteStore
+
+SAMPLE = {
+    "notes": [
+        {"id": "01HZY3N8Q4", "title": "Ünïcödé — ✨ 笔记", "content": "line\nbreak \"quoted\" \\ tab\t",
+         "tags": [], "pinned": False, "version": 2 ** 53, "ratio": 0.1, "extra": None},
+        {"id": "x", "title": "", "content": "", "tags": ["a", "b"], "nested": {"list": [[], {}]}},
+    ],
+    "settings": {"theme": "nebula", "locked": True},
+}
+
+
+@pytest.mark.parametrize("fmt", serialization.available_formats())
+def test_round_trip(fmt):
+    data = serialization.dumps(SAMPLE, fmt)
+    assert serialization.loads(data) == SAMPLE
+
+
+@pytest.mark.parametrize("fmt", serialization.available_formats())
+def test_format_is_detected_on_load(fmt, tmp_path):
+    assert serialization.detect(serialization.dumps(SAMPLE, fmt)) == fmt
+
+    # A store reads a snapshot in whatever format it finds
+    path = str(tmp_path / "notes.json")
+    store = NoteStore(path, snapshot_format=fmt)
+    store.put({"id": "a", "title": "t", "content": "c"})
+    store.compact(background=False)
+    with open(path, 'rb') as f:
+        assert serialization.detect(f.read()) == fmt
+    assert NoteStore(path).notes["a"]["content"] == "c"
+
+
+def test_legacy_plain_json_file(tmp_path):
+    # The original store: one indented JSON document written as text
+    path = tmp_path / "notes.json"
+    path.write_text(json.dumps({"notes": [{"id": "1", "title": "old", "content": "body", "tags": []}],
+                                "settings": {"theme": "aurora"}}, indent=2), encoding="utf-8")
+    assert serialization.detect(path.read_bytes()) == "json"
+    assert serialization.loads(path.read_text(encoding="utf-8"))["settings"] == {"theme": "aurora"}
+
+    store = NoteStore(str(path))
+    assert store.notes["1"]["title"] == "old"
+    assert store.settings["theme"] == "aurora"
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_open_stream(compression):
+    if compression == "zstd" and serialization.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    payload = serialization.json_dumps(SAMPLE) * 50
+    buffer = io.BytesIO()
+    if compression:
+        with serialization.compress_stream(buffer, compression) as stream:
+            stream.write(payload)
+    else:
+        buffer.write(payload)
+    buffer.seek(0)
+
+    stream = serialization.open_stream(buffer)
+    chunks = []
+    while chunk := stream.read(1000):
+        chunks.append(chunk)
+    assert b"".join(chunks) == payload
+
+
+def test_open_stream_reads_gzip_from_other_tools():
+    payload = b'{"notes": []}'
+    stream = serialization.open_stream(io.BytesIO(gzip.compress(payload)))
+    assert stream.read() == payload
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        serialization.dumps(SAMPLE, "json+lz4")
+    with pytest.raises(ValueError):
+        serialization.parse_format("yaml")